@@ -0,0 +1,226 @@
+"""
+ASGI Entry Point for the Analytics Server
+=========================================
+Serves analytics_server.py's routes from an event loop instead of sync
+gunicorn workers, so a worker is no longer tied up by one request at a time.
+
+- /data.json is answered on the event loop from memory: the payload variants
+  of every location are re-checked on disk by a background task, never by a
+  request. Negotiation, ETag/304 and headers are the Flask route's
+  (analytics_server._payload_response)
+- Its analytics records go to an AsyncAnalyticsWriter (asyncio queue, batches
+  written in a worker thread), so disk or SQLite stalls never hold up a
+  response
+- Every other route (/api/*, /health, /metrics, /debug/ip) runs the Flask app
+  in a bounded thread pool (ASGI_THREADS per worker); request bodies above
+  MAX_BODY_BYTES are refused
+- A slow client costs an idle coroutine, not a worker
+
+Run with uvicorn (pip install uvicorn):
+    uvicorn --app-dir backend --host 127.0.0.1 --port 8001 --workers 2 analytics_asgi:app
+
+How its concurrency limits compare to the gunicorn setup: see
+server_setup.md ("Optional: ASGI Mode").
+"""
+
+import asyncio
+import logging
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from werkzeug.wrappers import Request
+
+import analytics_server as server
+from analytics_writer import AsyncAnalyticsWriter
+from snapshot import SnapshotCache
+
+# Threads per worker for the routes that still run through Flask
+ASGI_THREADS = 8
+
+# Largest request body accepted (only POST /api/suggestions has one)
+MAX_BODY_BYTES = 64 * 1024
+
+log = logging.getLogger("analytics.asgi")
+
+# Replaces the thread-based writer, so /metrics reports this one
+_writer = server._writer = AsyncAnalyticsWriter(
+    server.ANALYTICS_DIR,
+    server._users_db,
+    resolve_country=server._lookup_country,
+    anonymize=server._salts.anonymize,
+    dedup=server._dedup,
+    rollups=server._rollups,
+    max_queue=server.WRITER_MAX_QUEUE,
+    batch_size=server.WRITER_BATCH_SIZE,
+    flush_interval=server.WRITER_FLUSH_INTERVAL,
+)
+
+_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi-flask")
+_payload_caches = [cache for variants in server._data_caches.values() for cache in variants.values()]
+_refresher = None
+_loaded = None   # future of the first payload load
+
+
+# --- Payload refresh (off the request path) ---
+
+def _refresh_payloads():
+    for cache in _payload_caches:
+        try:
+            cache.refresh()
+        except OSError as e:
+            log.warning("Error reloading %s: %s", cache.path, e)
+
+
+async def _refresh_loop():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(server.DATA_CHECK_INTERVAL)
+        await loop.run_in_executor(_executor, _refresh_payloads)
+
+
+async def _start():
+    """Load every payload once (before the first request is answered) and start the refresh task."""
+    global _refresher, _loaded
+    if _loaded is None:
+        loop = asyncio.get_running_loop()
+        _loaded = loop.run_in_executor(_executor, _refresh_payloads)
+        _refresher = loop.create_task(_refresh_loop())
+    await _loaded
+
+
+async def _stop():
+    if _refresher is not None:
+        _refresher.cancel()
+    await _writer.aclose()
+    _executor.shutdown(wait=False)
+    server._metrics.flush()
+
+
+# --- ASGI <-> WSGI ---
+
+def _environ(scope, body: bytes) -> dict:
+    """The WSGI environ (PEP 3333) of an ASGI http request."""
+    host, port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": host,
+        "SERVER_PORT": str(port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("",))[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _call_flask(environ):
+    """Run one request through the Flask app (in a pool thread): (status, headers, body)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    chunks = server.app(environ, start_response)
+    try:
+        body = b"".join(chunks)
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+    return started["status"], started["headers"], body
+
+
+async def _read_body(receive):
+    """The request body, or None if it's larger than MAX_BODY_BYTES."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body"):
+            break
+    return bytes(body)
+
+
+async def _send_response(send, status, headers, body=b""):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+# --- Routes ---
+
+async def _serve_data(scope, send):
+    """/data.json on the event loop: payload from memory, analytics to the async writer."""
+    start = time.perf_counter()
+    req = Request(_environ(scope, b""))
+    try:
+        server._log_analytics(server._get_client_ip(req), req.args.get("uid"))
+    except Exception as e:
+        # Never let analytics failures break data serving
+        log.warning("Error logging: %s", e)
+
+    response = server._payload_response(req, load=SnapshotCache.peek)
+    body = b"" if scope["method"] == "HEAD" else response.get_data()
+    await _send_response(send, response.status_code, response.headers.to_wsgi_list(), body)
+    server._http_latency.observe(time.perf_counter() - start, "/data.json")
+    server._http_requests.inc("/data.json", scope["method"], response.status_code)
+
+
+async def _serve_flask(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        await _send_response(send, 413, [("Content-Type", "text/plain")], b"Request body too large")
+        return
+    loop = asyncio.get_running_loop()
+    status, headers, body = await loop.run_in_executor(_executor, _call_flask, _environ(scope, body))
+    await _send_response(send, status, headers, body)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await _start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await _stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+    if _loaded is None or not _loaded.done():
+        # First request (or a server that doesn't send lifespan events)
+        await _start()
+    if scope["path"] == "/data.json" and scope["method"] in ("GET", "HEAD"):
+        await _serve_data(scope, send)
+    else:
+        await _serve_flask(scope, receive, send)
@@ -0,0 +1,381 @@
+"""
+Analytics Log Files
+===================
+One reader API for the daily analytics logs, in either on-disk format:
+
+- YYYY-MM-DD.jsonl — one {"ts", "uid", "country"} JSON object per line, appended
+  by the analytics writer during the day
+- YYYY-MM-DD.jsonl.gz — a closed JSONL day, gzipped by the archive job below
+  (streamed back line by line; a late write to an archived day is appended
+  to it as another gzip member on the next run)
+- YYYY-MM-DD.bin — compact columnar format for closed days, produced by the
+  converter below (typically 5-10x smaller and much faster to scan)
+
+Binary layout (little-endian):
+    header   magic b"GRAL", u8 version, 3 reserved bytes,
+             u32 n_records, u32 n_uids, u32 n_countries          (20 bytes)
+    columns  u32 ts[n_records]
+             u32 uid_index[n_records]
+             u16 country_index[n_records]
+    dicts    n_uids + n_countries strings, each u16 length + UTF-8 bytes
+
+Anonymous users (requests without a device uid) are logged as a truncated
+SHA-256 of IP + a random per-day salt, kept in .salt_YYYY-MM-DD (DailySalts).
+A salt is only needed while its day can still receive records, so the
+archive job deletes the salts of closed days.
+
+Usage:
+    python analytics_log.py convert              # Convert closed days to .bin
+    python analytics_log.py convert --remove     # ...and delete the .jsonl files
+    python analytics_log.py archive              # Gzip closed days, delete their salts
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from snapshot import atomic_write_bytes, file_lock
+
+ANALYTICS_DIR = Path(__file__).parent.resolve() / "analytics"
+
+MAGIC = b"GRAL"
+VERSION = 1
+_HEADER = struct.Struct("<4sB3xIII")
+_U32 = "I" if array("I").itemsize == 4 else "L"
+_U16 = "H"
+
+# Held while day files are archived; the same lock analytics_report.py holds,
+# so a report never sees a day file renamed under it
+ARCHIVE_LOCK = ".report.lock"
+
+# JSONL files are scanned backwards in blocks of this size for their last
+# complete line
+_TAIL_BLOCK = 64 * 1024
+
+
+# --- Anonymous user IDs ---
+
+def hash_user(ip: str, daily_salt: str) -> str:
+    """Create a truncated SHA-256 hash of IP + daily salt."""
+    raw = f"{ip}:{daily_salt}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+class DailySalts:
+    """The per-day salts in `directory`/.salt_YYYY-MM-DD, created on first use (last day cached)."""
+
+    def __init__(self, directory: Path = ANALYTICS_DIR):
+        self.directory = Path(directory)
+        self._cache = {}
+
+    def get(self, date_str: str) -> str:
+        salt = self._cache.get(date_str)
+        if salt is not None:
+            return salt
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        salt_file = self.directory / f".salt_{date_str}"
+        if salt_file.exists():
+            salt = salt_file.read_text().strip()
+        else:
+            salt = secrets.token_hex(16)
+            salt_file.write_text(salt)
+
+        self._cache.clear()  # only one day's salt is needed at a time
+        self._cache[date_str] = salt
+        return salt
+
+    def anonymize(self, ip: str, ts) -> str:
+        """The hashed user ID of `ip` on the (UTC) day of `ts`."""
+        day = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+        return hash_user(ip, self.get(day))
+
+
+# --- Listing ---
+
+def _day_of(path: Path) -> str:
+    return path.name.split(".", 1)[0]
+
+
+def day_files(directory: Path = ANALYTICS_DIR) -> list:
+    """
+    Return [(date_str, path)] sorted by date, one file per day.
+
+    .bin is preferred over .jsonl.gz, which is preferred over .jsonl (a
+    .jsonl next to an archive only holds late writes until the next archive
+    run).
+    """
+    directory = Path(directory)
+    days = {}
+    for pattern in ("*.jsonl", "*.jsonl.gz", "*.bin"):
+        for path in directory.glob(pattern):
+            days[_day_of(path)] = path
+    return sorted(days.items())
+
+
+# --- Reading ---
+
+def _iter_jsonl(lines):
+    for line in lines:
+        line = line.decode("utf-8", errors="replace").strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        yield entry.get("ts", 0), entry.get("uid", ""), entry.get("country", "XX")
+
+
+def _column(data: bytes, typecode: str, start: int, count: int):
+    col = array(typecode)
+    col.frombytes(data[start:start + count * col.itemsize])
+    if sys.byteorder == "big":
+        col.byteswap()
+    return col, start + count * col.itemsize
+
+
+def _read_strings(data: bytes, pos: int, count: int):
+    out = []
+    for _ in range(count):
+        (length,) = struct.unpack_from("<H", data, pos)
+        pos += 2
+        out.append(data[pos:pos + length].decode("utf-8"))
+        pos += length
+    return out, pos
+
+
+def read_binary(data: bytes):
+    """Decode a .bin log into (ts column, uid_index column, country_index column, uids, countries)."""
+    magic, version, n, n_uids, n_countries = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"not an analytics log (magic={magic!r}, version={version})")
+    pos = _HEADER.size
+    ts, pos = _column(data, _U32, pos, n)
+    uid_idx, pos = _column(data, _U32, pos, n)
+    country_idx, pos = _column(data, _U16, pos, n)
+    uids, pos = _read_strings(data, pos, n_uids)
+    countries, pos = _read_strings(data, pos, n_countries)
+    return ts, uid_idx, country_idx, uids, countries
+
+
+def _iter_binary(data: bytes):
+    ts, uid_idx, country_idx, uids, countries = read_binary(data)
+    for t, u, c in zip(ts, uid_idx, country_idx):
+        yield t, uids[u], countries[c]
+
+
+def _iter_jsonl_file(path: Path, start: int, end: int):
+    """Stream the JSONL lines between byte offsets `start` and `end` (a line boundary)."""
+    def lines(f, remaining):
+        for line in f:
+            if remaining <= 0:
+                break
+            remaining -= len(line)
+            yield line
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        yield from _iter_jsonl(lines(f, end - start))
+
+
+def _iter_gzip(path: Path):
+    with gzip.open(path, "rb") as f:
+        yield from _iter_jsonl(f)
+
+
+def _complete_end(f, offset: int) -> int:
+    """Offset just past the last newline at or after `offset` (`offset` if there is none)."""
+    pos = f.seek(0, os.SEEK_END)
+    while pos > offset:
+        start = max(offset, pos - _TAIL_BLOCK)
+        f.seek(start)
+        newline = f.read(pos - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        pos = start
+    return offset
+
+
+def scan(path: Path, offset: int = 0):
+    """
+    Read the log entries of one day file, starting at byte `offset`.
+
+    Returns (entries, end_offset): `entries` iterates (ts, uid, country) tuples
+    and `end_offset` is where the next incremental scan should start. For
+    JSONL only complete lines are consumed; binary files and gzip archives are
+    immutable and always read as a whole (`end_offset` is their size on disk).
+    JSONL and gzip entries are streamed from the file as they're iterated.
+    """
+    path = Path(path)
+    if path.suffix == ".gz":
+        size = path.stat().st_size
+        if offset >= size:
+            return iter(()), size
+        return _iter_gzip(path), size
+
+    with open(path, "rb") as f:
+        if path.suffix == ".bin":
+            data = f.read()
+            if offset >= len(data):
+                return iter(()), len(data)
+            return _iter_binary(data), len(data)
+
+        # A partially written last line is left for the next scan
+        end = _complete_end(f, offset)
+    if end <= offset:
+        return iter(()), offset
+    return _iter_jsonl_file(path, offset, end), end
+
+
+def iter_entries(path: Path):
+    """Iterate all (ts, uid, country) entries of one day file."""
+    entries, _ = scan(path)
+    return entries
+
+
+# --- Writing / converting ---
+
+def encode_binary(entries) -> bytes:
+    """Encode (ts, uid, country) entries into the columnar .bin format."""
+    ts_col = array(_U32)
+    uid_col = array(_U32)
+    country_col = array(_U16)
+    uid_index = {}
+    country_index = {}
+
+    for ts, uid, country in entries:
+        ts_col.append(int(ts or 0))
+        uid_col.append(uid_index.setdefault(uid or "", len(uid_index)))
+        country_col.append(country_index.setdefault(country or "XX", len(country_index)))
+
+    if sys.byteorder == "big":
+        for col in (ts_col, uid_col, country_col):
+            col.byteswap()
+
+    parts = [
+        _HEADER.pack(MAGIC, VERSION, len(ts_col), len(uid_index), len(country_index)),
+        ts_col.tobytes(),
+        uid_col.tobytes(),
+        country_col.tobytes(),
+    ]
+    for value in list(uid_index) + list(country_index):
+        raw = value.encode("utf-8")
+        parts.append(struct.pack("<H", len(raw)))
+        parts.append(raw)
+    return b"".join(parts)
+
+
+def convert_jsonl(path: Path, remove_source: bool = False) -> Path:
+    """Convert one .jsonl day file to .bin (atomically) and return the new path."""
+    path = Path(path)
+    target = path.with_suffix(".bin")
+    atomic_write_bytes(target, encode_binary(iter_entries(path)))
+    if remove_source:
+        path.unlink()
+    return target
+
+
+def convert_closed_days(directory: Path = ANALYTICS_DIR, remove_source: bool = False) -> list:
+    """Convert every .jsonl day file older than yesterday (UTC); returns the converted paths."""
+    # Yesterday may still receive a few late batched writes, so leave it alone too
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    converted = []
+    for path in sorted(Path(directory).glob("*.jsonl")):
+        if path.stem >= cutoff:
+            continue
+        source_size = path.stat().st_size
+        target = convert_jsonl(path, remove_source=remove_source)
+        print(f"  {path.name} ({source_size} B) → {target.name} ({target.stat().st_size} B)")
+        converted.append(target)
+    return converted
+
+
+def archive_jsonl(path: Path) -> Path:
+    """
+    Gzip one .jsonl day file into .jsonl.gz (atomically), delete it and return the archive.
+
+    If the archive already exists (late writes after an earlier run), the file
+    is appended to it as a new gzip member.
+    """
+    path = Path(path)
+    target = path.with_name(path.name + ".gz")
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{target.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as out:
+            if target.exists():
+                with open(target, "rb") as archived:
+                    shutil.copyfileobj(archived, out)
+            with open(path, "rb") as src, gzip.GzipFile(fileobj=out, mode="wb", mtime=0) as gz:
+                shutil.copyfileobj(src, gz)
+            out.flush()
+            os.fsync(out.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    path.unlink()
+    return target
+
+
+def archive_closed_days(directory: Path = ANALYTICS_DIR) -> dict:
+    """
+    Gzip every .jsonl day file older than yesterday (UTC) and delete the salts of those days.
+
+    Days already converted to .bin keep their .bin; only the .jsonl is
+    archived. Returns {"archived": [paths], "salts_removed": count}.
+    """
+    directory = Path(directory)
+    # Yesterday may still receive a few late batched writes, so leave it alone too
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=1)).strftime("%Y-%m-%d")
+    archived = []
+    salts_removed = 0
+    with file_lock(directory / ARCHIVE_LOCK):
+        for path in sorted(directory.glob("*.jsonl")):
+            if path.stem >= cutoff:
+                continue
+            source_size = path.stat().st_size
+            target = archive_jsonl(path)
+            print(f"  {path.name} ({source_size} B) → {target.name} ({target.stat().st_size} B)")
+            archived.append(target)
+
+        for salt_file in directory.glob(".salt_*"):
+            if salt_file.name[len(".salt_"):] < cutoff:
+                salt_file.unlink()
+                salts_removed += 1
+    return {"archived": archived, "salts_removed": salts_removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analytics log file tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="Convert closed JSONL days to the binary format")
+    convert.add_argument("--dir", type=Path, default=ANALYTICS_DIR,
+                         help="Analytics directory (default: backend/analytics)")
+    convert.add_argument("--remove", action="store_true",
+                         help="Delete the .jsonl files after converting")
+    archive = sub.add_parser("archive", help="Gzip closed JSONL days and delete expired salts")
+    archive.add_argument("--dir", type=Path, default=ANALYTICS_DIR,
+                         help="Analytics directory (default: backend/analytics)")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        done = convert_closed_days(args.dir, remove_source=args.remove)
+        print(f"✓ Converted {len(done)} day files")
+    elif args.command == "archive":
+        done = archive_closed_days(args.dir)
+        print(f"✓ Archived {len(done['archived'])} day files, removed {done['salts_removed']} salts")
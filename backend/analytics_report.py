@@ -1,13 +1,29 @@
 """
 Analytics Report Generator
 ===========================
-Reads daily JSONL log files from analytics/ and generates a summary.
+Reads daily log files from analytics/ (JSONL or compact .bin, see analytics_log.py)
+and generates a summary.
 
 Output: analytics/summary.json with daily unique user counts and country distributions.
 
+Aggregation is incremental: analytics/report_state.json keeps, per day that is
+still open, the byte offset read so far plus the partial state (uid set and
+country counts), so each run only parses lines appended since the previous run.
+Once a day is over (plus a grace period) and fully read, it is frozen: its uid
+set is dropped and its final counts are written once to
+analytics/report_days/YYYY-MM-DD.json, which later runs never read again (its
+counts are already in summary.json). A run therefore only loads and rewrites the
+open days, whatever the length of the history.
+
+Each day also gets HyperLogLog sketches (all users and per country), kept with
+the day's state. rolling_uniques() merges the sketches of the days in each window
+to answer 7/30/90-day unique counts in constant memory; exact=True re-scans the
+logs for validation.
+
 Usage:
     python analytics_report.py              # Process all days
     python analytics_report.py --days 7     # Process last 7 days only
+    python analytics_report.py --rolling 7,30 --exact   # Exact rolling uniques (slow)
 
 Add to cron for daily summary updates:
     0 3 * * * /home/ubuntu/garmin-rowing/venv/bin/python /home/ubuntu/garmin-rowing/backend/analytics_report.py --days 30
@@ -15,58 +31,259 @@ Add to cron for daily summary updates:
 
 import argparse
 import json
+import logging
 from collections import defaultdict
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from analytics_log import day_files, iter_entries, scan
+from hyperloglog import HyperLogLog
+from snapshot import atomic_write_bytes, file_lock
+
 ANALYTICS_DIR = Path(__file__).parent.resolve() / "analytics"
 SUMMARY_FILE = ANALYTICS_DIR / "summary.json"
+STATE_FILE = ANALYTICS_DIR / "report_state.json"
+DAYS_DIR = ANALYTICS_DIR / "report_days"
+# Sketches of all days, before frozen days got their own files (migrated on the next run)
+LEGACY_SKETCH_FILE = ANALYTICS_DIR / "sketches.json"
+LOCK_FILE = ANALYTICS_DIR / ".report.lock"
+
+log = logging.getLogger("analytics.report")
+
+# A day is frozen this long after it ended (UTC), so late batched writes still count
+FREEZE_GRACE = timedelta(hours=1)
+
+
+def _new_day_state(file_name: str = "") -> dict:
+    return {"file": file_name, "offset": 0, "frozen": False,
+            "uids": set(), "countries": defaultdict(int),
+            "sketch": HyperLogLog(), "country_sketches": {}}
+
+
+def _add_to_sketches(day_state: dict, uid: str, country: str):
+    day_state["sketch"].add(uid)
+    sketch = day_state["country_sketches"].get(country)
+    if sketch is None:
+        sketch = day_state["country_sketches"][country] = HyperLogLog()
+    sketch.add(uid)
+
+
+def _consume(log_file: Path, day_state: dict) -> int:
+    """Parse the entries appended to `log_file` since `day_state['offset']`.
+
+    Updates the day state in place and returns the number of entries read.
+    """
+    # Only complete lines are consumed; a partially written last line is picked up next run
+    entries, day_state["offset"] = scan(log_file, day_state["offset"])
+
+    unique_users = day_state["uids"]
+    countries = day_state["countries"]
+    count = 0
+    for _, uid, country in entries:
+        count += 1
+        if uid and uid not in unique_users:
+            unique_users.add(uid)
+            countries[country] += 1
+            _add_to_sketches(day_state, uid, country)
+    return count
+
+
+def _day_stats(day_state: dict) -> dict:
+    unique_users = day_state.get("unique_users", len(day_state.get("uids", ())))
+    return {
+        "unique_users": unique_users,
+        "countries": dict(sorted(day_state["countries"].items(), key=lambda x: -x[1])),
+    }
 
 
 def parse_day(log_file: Path) -> dict:
-    """Parse a single day's JSONL log file and return summary stats."""
-    unique_users = set()
-    countries = defaultdict(int)
-
-    with open(log_file, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-                uid = entry.get("uid", "")
-                country = entry.get("country", "XX")
-
-                if uid and uid not in unique_users:
-                    unique_users.add(uid)
-                    countries[country] += 1
-            except json.JSONDecodeError:
-                continue
+    """Parse a single day's log file and return summary stats."""
+    day_state = _new_day_state()
+    _consume(log_file, day_state)
+    return _day_stats(day_state)
+
 
+def _sketches_to_json(day: dict) -> dict:
     return {
-        "unique_users": len(unique_users),
-        "countries": dict(sorted(countries.items(), key=lambda x: -x[1])),
+        "all": day["sketch"].to_str(),
+        "countries": {c: h.to_str() for c, h in day["country_sketches"].items()},
+    }
+
+
+def _sketches_from_json(raw: dict):
+    return (
+        HyperLogLog.from_str(raw["all"]),
+        {c: HyperLogLog.from_str(v) for c, v in raw["countries"].items()},
+    )
+
+
+def _day_to_json(day: dict) -> dict:
+    out = {
+        "file": day.get("file", ""),
+        "offset": day["offset"],
+        "frozen": day["frozen"],
+        "countries": dict(day["countries"]),
     }
+    if day["frozen"]:
+        out["unique_users"] = day["unique_users"]
+    else:
+        out["uids"] = sorted(day["uids"])
+    if "sketch" in day:
+        out["sketches"] = _sketches_to_json(day)
+    return out
+
+
+def _day_from_json(raw: dict) -> dict:
+    day = dict(raw)
+    day["countries"] = defaultdict(int, day.get("countries", {}))
+    if not day.get("frozen"):
+        day["uids"] = set(day.get("uids", ()))
+    if "sketches" in day:
+        day["sketch"], day["country_sketches"] = _sketches_from_json(day.pop("sketches"))
+    return day
+
+
+def _load_state() -> dict:
+    """Load the checkpoint of the open days: {date_str: day_state}.
+
+    A version 1 checkpoint (every day, sketches in sketches.json) is returned
+    whole, frozen days included; the next report run moves those out.
+    """
+    if not STATE_FILE.exists():
+        return {}
+    try:
+        with open(STATE_FILE, "r") as f:
+            raw = json.load(f)
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+    legacy = _load_legacy_sketches() if raw.get("version", 1) == 1 else {}
+    state = {}
+    for date_str, day in raw.get("days", {}).items():
+        day = _day_from_json(day)
+        if date_str in legacy:
+            day["sketch"], day["country_sketches"] = legacy[date_str]
+        state[date_str] = day
+    return state
+
 
+def _load_legacy_sketches() -> dict:
+    """{date_str: (HyperLogLog, {country: HyperLogLog})} from a version 1 sketches.json."""
+    if not LEGACY_SKETCH_FILE.exists():
+        return {}
+    try:
+        with open(LEGACY_SKETCH_FILE, "r") as f:
+            raw = json.load(f)
+        return {date_str: _sketches_from_json(day) for date_str, day in raw.items()}
+    except (json.JSONDecodeError, IOError, KeyError, ValueError):
+        return {}
 
-def generate_report(max_days: int = None):
-    """Generate summary.json from all (or recent) JSONL log files."""
+
+def _save_state(state: dict):
+    days = {date_str: _day_to_json(day) for date_str, day in state.items()}
+    atomic_write_bytes(STATE_FILE, json.dumps({"version": 2, "days": days}).encode("utf-8"))
+    if LEGACY_SKETCH_FILE.exists():
+        LEGACY_SKETCH_FILE.unlink()
+
+
+def _frozen_days() -> set:
+    """Dates that have a frozen day file (listed, not read)."""
+    if not DAYS_DIR.exists():
+        return set()
+    return {path.stem for path in DAYS_DIR.glob("*.json")}
+
+
+def _load_frozen_day(date_str: str):
+    """The state of one frozen day, or None if it has no (readable) day file."""
+    try:
+        with open(DAYS_DIR / f"{date_str}.json", "r") as f:
+            return _day_from_json(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, ValueError):
+        return None
+
+
+def _save_frozen_day(date_str: str, day: dict):
+    atomic_write_bytes(DAYS_DIR / f"{date_str}.json", json.dumps(_day_to_json(day)).encode("utf-8"))
+
+
+def _load_sketches(dates) -> dict:
+    """{date_str: (HyperLogLog, {country: HyperLogLog})} for the given dates (open or frozen)."""
+    state = _load_state()
+    frozen = _frozen_days()
+    sketches = {}
+    for date_str in dates:
+        day = state.get(date_str)
+        if day is None and date_str in frozen:
+            day = _load_frozen_day(date_str)
+        if day is not None and "sketch" in day:
+            sketches[date_str] = (day["sketch"], day["country_sketches"])
+    return sketches
+
+
+def _update_day(date_str: str, log_file: Path, day_state: dict, now: datetime) -> int:
+    """Bring one day's state up to date with its log file; freeze it once the day is over."""
+    if "sketch" not in day_state:
+        # Checkpoint predates sketches: rebuild them (frozen days) or re-read the day
+        if day_state["frozen"]:
+            day_state["sketch"], day_state["country_sketches"] = HyperLogLog(), {}
+            seen = set()
+            for _, uid, country in iter_entries(log_file):
+                if uid and uid not in seen:
+                    seen.add(uid)
+                    _add_to_sketches(day_state, uid, country)
+        else:
+            day_state.update(_new_day_state(log_file.name))
+
+    if day_state["frozen"]:
+        return 0
+
+    size = log_file.stat().st_size
+    if size < day_state["offset"] or day_state.get("file") != log_file.name:
+        # File was truncated, rewritten or converted to another format: start over
+        day_state.update(_new_day_state(log_file.name))
+
+    new_lines = _consume(log_file, day_state) if size > day_state["offset"] else 0
+
+    day_end = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+    if now >= day_end + FREEZE_GRACE and day_state["offset"] >= size:
+        day_state["unique_users"] = len(day_state["uids"])
+        day_state["frozen"] = True
+        del day_state["uids"]
+    return new_lines
+
+
+def generate_report(max_days: int = None, blocking: bool = True, log_level: int = logging.INFO) -> bool:
+    """
+    Generate summary.json from all (or recent) daily log files.
+
+    Only one process regenerates at a time (flock on LOCK_FILE). With
+    blocking=False, returns False straight away if another process is already
+    regenerating; otherwise returns True. Progress is logged at `log_level`
+    (the server, which refreshes every minute, passes DEBUG).
+    """
     if not ANALYTICS_DIR.exists():
-        print("No analytics directory found. Nothing to report.")
-        return
+        log.log(log_level, "No analytics directory found. Nothing to report.")
+        return True
+
+    with file_lock(LOCK_FILE, blocking=blocking) as acquired:
+        if not acquired:
+            return False
+        _generate_report(max_days, log_level)
+    return True
 
-    # Find all JSONL files
-    log_files = sorted(ANALYTICS_DIR.glob("*.jsonl"), reverse=True)
+
+def _generate_report(max_days: int = None, log_level: int = logging.INFO):
+    # Find all day files (newest first)
+    log_files = day_files(ANALYTICS_DIR)[::-1]
 
     if not log_files:
-        print("No log files found. Nothing to report.")
+        log.log(log_level, "No log files found. Nothing to report.")
         return
 
     # Filter to recent days if specified
     if max_days:
         cutoff = (datetime.now(timezone.utc) - timedelta(days=max_days)).strftime("%Y-%m-%d")
-        log_files = [f for f in log_files if f.stem >= cutoff]
+        log_files = [(d, f) for d, f in log_files if d >= cutoff]
 
     # Load existing summary to preserve older data
     summary = {}
@@ -77,38 +294,122 @@ def generate_report(max_days: int = None):
         except (json.JSONDecodeError, IOError):
             summary = {}
 
-    # Process each day
-    for log_file in log_files:
-        date_str = log_file.stem  # e.g., "2026-02-25"
-        print(f"Processing {date_str}...")
-        day_stats = parse_day(log_file)
+    # Process each day, parsing only what was appended since the last run
+    state = _load_state()
+    frozen = _frozen_days()
+    now = datetime.now(timezone.utc)
+    for date_str, log_file in log_files:  # e.g., "2026-02-25"
+        if date_str in frozen and date_str not in state:
+            if date_str in summary:
+                continue  # final counts already in summary.json
+            day_state = _load_frozen_day(date_str)
+            if day_state is not None:
+                summary[date_str] = _day_stats(day_state)
+                continue
+        day_state = state.setdefault(date_str, _new_day_state(log_file.name))
+        new_lines = _update_day(date_str, log_file, day_state, now)
+        day_stats = _day_stats(day_state)
         summary[date_str] = day_stats
-        print(f"  → {day_stats['unique_users']} unique users, "
-              f"{len(day_stats['countries'])} countries")
+        if new_lines:
+            log.log(log_level, "Processed %s: %d new entries → %d unique users, %d countries",
+                    date_str, new_lines, day_stats["unique_users"], len(day_stats["countries"]))
+
+    # Frozen days (including those of a version 1 checkpoint) move to their own files
+    for date_str in [d for d, day in state.items() if day["frozen"]]:
+        _save_frozen_day(date_str, state.pop(date_str))
+    _save_state(state)
 
     # Sort by date (newest first) and save
     summary = dict(sorted(summary.items(), reverse=True))
 
-    with open(SUMMARY_FILE, "w") as f:
-        json.dump(summary, f, indent=2)
+    atomic_write_bytes(SUMMARY_FILE, json.dumps(summary, indent=2).encode("utf-8"))
+
+    log.log(log_level, "✓ Summary saved to %s (%d days)", SUMMARY_FILE, len(summary))
 
-    print(f"\n✓ Summary saved to {SUMMARY_FILE}")
-    print(f"  Total days: {len(summary)}")
+    # A quick overview of the most recent days
+    if log.isEnabledFor(log_level):
+        for date_str in list(summary.keys())[:7]:
+            stats = summary[date_str]
+            top_countries = ", ".join(
+                f"{c}: {n}" for c, n in list(stats["countries"].items())[:3]
+            )
+            log.log(log_level, "  %s: %d users (%s)", date_str, stats["unique_users"], top_countries)
 
-    # Print a quick overview of the most recent days
-    print("\nRecent activity:")
-    for date_str in list(summary.keys())[:7]:
-        stats = summary[date_str]
-        top_countries = ", ".join(
-            f"{c}: {n}" for c, n in list(stats["countries"].items())[:3]
-        )
-        print(f"  {date_str}: {stats['unique_users']} users ({top_countries})")
+
+def rolling_uniques(windows=(7, 30, 90), exact: bool = False, end_date: str = None) -> dict:
+    """
+    Unique users over the last N days (ending at `end_date`, default today UTC) per window.
+
+    By default merges the persisted daily HyperLogLog sketches (estimates, constant
+    memory); exact=True unions the uid sets from the log files instead.
+    """
+    if end_date is None:
+        end_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+
+    def window_days(n):
+        return {(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(n)}
+
+    result = {"end": end_date, "mode": "exact" if exact else "hll", "windows": {}}
+
+    if exact:
+        files = dict(day_files(ANALYTICS_DIR)) if ANALYTICS_DIR.exists() else {}
+        for n in windows:
+            # Same semantics as the sketches: a user counts for every country it
+            # was first seen from on some day of the window
+            unique_users = set()
+            countries = defaultdict(set)
+            for date_str in sorted(window_days(n)):
+                if date_str not in files:
+                    continue
+                seen_today = set()
+                for _, uid, country in iter_entries(files[date_str]):
+                    if uid and uid not in seen_today:
+                        seen_today.add(uid)
+                        countries[country].add(uid)
+                unique_users |= seen_today
+            counts = {c: len(uids) for c, uids in countries.items()}
+            result["windows"][str(n)] = {
+                "unique_users": len(unique_users),
+                "countries": dict(sorted(counts.items(), key=lambda x: -x[1])),
+            }
+        return result
+
+    sketches = _load_sketches(set().union(*(window_days(n) for n in windows)))
+    for n in windows:
+        total = HyperLogLog()
+        by_country = {}
+        for date_str in window_days(n):
+            if date_str not in sketches:
+                continue
+            day_sketch, day_countries = sketches[date_str]
+            total.merge(day_sketch)
+            for country, sketch in day_countries.items():
+                if country in by_country:
+                    by_country[country].merge(sketch)
+                else:
+                    by_country[country] = sketch.copy()
+        countries = {c: h.count() for c, h in by_country.items()}
+        result["windows"][str(n)] = {
+            "unique_users": total.count(),
+            "countries": dict(sorted(countries.items(), key=lambda x: -x[1])),
+        }
+    return result
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate analytics summary report")
     parser.add_argument("--days", type=int, default=None,
                         help="Only process the last N days (default: all)")
+    parser.add_argument("--rolling", default=None, metavar="7,30,90",
+                        help="Print rolling unique users for these windows (days) instead")
+    parser.add_argument("--exact", action="store_true",
+                        help="With --rolling: count exactly from the logs instead of the sketches")
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
 
-    generate_report(max_days=args.days)
+    if args.rolling:
+        windows = tuple(int(w) for w in args.rolling.split(",") if w.strip())
+        print(json.dumps(rolling_uniques(windows, exact=args.exact), indent=2))
+    else:
+        generate_report(max_days=args.days)
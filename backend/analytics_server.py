@@ -4,185 +4,188 @@ Analytics Server for Garmin Rowing Watchface
 Lightweight Flask app that serves data.json while logging anonymous analytics.
 
 - Logs a hashed user ID (SHA-256 of IP + daily salt, truncated to 16 chars)
-- Looks up country from IP using GeoLite2-Country offline database
+- Looks up country from IP using GeoLite2-Country offline database (memory-mapped,
+  cached per /24 or /48 network)
 - Deduplicates: skips logging if same user was logged within the last hour
-- Stores daily JSONL log files in analytics/ directory
+  (dedup table shared by all gunicorn workers)
+- Stores daily JSONL log files in analytics/ directory (written in batches by a
+  background writer thread, off the request path)
+- Keeps the published data.json of every location in memory (/data.json?loc=...,
+  see locations.py) and answers If-None-Match with 304
+- Serves the compact binary payload (?format=bin or Accept) and precompressed
+  JSON (Accept-Encoding: br/gzip) published next to data.json by fetch_data.py,
+  only when the variants manifest ties them to the JSON being served
+- Caches /api/summary and /api/total_users (TTL + stale-while-revalidate)
+- Answers /api/summary?from=&to=&granularity= from minute/hour/day rollups
+  (rollups.db) that the writer updates with every batch
+- Serves past data.json snapshots for trend charts from a memory-mapped ring
+  buffer (/api/history)
+- Exposes Prometheus metrics aggregated across workers on /metrics (request
+  counts and latency per route, dedup, GeoIP, SQLite, summary generation,
+  fetch_data timings and data.json staleness); logs through `logging`
+  (level from LOG_LEVEL, default INFO)
 
 Run with gunicorn:
     gunicorn -b 127.0.0.1:8001 analytics_server:app
+or, on an event loop, through analytics_asgi.py (same routes)
 """
 
-import hashlib
+import atexit
 import json
+import logging
 import os
-import secrets
-import sqlite3
 import time
 from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
-
-from flask import Flask, request, send_file, jsonify
+from urllib.parse import urlsplit
+
+from flask import Flask, Response, g, request, jsonify
+
+from analytics_log import DailySalts, day_files, iter_entries
+from analytics_writer import AnalyticsWriter
+from db import Database
+from dedup_store import DedupStore
+from geoip_lookup import CountryLookup
+from locations import DEFAULT_LOCATION, load_locations, location_data_path
+from metrics import METRICS_DIR, Registry
+from payload_codec import BINARY_MIMETYPE, encode_binary, parse_manifest, variant_matches, variant_paths
+from response_cache import CachedResponse, ResponseCache
+from rollup_store import GRANULARITIES, ROLLUPS_DB_PATH, RollupStore
+from snapshot import Snapshot, SnapshotCache
+from snapshot_history import FIELDS as HISTORY_FIELDS, SnapshotHistory
+from upstream_cache import CACHE_DIR as UPSTREAM_CACHE_DIR, UpstreamCache
 
 try:
-    from analytics_report import generate_report
+    from analytics_report import generate_report, rolling_uniques
 except ImportError:
     generate_report = None
-
-
-# Optional: GeoIP2 for country lookup
-try:
-    import geoip2.database
-    GEOIP_AVAILABLE = True
-except ImportError:
-    GEOIP_AVAILABLE = False
+    rolling_uniques = None
 
 # --- Configuration ---
 BASE_DIR = Path(__file__).parent.resolve()
-DATA_JSON_PATH = BASE_DIR.parent / "data.json"
+DATA_JSON_PATH = location_data_path(DEFAULT_LOCATION)
 ANALYTICS_DIR = BASE_DIR / "analytics"
 GEOIP_DB_PATH = BASE_DIR / "GeoLite2-Country.mmdb"
 SUGGESTIONS_DB_PATH = BASE_DIR / "suggestions.db"
 USERS_DB_PATH = BASE_DIR / "users.db"
+DEDUP_DB_PATH = BASE_DIR / "dedup.db"
 SUMMARY_JSON_PATH = ANALYTICS_DIR / "summary.json"
+FETCH_METRICS_PATH = BASE_DIR / "fetch_metrics.json"
 
 # How often the same user can be logged (seconds) — matches Garmin's hourly interval
 DEDUP_INTERVAL = 3500  # slightly less than 1 hour to avoid edge cases
 
+# How often (seconds) the server checks whether fetch_data.py published a new data.json
+DATA_CHECK_INTERVAL = 2.0
+
+# Dashboard API cache: responses are fresh for SUMMARY_TTL seconds, then served
+# stale for up to SUMMARY_STALE_TTL seconds while one thread regenerates them
+SUMMARY_TTL = 60
+SUMMARY_STALE_TTL = 600
+
+# Windows (days) /api/summary?windows=... may ask rolling unique counts for
+ROLLING_WINDOWS = (7, 30, 90)
+
+# /api/summary?from=&to=&granularity=: most buckets one response may have
+ROLLUP_MAX_BUCKETS = 5000
+
+# /api/history: default and maximum time range (seconds)
+HISTORY_DEFAULT_RANGE = 48 * 3600
+HISTORY_MAX_RANGE = 90 * 86400
+
+# Max number of cached GeoIP network prefixes per worker
+GEOIP_CACHE_SIZE = 65536
+
+# Background analytics writer: queue bound and batch flush triggers
+WRITER_MAX_QUEUE = 10000
+WRITER_BATCH_SIZE = 500
+WRITER_FLUSH_INTERVAL = 2.0  # seconds
+
+logging.basicConfig(
+    level=os.environ.get("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
+log = logging.getLogger("analytics")
+
 app = Flask(__name__)
 
-# --- In-memory dedup cache: {user_hash: last_log_timestamp} ---
-_recent_users = {}
+# --- Metrics (per worker in memory, merged across workers on /metrics) ---
+_metrics = Registry(METRICS_DIR)
+_http_requests = _metrics.counter(
+    "http_requests_total", "HTTP requests by route, method and status", ("route", "method", "status"))
+_http_latency = _metrics.histogram(
+    "http_request_duration_seconds", "Request handling time by route", ("route",))
+_sqlite_latency = _metrics.histogram(
+    "sqlite_query_duration_seconds", "SQLite query time by database and statement", ("db", "statement"))
+_summary_generation = _metrics.histogram(
+    "summary_generation_seconds", "Time to regenerate summary.json",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
 
-# --- GeoIP Reader (loaded once) ---
-_geoip_reader = None
 
+def _observe_sql(db_name: str):
+    def observe(sql, seconds):
+        _sqlite_latency.observe(seconds, db_name, sql.split(None, 1)[0].upper())
+    return observe
 
-def _get_geoip_reader():
-    """Lazy-load the GeoIP reader."""
-    global _geoip_reader
-    if _geoip_reader is None and GEOIP_AVAILABLE and GEOIP_DB_PATH.exists():
-        try:
-            _geoip_reader = geoip2.database.Reader(str(GEOIP_DB_PATH))
-        except Exception as e:
-            print(f"[analytics] Failed to load GeoIP database: {e}")
-    return _geoip_reader
+# --- Published data.json per location (plus its binary and precompressed
+#     variants), kept in memory and reloaded only when its version changes ---
+def _payload_caches(json_path: Path) -> dict:
+    paths = {"json": json_path, **variant_paths(json_path)}
+    return {name: SnapshotCache(path, check_interval=DATA_CHECK_INTERVAL) for name, path in paths.items()}
 
 
-def _get_daily_salt(date_str: str) -> str:
-    """Get or create a daily salt for hashing. Stored in analytics/.salt_YYYY-MM-DD"""
-    ANALYTICS_DIR.mkdir(parents=True, exist_ok=True)
-    salt_file = ANALYTICS_DIR / f".salt_{date_str}"
+_data_caches = {key: _payload_caches(location_data_path(key)) for key in load_locations()}
+_data_cache = _data_caches[DEFAULT_LOCATION]["json"]
 
-    if salt_file.exists():
-        return salt_file.read_text().strip()
+# --- Cached /api/summary and /api/total_users responses ---
+_summary_cache = ResponseCache(ttl=SUMMARY_TTL, stale_ttl=SUMMARY_STALE_TTL)
 
-    salt = secrets.token_hex(16)
-    salt_file.write_text(salt)
-    return salt
+# --- Snapshot history (memory-mapped, written by fetch_data.py) ---
+_history = SnapshotHistory()
 
+# --- Daily salts for hashing anonymous users (used by the writer thread) ---
+_salts = DailySalts(ANALYTICS_DIR)
 
-def _hash_user(ip: str, daily_salt: str) -> str:
-    """Create a truncated SHA-256 hash of IP + daily salt."""
-    raw = f"{ip}:{daily_salt}".encode("utf-8")
-    return hashlib.sha256(raw).hexdigest()[:16]
+# --- GeoIP lookups (reader loaded once, results cached per /24 or /48 prefix) ---
+_geoip = CountryLookup(GEOIP_DB_PATH, cache_size=GEOIP_CACHE_SIZE)
 
 
 def _lookup_country(ip: str) -> str:
     """Look up the country code for an IP address. Returns 'XX' on failure."""
-    # Private/local IPs can't be geolocated
-    private_prefixes = ("127.", "10.", "192.168.", "172.16.", "172.17.",
-                        "172.18.", "172.19.", "172.2", "172.3", "0.", "::1")
-    if ip.startswith(private_prefixes):
-        print(f"[geoip] Private/internal IP detected: {ip} → XX")
-        return "XX"
-
-    reader = _get_geoip_reader()
-    if reader is None:
-        print(f"[geoip] GeoIP reader unavailable for IP: {ip} → XX")
-        return "XX"
-    try:
-        response = reader.country(ip)
-        code = response.country.iso_code or "XX"
-        print(f"[geoip] {ip} → {code}")
-        return code
-    except Exception as e:
-        print(f"[geoip] Lookup failed for {ip}: {e} → XX")
-        return "XX"
+    return _geoip.lookup(ip)
 
 
-def _get_client_ip() -> str:
+def _get_client_ip(req) -> str:
     """Extract client IP from X-Forwarded-For header (set by nginx) or fall back to remote_addr."""
-    forwarded = request.headers.get("X-Forwarded-For", "")
+    forwarded = req.headers.get("X-Forwarded-For", "")
     if forwarded:
         # X-Forwarded-For can contain multiple IPs; the first is the client
         return forwarded.split(",")[0].strip()
-    return request.remote_addr or "0.0.0.0"
-
-
-def _cleanup_dedup_cache():
-    """Remove entries older than DEDUP_INTERVAL from the in-memory cache."""
-    now = time.time()
-    expired = [uid for uid, ts in _recent_users.items() if now - ts > DEDUP_INTERVAL]
-    for uid in expired:
-        del _recent_users[uid]
+    return req.remote_addr or "0.0.0.0"
 
 
-def _log_analytics(ip: str):
+def _log_analytics(ip: str, device_uid):
     now = time.time()
-    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
     
-    # 1. Grab the UID passed from the Garmin watch
-    device_uid = request.args.get("uid")
+    # 1. The UID passed from the Garmin watch (?uid=...)
     is_real_uid = bool(device_uid)
     
-    # Fallback to IP hashing ONLY if it's accessed via a normal web browser
-    if not device_uid:
-        daily_salt = _get_daily_salt(today)
-        device_uid = _hash_user(ip, daily_salt)
-    
-    # 2. Use the device_uid for your dedup check
-    if device_uid in _recent_users and (now - _recent_users[device_uid]) < DEDUP_INTERVAL:
-        return 
-        
-    _recent_users[device_uid] = now
-
-    if len(_recent_users) > 1000:
-        _cleanup_dedup_cache()
-
-    # Country lookup
-    country = _lookup_country(ip)
-
-    # Append to daily JSONL file
-    ANALYTICS_DIR.mkdir(parents=True, exist_ok=True)
-    log_file = ANALYTICS_DIR / f"{today}.jsonl"
+    # 2. Hand off to the background writer (IP hashing for normal web browsers
+    #    without a uid, shared dedup check, country lookup, JSONL line,
+    #    users.db insert), so no request touches the salt files or databases
+    _writer.submit(now, device_uid or None, ip, is_real_uid)
 
-    entry = {
-        "ts": int(now),
-        "uid": device_uid,
-        "country": country
-    }
 
-    with open(log_file, "a") as f:
-        f.write(json.dumps(entry) + "\n")
-
-    # Log to unique users db only if it's a real device UID from garmin watch
-    if is_real_uid:
-        try:
-            conn = sqlite3.connect(str(USERS_DB_PATH))
-            conn.execute("INSERT OR IGNORE INTO unique_users (uid) VALUES (?)", (device_uid,))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"[analytics] Error saving real user id: {e}")
+# --- Databases (persistent per-thread connections, WAL) ---
 
+_suggestions_db = Database(SUGGESTIONS_DB_PATH, observer=_observe_sql("suggestions"))
+_users_db = Database(USERS_DB_PATH, observer=_observe_sql("users"))
 
 
-# --- Suggestions Database ---
-
 def _init_suggestions_db():
     """Initialize the SQLite suggestions database."""
-    conn = sqlite3.connect(str(SUGGESTIONS_DB_PATH))
-    conn.execute("""
+    _suggestions_db.execute("""
         CREATE TABLE IF NOT EXISTS suggestions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT,
@@ -190,8 +193,6 @@ def _init_suggestions_db():
             created_at TEXT NOT NULL DEFAULT (datetime('now'))
         )
     """)
-    conn.commit()
-    conn.close()
 
 
 # Initialize DB on import
@@ -199,115 +200,330 @@ _init_suggestions_db()
 
 def _init_users_db():
     """Initialize the SQLite unique users database."""
-    conn = sqlite3.connect(str(USERS_DB_PATH))
-    conn.execute("""
+    _users_db.execute("""
         CREATE TABLE IF NOT EXISTS unique_users (
             uid TEXT PRIMARY KEY,
             first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    conn.commit()
-    conn.close()
 
 _init_users_db()
 
 
+# --- Dedup table shared by all workers ---
+_dedup = DedupStore(DEDUP_DB_PATH, interval=DEDUP_INTERVAL)
+
+# --- Minute/hour/day poll counts, fed by the writer ---
+_rollups = RollupStore(ROLLUPS_DB_PATH, observer=_observe_sql("rollups"))
+
+# --- Background analytics writer (one per worker, flushed on shutdown) ---
+_writer = AnalyticsWriter(
+    ANALYTICS_DIR,
+    _users_db,
+    resolve_country=_lookup_country,
+    anonymize=_salts.anonymize,
+    dedup=_dedup,
+    rollups=_rollups,
+    max_queue=WRITER_MAX_QUEUE,
+    batch_size=WRITER_BATCH_SIZE,
+    flush_interval=WRITER_FLUSH_INTERVAL,
+)
+atexit.register(_writer.close)
+
+
 # --- Routes ---
 
 @app.route("/data.json")
 def serve_data():
-    """Serve data.json and log analytics."""
+    """Serve data.json (of ?loc=..., default Nijmegen) and log analytics."""
     # Log analytics (non-blocking, best-effort)
     try:
-        ip = _get_client_ip()
-        _log_analytics(ip)
+        _log_analytics(_get_client_ip(request), request.args.get("uid"))
     except Exception as e:
         # Never let analytics failures break data serving
-        print(f"[analytics] Error logging: {e}")
+        log.warning("Error logging: %s", e)
 
-    # Serve data.json
-    if DATA_JSON_PATH.exists():
-        response = send_file(
-            str(DATA_JSON_PATH),
-            mimetype="application/json",
-        )
-        # Add CORS header to match existing nginx config
-        response.headers["Access-Control-Allow-Origin"] = "*"
-        response.headers["Cache-Control"] = "no-cache"
-        return response
-    else:
-        return jsonify({"error": "data.json not found"}), 404
+    # Serve data.json from memory
+    return _payload_response(request)
 
 
-@app.route("/api/summary")
-def api_summary():
-    """Serve the analytics summary JSON, regenerating it on the fly."""
+def _json_error(message: str, status: int) -> Response:
+    # Like jsonify(), but usable without a Flask app context (analytics_asgi.py)
+    return Response(json.dumps({"error": message}), status=status, mimetype="application/json")
+
+
+_manifest = lru_cache(maxsize=64)(parse_manifest)
+
+
+@lru_cache(maxsize=16)
+def _binary_from_json(body: bytes, mtime: float):
+    """The binary payload encoded from a JSON body (when the published data.bin doesn't match it)."""
+    try:
+        return Snapshot(encode_binary(json.loads(body)), mtime)
+    except (ValueError, TypeError):
+        return None
+
+
+def _payload_response(req, load=SnapshotCache.get) -> Response:
+    """
+    The /data.json response for werkzeug request `req`: the payload of its
+    location in the negotiated representation, or 304. `load(cache)` returns
+    a variant's current Snapshot (SnapshotCache.peek never touches the disk).
+    """
+    caches = _data_caches.get(req.args.get("loc") or DEFAULT_LOCATION)
+    if caches is None:
+        return _json_error("Unknown location", 404)
+    snapshot = load(caches["json"])
+    if snapshot is None:
+        return _json_error("data.json not found", 404)
+
+    # Variant files are picked up one at a time, so only use one the manifest
+    # says was made from this JSON body
+    manifest_snapshot = load(caches["manifest"])
+    manifest = _manifest(manifest_snapshot.body) if manifest_snapshot is not None else None
+
+    def variant(name):
+        candidate = load(caches[name])
+        if candidate is not None and variant_matches(manifest, snapshot.etag, name, candidate.etag):
+            return candidate
+        return None
+
+    # Pick the representation: binary if asked for, else JSON, precompressed
+    # when the client accepts it and it's actually smaller
+    mimetype, encoding = "application/json", None
+    wants_binary = req.args.get("format") == "bin" or req.accept_mimetypes.best_match(
+        ["application/json", BINARY_MIMETYPE], default="application/json") == BINARY_MIMETYPE
+    if wants_binary:
+        snapshot = variant("bin") or _binary_from_json(snapshot.body, snapshot.mtime)
+        if snapshot is None:
+            return _json_error("Binary payload not available", 404)
+        mimetype = BINARY_MIMETYPE
+    else:
+        for candidate in ("br", "gzip"):
+            if req.accept_encodings[candidate]:
+                compressed = variant(candidate)
+                if compressed is not None and len(compressed.body) < len(snapshot.body):
+                    snapshot, encoding = compressed, candidate
+                    break
+
+    if req.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.body, mimetype=mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.set_etag(snapshot.etag)
+    response.vary.update(("Accept", "Accept-Encoding"))
+    response.headers["Last-Modified"] = snapshot.last_modified
+    # Add CORS header to match existing nginx config
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _cached_json_response(cached: CachedResponse):
+    """Build a JSON response with ETag/Last-Modified, answering conditional requests with 304."""
+    response = Response(cached.body, mimetype="application/json")
+    response.set_etag(cached.etag)
+    response.last_modified = datetime.fromtimestamp(cached.last_modified, timezone.utc)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def _refresh_summary_file():
+    """Regenerate summary.json (and the day sketches) if it's older than SUMMARY_TTL.
+
+    Only one process regenerates at a time; if another worker holds the report
+    lock, whatever is currently on disk is used instead.
+    """
     if generate_report:
         try:
-            generate_report(max_days=30)
+            mtime = SUMMARY_JSON_PATH.stat().st_mtime if SUMMARY_JSON_PATH.exists() else 0
+            if time.time() - mtime >= SUMMARY_TTL:
+                start = time.perf_counter()
+                if generate_report(max_days=30, blocking=not SUMMARY_JSON_PATH.exists(),
+                                   log_level=logging.DEBUG):
+                    _summary_generation.observe(time.perf_counter() - start)
         except Exception as e:
-            print(f"[analytics] Error generating summary report: {e}")
-            
+            log.error("Error generating summary report: %s", e)
+
+
+def _build_summary() -> CachedResponse:
+    """Load summary.json, regenerating it first if it's stale."""
+    _refresh_summary_file()
+
     if SUMMARY_JSON_PATH.exists():
-        try:
-            with open(SUMMARY_JSON_PATH, "r") as f:
-                data = json.load(f)
-            return jsonify(data)
-        except (json.JSONDecodeError, IOError) as e:
-            return jsonify({"error": f"Failed to read summary: {e}"}), 500
-    else:
-        # If no summary.json exists yet, generate a live summary from JSONL files
-        return _live_summary()
+        with open(SUMMARY_JSON_PATH, "rb") as f:
+            body = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+        json.loads(body)  # refuse to cache a corrupt file
+        return CachedResponse(body, last_modified=mtime)
 
+    # If no summary.json exists yet, generate a live summary from JSONL files
+    return CachedResponse(json.dumps(_live_summary()).encode("utf-8"))
 
-def _live_summary():
-    """Generate a summary on the fly from JSONL files (fallback if report hasn't run)."""
+
+def _parse_windows(raw: str):
+    """Parse ?windows=7,30,90 into a tuple of day counts; None unless all are in ROLLING_WINDOWS."""
+    try:
+        windows = tuple(sorted({int(w) for w in raw.split(",") if w.strip()}))
+    except ValueError:
+        return None
+    if not windows or not set(windows) <= set(ROLLING_WINDOWS):
+        return None
+    return windows
+
+
+def _parse_time(raw: str, end: bool = False):
+    """Parse a YYYY-MM-DD date or ISO datetime (UTC unless it has an offset) into Unix seconds.
+
+    A date used as the `end` of a range includes that whole day. None if invalid.
+    """
+    try:
+        value = datetime.fromisoformat(raw.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    ts = int(value.timestamp())
+    if end and len(raw.strip()) == 10:
+        ts += 86400
+    return ts
+
+
+def _rollup_summary():
+    """/api/summary?from=&to=&granularity=minute|hour|day|week: poll counts per bucket from rollups.db."""
+    granularity = request.args.get("granularity", "day")
+    if granularity not in GRANULARITIES:
+        return jsonify({"error": f"granularity must be one of: {', '.join(GRANULARITIES)}"}), 400
+    start = _parse_time(request.args.get("from", ""))
+    end = _parse_time(request.args["to"], end=True) if "to" in request.args else int(time.time())
+    if start is None or end is None:
+        return jsonify({"error": "from and to must be YYYY-MM-DD dates or ISO datetimes"}), 400
+    if end <= start:
+        return jsonify({"error": "to must be after from"}), 400
+    bucket_seconds = GRANULARITIES[granularity][2]
+    if (end - start) / bucket_seconds > ROLLUP_MAX_BUCKETS:
+        return jsonify({"error": f"At most {ROLLUP_MAX_BUCKETS} {granularity} buckets per request"}), 400
+
+    return jsonify({"granularity": granularity, **_rollups.query(start, end, granularity)})
+
+
+@app.route("/api/summary")
+def api_summary():
+    """
+    Serve the analytics summary JSON (cached, stale-while-revalidate).
+
+    With ?windows=7,30,90 returns rolling unique-user counts instead, merged from
+    the daily HyperLogLog sketches (exact counts, which re-scan the logs, are
+    only available from the CLI: analytics_report.py --rolling).
+    With ?from= (and optional &to=, &granularity=minute|hour|day|week) returns
+    poll counts per bucket from the rollups: `requests` (every poll) and
+    `logged` (polls not deduplicated away, roughly active devices), plus
+    logged polls per country over the range.
+    """
+    if "from" in request.args:
+        return _rollup_summary()
+
+    raw_windows = request.args.get("windows")
+    if raw_windows is not None:
+        windows = _parse_windows(raw_windows)
+        if windows is None:
+            return jsonify({"error": "windows must be one or more of "
+                                     + ",".join(map(str, ROLLING_WINDOWS))}), 400
+        if rolling_uniques is None:
+            return jsonify({"error": "Rolling uniques unavailable"}), 503
+
+        def build_rolling():
+            _refresh_summary_file()
+            data = rolling_uniques(windows)
+            return CachedResponse(json.dumps(data).encode("utf-8"))
+
+        key = f"rolling:{','.join(map(str, windows))}"
+        return _cached_json_response(_summary_cache.get(key, build_rolling))
+
+    try:
+        cached = _summary_cache.get("summary", _build_summary)
+    except (json.JSONDecodeError, IOError) as e:
+        return jsonify({"error": f"Failed to read summary: {e}"}), 500
+    return _cached_json_response(cached)
+
+
+def _live_summary() -> dict:
+    """Generate a summary on the fly from the day log files (fallback if report hasn't run)."""
     from collections import defaultdict
     summary = {}
 
     if not ANALYTICS_DIR.exists():
-        return jsonify({})
+        return {}
 
-    for log_file in sorted(ANALYTICS_DIR.glob("*.jsonl")):
-        date_str = log_file.stem
+    for date_str, log_file in day_files(ANALYTICS_DIR):
         unique_users = set()
         countries = defaultdict(int)
 
-        with open(log_file, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    entry = json.loads(line)
-                    uid = entry.get("uid", "")
-                    country = entry.get("country", "XX")
-                    if uid and uid not in unique_users:
-                        unique_users.add(uid)
-                        countries[country] += 1
-                except json.JSONDecodeError:
-                    continue
+        for _, uid, country in iter_entries(log_file):
+            if uid and uid not in unique_users:
+                unique_users.add(uid)
+                countries[country] += 1
 
         summary[date_str] = {
             "unique_users": len(unique_users),
             "countries": dict(sorted(countries.items(), key=lambda x: -x[1])),
         }
 
-    return jsonify(summary)
+    return summary
+
+
+def _build_total_users() -> CachedResponse:
+    count = _users_db.execute("SELECT COUNT(*) FROM unique_users").fetchone()[0]
+    return CachedResponse(json.dumps({"total_users": count}).encode("utf-8"))
+
 
 @app.route("/api/total_users")
 def api_total_users():
-    """Return the total number of unique users tracked in the users.db."""
+    """Return the total number of unique users tracked in the users.db (cached)."""
     try:
-        conn = sqlite3.connect(str(USERS_DB_PATH))
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM unique_users")
-        count = cursor.fetchone()[0]
-        conn.close()
-        return jsonify({"total_users": count})
+        cached = _summary_cache.get("total_users", _build_total_users)
     except Exception as e:
-        print(f"[analytics] Error retrieving total unique users: {e}")
+        log.error("Error retrieving total unique users: %s", e)
         return jsonify({"total_users": 0}), 500
+    return _cached_json_response(cached)
+
+
+@app.route("/api/history")
+def api_history():
+    """
+    Past data.json snapshots as columns, oldest first, for trend charts.
+
+    ?from=&to= are Unix timestamps (default: the last 48 hours), ?fields= a
+    comma-separated subset of the packed array's fields (default: all), e.g.
+    /api/history?fields=water_now,wind_now
+    """
+    now = int(time.time())
+    try:
+        end = int(request.args.get("to", now))
+        start = int(request.args.get("from", end - HISTORY_DEFAULT_RANGE))
+    except ValueError:
+        return jsonify({"error": "from and to must be Unix timestamps"}), 400
+    if start > end or end - start > HISTORY_MAX_RANGE:
+        return jsonify({"error": f"range must be between 0 and {HISTORY_MAX_RANGE} seconds"}), 400
+
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    unknown = [f for f in fields if f not in HISTORY_FIELDS]
+    if unknown:
+        return jsonify({"error": f"unknown fields: {', '.join(unknown)}"}), 400
+    if "ts" in fields:
+        fields.remove("ts")
+    fields = ["ts"] + (fields or list(HISTORY_FIELDS[1:]))
+
+    try:
+        columns = _history.query_columns(start, end, fields)
+    except (OSError, ValueError) as e:
+        log.error("Error reading history: %s", e)
+        return jsonify({"error": "History unavailable"}), 503
+    response = jsonify({"from": start, "to": end, "count": len(columns["ts"]), **columns})
+    response.headers["Access-Control-Allow-Origin"] = "*"
+    return response
 
 
 @app.route("/api/suggestions", methods=["POST"])
@@ -321,48 +537,150 @@ def api_submit_suggestion():
     suggestion = data["suggestion"].strip()[:2000]  # Limit suggestion length
 
     try:
-        conn = sqlite3.connect(str(SUGGESTIONS_DB_PATH))
-        conn.execute(
+        _suggestions_db.execute(
             "INSERT INTO suggestions (name, suggestion) VALUES (?, ?)",
             (name or None, suggestion),
         )
-        conn.commit()
-        conn.close()
         return jsonify({"status": "ok"}), 201
     except Exception as e:
-        print(f"[suggestions] Error saving: {e}")
+        log.error("Error saving suggestion: %s", e)
         return jsonify({"error": "Failed to save suggestion"}), 500
 
 
 @app.route("/health")
 def health():
-    """Simple health check endpoint."""
+    """Simple health check endpoint (public; server internals are on /metrics)."""
     return jsonify({
         "status": "ok",
-        "geoip": GEOIP_AVAILABLE and GEOIP_DB_PATH.exists(),
-        "data_json": DATA_JSON_PATH.exists(),
+        "geoip": _geoip.available,
+        "data_json": _data_cache.get() is not None,
         "suggestions_db": SUGGESTIONS_DB_PATH.exists(),
     })
 
 
+# --- Metrics ---
+
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def _record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        _http_latency.observe(time.perf_counter() - start, route)
+        _http_requests.inc(route, request.method, response.status_code)
+    return response
+
+
+@_metrics.process_collector
+def _worker_metrics():
+    geoip = _geoip.stats()
+    writer = _writer.stats()
+    cache = _summary_cache.stats()
+    return [
+        ("geoip_lookups_total", "counter", "GeoIP lookups by result", ("result",), {
+            ("hit",): geoip["hits"], ("miss",): geoip["misses"],
+            ("private",): geoip["private"], ("failure",): geoip["failures"],
+        }),
+        ("geoip_cache_evictions_total", "counter", "GeoIP prefix cache evictions", (),
+         {(): geoip["evictions"]}),
+        ("geoip_cached_prefixes", "gauge", "Networks in the GeoIP prefix caches", (),
+         {(): geoip["cached_prefixes"]}),
+        ("analytics_records_total", "counter", "Analytics records by outcome", ("outcome",), {
+            ("enqueued",): writer["enqueued"], ("written",): writer["written"],
+            ("dropped",): writer["dropped"], ("duplicate",): writer["duplicates"],
+        }),
+        ("analytics_batches_total", "counter", "Analytics batches written", (), {(): writer["batches"]}),
+        ("analytics_write_errors_total", "counter", "Analytics write errors", (), {(): writer["errors"]}),
+        ("analytics_queue_depth", "gauge", "Records waiting in the writer queues", (),
+         {(): writer["queue_depth"]}),
+        ("analytics_queue_capacity", "gauge", "Capacity of the writer queues", (),
+         {(): writer["queue_capacity"]}),
+        ("api_cache_requests_total", "counter", "Dashboard API cache lookups by result", ("result",), {
+            ("hit",): cache["hits"], ("stale",): cache["stale_hits"],
+            ("miss",): cache["misses"], ("error",): cache["errors"],
+        }),
+        ("api_cache_evictions_total", "counter", "Dashboard API cache entries evicted (LRU)", (),
+         {(): cache["evictions"]}),
+        ("api_cache_entries", "gauge", "Dashboard API responses cached", (), {(): cache["entries"]}),
+    ]
+
+
+@_metrics.scrape_collector
+def _shared_metrics():
+    samples = []
+    dedup = _dedup.stats()
+    samples.append(("dedup_checks_total", "counter", "Dedup checks across workers by result", ("result",),
+                    {("hit",): dedup["hits"], ("miss",): dedup["misses"]}))
+    samples.append(("dedup_rotations_total", "counter", "Dedup bucket rotations", (),
+                    {(): dedup["rotations"]}))
+    samples.append(("geoip_database_available", "gauge", "Whether the GeoLite2 database is loaded", (),
+                    {(): int(_geoip.available)}))
+
+    history = _history.stats()
+    samples.append(("history_snapshots", "gauge", "Snapshots in the history ring buffer", (),
+                    {(): history["records"]}))
+    samples.append(("history_capacity", "gauge", "Capacity of the history ring buffer", (),
+                    {(): history["capacity"]}))
+
+    now = time.time()
+    ages = {}
+    for key, caches in _data_caches.items():
+        snapshot = caches["json"].get()
+        if snapshot is not None:
+            ages[(key,)] = round(now - snapshot.mtime, 3)
+    samples.append(("data_json_age_seconds", "gauge", "Seconds since data.json was last published",
+                    ("location",), ages))
+
+    try:
+        fetch = json.loads(FETCH_METRICS_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        fetch = None
+    if fetch:
+        samples.append(("fetch_duration_seconds", "gauge", "Duration of the last fetch_data run by source",
+                        ("source",), {(source,): seconds for source, seconds in fetch["timings"].items()}))
+        samples.append(("fetch_last_run_timestamp_seconds", "gauge", "When fetch_data last finished", (),
+                        {(): fetch["finished"]}))
+
+    upstream = {}
+    for url, counters in UpstreamCache(UPSTREAM_CACHE_DIR, http_get=None).stats().items():
+        host = urlsplit(url).hostname or url
+        for result in ("not_modified", "identical", "changed"):
+            upstream[(host, result)] = upstream.get((host, result), 0) + counters.get(result, 0)
+        upstream[(host, "parse_skipped")] = upstream.get((host, "parse_skipped"), 0) + counters.get("parses_skipped", 0)
+    samples.append(("upstream_responses_total", "counter",
+                    "Upstream responses by host and result (parse_skipped: computed values reused)",
+                    ("host", "result"), upstream))
+    return samples
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics, aggregated across all server workers."""
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/debug/ip")
 def debug_ip():
     """Debug: show what IP Flask sees for this request."""
-    ip = _get_client_ip()
+    ip = _get_client_ip(request)
     country = _lookup_country(ip)
     return jsonify({
         "raw_ip": ip,
         "country": country,
         "x_forwarded_for": request.headers.get("X-Forwarded-For", None),
         "remote_addr": request.remote_addr,
-        "geoip_available": GEOIP_AVAILABLE and GEOIP_DB_PATH.exists(),
+        "geoip_available": _geoip.available,
     })
 
 
 if __name__ == "__main__":
-    print(f"[analytics] Data JSON path: {DATA_JSON_PATH}")
-    print(f"[analytics] Analytics dir: {ANALYTICS_DIR}")
-    print(f"[analytics] GeoIP available: {GEOIP_AVAILABLE and GEOIP_DB_PATH.exists()}")
-    print(f"[analytics] Suggestions DB: {SUGGESTIONS_DB_PATH}")
+    log.info("Data JSON path: %s", DATA_JSON_PATH)
+    log.info("Analytics dir: %s", ANALYTICS_DIR)
+    log.info("GeoIP available: %s", _geoip.available)
+    log.info("Suggestions DB: %s", SUGGESTIONS_DB_PATH)
     app.run(host="127.0.0.1", port=8001, debug=True)
 
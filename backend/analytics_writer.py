@@ -0,0 +1,332 @@
+"""
+Background Analytics Writer
+===========================
+Takes analytics logging off the /data.json request path.
+
+Requests only enqueue a small record; one writer thread per (gunicorn) worker
+drains the queue and writes in batches:
+
+- Duplicates (same uid within the dedup interval) are filtered per batch
+  against the DedupStore shared by all workers
+- Country lookup, and hashing the IP of records without a device uid (which
+  reads or creates the daily salt file), happen in the writer thread, not in
+  the request
+- All JSONL lines of a batch are appended with one open/write per day file
+- Real device UIDs are inserted into users.db with one executemany per batch
+- Every record, duplicate or not, is counted in the RollupStore (if given) with
+  one transaction per batch
+- A batch is flushed when it reaches `batch_size` records or when its oldest
+  record is `flush_interval` seconds old
+- The queue is bounded; records that don't fit are dropped and counted
+- close() (registered with atexit) flushes everything still queued
+
+AsyncAnalyticsWriter does the same for the ASGI app (analytics_asgi.py): an
+asyncio queue drained by a task on the event loop, with each batch written in
+a worker thread so file and SQLite I/O never run on the loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+_STOP = object()
+
+log = logging.getLogger("analytics.writer")
+
+
+class AnalyticsWriter:
+    """Bounded queue + single background thread that batches analytics writes."""
+
+    _Full = queue.Full
+
+    def __init__(self, analytics_dir: Path, users_db, resolve_country, anonymize=None, dedup=None,
+                 rollups=None, max_queue: int = 10000, batch_size: int = 500, flush_interval: float = 2.0):
+        self.analytics_dir = Path(analytics_dir)
+        self.users_db = users_db
+        self.resolve_country = resolve_country
+        self.anonymize = anonymize   # anonymize(ip, ts) -> uid, for records submitted without one
+        self.dedup = dedup
+        self.rollups = rollups
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.batches = 0
+        self.errors = 0
+
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        """(Re)create per-process state; also used after a fork."""
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        self._closed = False
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            # Forked (e.g. gunicorn --preload): the parent's thread doesn't exist here
+            self._reset()
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="analytics-writer", daemon=True
+                )
+                self._thread.start()
+
+    # --- Producer side (request path) ---
+
+    def submit(self, ts: float, uid: str, ip: str, is_real_uid: bool) -> bool:
+        """
+        Enqueue one record without blocking. Returns False if it was dropped.
+        `uid` may be None if the writer was given `anonymize`.
+        """
+        self._ensure_started()
+        if self._closed:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait((int(ts), uid, ip, is_real_uid))
+        except self._Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def close(self, timeout: float = 5.0):
+        """Stop accepting records and flush everything still queued."""
+        if self._pid != os.getpid() or self._thread is None or self._closed:
+            self._closed = True
+            return
+        self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+
+    def write(self, records):
+        """Write (ts, uid, ip, is_real_uid) records now, on the calling thread (offline jobs, e.g. log_ingest.py)."""
+        self._write_batch([(int(ts), uid, ip, is_real_uid) for ts, uid, ip, is_real_uid in records])
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "errors": self.errors,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self.max_queue,
+        }
+
+    # --- Consumer side (writer thread) ---
+
+    def _run(self):
+        batch = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except queue.Empty:
+                pass
+
+            if stopping:
+                # Drain whatever was queued before the stop marker
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            if batch and (stopping or len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch = []
+                deadline = None
+
+        self.users_db.close()
+
+    def _deduplicate(self, batch):
+        """One flag per record: True to log it, False for a duplicate."""
+        if self.dedup is None:
+            return [True] * len(batch)
+        try:
+            fresh = self.dedup.claim_many([(uid, ts) for ts, uid, _, _ in batch])
+        except Exception as e:
+            # Fail open: logging a duplicate is better than losing a record
+            self.errors += 1
+            log.warning("Dedup store unavailable, logging batch as-is: %s", e)
+            return [True] * len(batch)
+        self.duplicates += fresh.count(False)
+        return fresh
+
+    def _anonymize(self, batch):
+        if self.anonymize is None:
+            return batch
+        return [(ts, uid or self.anonymize(ip, ts), ip, is_real_uid) for ts, uid, ip, is_real_uid in batch]
+
+    def _write_batch(self, batch):
+        try:
+            batch = self._anonymize(batch)
+        except Exception as e:
+            self.errors += 1
+            log.error("Error hashing anonymous users, dropping batch of %d records: %s", len(batch), e)
+            return
+        fresh = self._deduplicate(batch)
+        lines_by_day = defaultdict(list)
+        real_uids = []
+        polls = []
+        logged = 0
+
+        for (ts, uid, ip, is_real_uid), is_new in zip(batch, fresh):
+            if not is_new and self.rollups is None:
+                continue
+            country = self.resolve_country(ip)
+            polls.append((ts, country, is_new))
+            if not is_new:
+                continue
+            logged += 1
+            day = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d")
+            entry = {
+                "ts": ts,
+                "uid": uid,
+                "country": country,
+            }
+            lines_by_day[day].append(json.dumps(entry) + "\n")
+            if is_real_uid:
+                real_uids.append((uid,))
+
+        try:
+            self.analytics_dir.mkdir(parents=True, exist_ok=True)
+            for day, lines in lines_by_day.items():
+                with open(self.analytics_dir / f"{day}.jsonl", "a") as f:
+                    f.write("".join(lines))
+            self.written += logged
+        except Exception as e:
+            self.errors += 1
+            log.error("Error writing batch of %d records: %s", len(batch), e)
+
+        # Log to unique users db only for real device UIDs from garmin watches
+        if real_uids:
+            try:
+                with self.users_db.transaction() as db:
+                    db.executemany(
+                        "INSERT OR IGNORE INTO unique_users (uid) VALUES (?)", real_uids
+                    )
+            except Exception as e:
+                self.errors += 1
+                log.error("Error saving real user ids: %s", e)
+
+        if self.rollups is not None and polls:
+            try:
+                self.rollups.add(polls)
+            except Exception as e:
+                self.errors += 1
+                log.error("Error updating rollups: %s", e)
+
+        self.batches += 1
+
+
+class AsyncAnalyticsWriter(AnalyticsWriter):
+    """
+    AnalyticsWriter for an asyncio event loop: submit() must be called on the
+    loop, which drains the queue in a task; batches are written by one
+    executor thread. Call `await aclose()` on shutdown to flush.
+    """
+
+    _Full = asyncio.QueueFull
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = None
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics-writer")
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self, timeout: float = 5.0):
+        """Stop accepting records (flushing needs the loop: use aclose())."""
+        self._closed = True
+
+    async def aclose(self, timeout: float = 5.0):
+        """Stop accepting records and flush everything still queued."""
+        if self._pid != os.getpid() or self._task is None or self._closed:
+            self._closed = True
+            return
+        self._closed = True
+        try:
+            await asyncio.wait_for(self._queue.put(_STOP), timeout)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.wait({self._task}, timeout=timeout)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        batch = []
+        deadline = None
+        stopping = False
+
+        while not stopping:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+            except asyncio.TimeoutError:
+                pass
+
+            if stopping:
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            if batch and (stopping or len(batch) >= self.batch_size
+                          or time.monotonic() >= deadline):
+                # Records keep queueing on the loop while the batch is written
+                await loop.run_in_executor(self._executor, self._write_batch, batch)
+                batch = []
+                deadline = None
+
+        await loop.run_in_executor(self._executor, self.users_db.close)
+        self._executor.shutdown(wait=False)
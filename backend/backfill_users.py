@@ -1,11 +1,28 @@
-import json
+"""
+Backfill users.db from the analytics day logs.
+
+Usage:
+    python backfill_users.py                  # Simple single-threaded backfill
+    python backfill_users.py --bulk           # Parallel, resumable bulk backfill
+    python backfill_users.py --bulk --full    # ...ignoring the per-file checkpoints
+"""
+
+import argparse
 import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+from analytics_log import day_files, iter_entries
+from db import Database
+
 BASE_DIR = Path(__file__).parent.resolve()
 ANALYTICS_DIR = BASE_DIR / "analytics"
 USERS_DB_PATH = BASE_DIR / "users.db"
 
+# Rows per executemany/transaction in bulk mode
+BULK_CHUNK_SIZE = 50000
+
 def backfill():
     print(f"Initializing database at {USERS_DB_PATH} (if not exists)...")
     conn = sqlite3.connect(str(USERS_DB_PATH))
@@ -21,8 +38,8 @@ def backfill():
         print(f"No analytics dir found at {ANALYTICS_DIR}")
         return
 
-    jsonl_files = sorted(ANALYTICS_DIR.glob("*.jsonl"))
-    print(f"Found {len(jsonl_files)} log files in {ANALYTICS_DIR}.")
+    log_files = day_files(ANALYTICS_DIR)
+    print(f"Found {len(log_files)} log files in {ANALYTICS_DIR}.")
 
     cursor = conn.cursor()
     cursor.execute("SELECT COUNT(*) FROM unique_users")
@@ -32,38 +49,27 @@ def backfill():
     scanned = 0
     skipped_16 = 0
 
-    for fpath in jsonl_files:
-        with open(fpath, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    data = json.loads(line)
-                    uid = data.get("uid")
-                    if uid:
-                        scanned += 1
-                        # Skip if length == 16 (assumed to be v1.4 hashed IP)
-                        if len(uid) == 16:
-                            skipped_16 += 1
-                            continue
-                        
-                        # Use the logged timestamp for first_seen if available
-                        ts = data.get("ts")
-                        
-                        if ts:
-                            conn.execute(
-                                "INSERT OR IGNORE INTO unique_users (uid, first_seen) VALUES (?, datetime(?, 'unixepoch'))", 
-                                (uid, ts)
-                            )
-                        else:
-                            conn.execute(
-                                "INSERT OR IGNORE INTO unique_users (uid) VALUES (?)", 
-                                (uid,)
-                            )
-                except json.JSONDecodeError:
+    for _, fpath in log_files:
+        for ts, uid, _ in iter_entries(fpath):
+            if uid:
+                scanned += 1
+                # Skip if length == 16 (assumed to be v1.4 hashed IP)
+                if len(uid) == 16:
+                    skipped_16 += 1
                     continue
 
+                # Use the logged timestamp for first_seen if available
+                if ts:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO unique_users (uid, first_seen) VALUES (?, datetime(?, 'unixepoch'))", 
+                        (uid, ts)
+                    )
+                else:
+                    conn.execute(
+                        "INSERT OR IGNORE INTO unique_users (uid) VALUES (?)", 
+                        (uid,)
+                    )
+
     conn.commit()
     
     cursor.execute("SELECT COUNT(*) FROM unique_users")
@@ -77,5 +83,139 @@ def backfill():
     print(f"Inserted {inserted} new distinct genuine device UIDs.")
     print(f"Total Unique Users in DB now: {count_after}")
 
+
+# --- Bulk mode ---
+
+def _parse_file(path_str: str):
+    """Worker: return ({uid: earliest ts or None}, scanned, skipped_16) for one day file."""
+    earliest = {}
+    scanned = 0
+    skipped_16 = 0
+    for ts, uid, _ in iter_entries(Path(path_str)):
+        if not uid:
+            continue
+        scanned += 1
+        # Skip if length == 16 (assumed to be v1.4 hashed IP)
+        if len(uid) == 16:
+            skipped_16 += 1
+            continue
+        ts = ts or None
+        if uid not in earliest:
+            earliest[uid] = ts
+        elif ts is not None and (earliest[uid] is None or ts < earliest[uid]):
+            earliest[uid] = ts
+    return earliest, scanned, skipped_16
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def bulk_backfill(workers: int = None, full: bool = False):
+    """
+    Parse day files in a process pool and insert deduplicated uids in large transactions.
+
+    Files already processed with the same size/mtime (checkpointed in the
+    backfill_files table) are skipped unless full=True. When a uid appears in
+    several files, the earliest first_seen wins, also against existing rows.
+    """
+    start = time.perf_counter()
+    db = Database(USERS_DB_PATH)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS unique_users (
+            uid TEXT PRIMARY KEY,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE IF NOT EXISTS backfill_files (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+    """)
+
+    if not ANALYTICS_DIR.exists():
+        print(f"No analytics dir found at {ANALYTICS_DIR}")
+        return
+
+    done = {} if full else {
+        name: (size, mtime_ns)
+        for name, size, mtime_ns in db.execute("SELECT name, size, mtime_ns FROM backfill_files")
+    }
+    todo = []
+    for _, fpath in day_files(ANALYTICS_DIR):
+        st = fpath.stat()
+        signature = (st.st_size, st.st_mtime_ns)
+        if done.get(fpath.name) != signature:
+            todo.append((fpath, signature))
+
+    count_before = db.execute("SELECT COUNT(*) FROM unique_users").fetchone()[0]
+    print(f"Users in DB before backfill: {count_before}")
+    print(f"{len(todo)} new or changed log files to process "
+          f"({len(done)} already checkpointed).")
+    if not todo:
+        return
+
+    # Parse in parallel, then merge keeping the earliest timestamp per uid
+    earliest = {}
+    scanned = 0
+    skipped_16 = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for file_uids, file_scanned, file_skipped in pool.map(
+            _parse_file, [str(f) for f, _ in todo], chunksize=4
+        ):
+            scanned += file_scanned
+            skipped_16 += file_skipped
+            for uid, ts in file_uids.items():
+                if uid not in earliest:
+                    earliest[uid] = ts
+                elif ts is not None and (earliest[uid] is None or ts < earliest[uid]):
+                    earliest[uid] = ts
+
+    with_ts = [(uid, ts) for uid, ts in earliest.items() if ts is not None]
+    without_ts = [(uid,) for uid, ts in earliest.items() if ts is None]
+
+    for chunk in _chunks(with_ts, BULK_CHUNK_SIZE):
+        with db.transaction():
+            db.executemany("""
+                INSERT INTO unique_users (uid, first_seen) VALUES (?, datetime(?, 'unixepoch'))
+                ON CONFLICT(uid) DO UPDATE SET first_seen = excluded.first_seen
+                WHERE excluded.first_seen < unique_users.first_seen
+            """, chunk)
+    for chunk in _chunks(without_ts, BULK_CHUNK_SIZE):
+        with db.transaction():
+            db.executemany("INSERT OR IGNORE INTO unique_users (uid) VALUES (?)", chunk)
+
+    # Checkpoint only after the uids are committed
+    with db.transaction():
+        db.executemany(
+            "INSERT OR REPLACE INTO backfill_files (name, size, mtime_ns) VALUES (?, ?, ?)",
+            [(f.name, size, mtime_ns) for f, (size, mtime_ns) in todo],
+        )
+
+    count_after = db.execute("SELECT COUNT(*) FROM unique_users").fetchone()[0]
+    db.close()
+
+    print(f"\n--- Bulk Backfill Summary ---")
+    print(f"Processed {len(todo)} files in {time.perf_counter() - start:.2f}s.")
+    print(f"Scanned {scanned} valid UID entries ({len(earliest)} distinct).")
+    print(f"Skipped {skipped_16} entries with length 16 (v1.4 hashed IPs).")
+    print(f"Inserted {count_after - count_before} new distinct genuine device UIDs.")
+    print(f"Total Unique Users in DB now: {count_after}")
+
+
 if __name__ == "__main__":
-    backfill()
+    parser = argparse.ArgumentParser(description="Backfill users.db from analytics logs")
+    parser.add_argument("--bulk", action="store_true",
+                        help="Parallel, resumable bulk mode")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Parser processes in bulk mode (default: CPU count)")
+    parser.add_argument("--full", action="store_true",
+                        help="Bulk mode: reprocess all files, ignoring checkpoints")
+    args = parser.parse_args()
+
+    if args.bulk:
+        bulk_backfill(workers=args.workers, full=args.full)
+    else:
+        backfill()
@@ -0,0 +1,121 @@
+"""
+SQLite Connection Manager
+=========================
+Persistent, per-thread SQLite connections for users.db and suggestions.db.
+
+- One connection per thread per process, opened on first use and reused, so
+  sqlite3's prepared-statement cache is reused across requests
+- WAL journal (readers never block the writer), synchronous=NORMAL and a
+  busy_timeout so concurrent gunicorn workers wait instead of failing with
+  "database is locked"
+- Fork-safe: a connection inherited from a parent process is never reused
+- Per-query latency stats (count, total, max) for /health, and an optional
+  observer callback (e.g. a /metrics histogram) called with every query's duration
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 128
+
+
+class Database:
+    """Lazily opened, per-thread SQLite connections to one database file."""
+
+    def __init__(self, path: Path, synchronous: str = "NORMAL", observer=None):
+        self.path = Path(path)
+        self.synchronous = synchronous
+        self.observer = observer   # observer(sql, seconds)
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    # --- Connections ---
+
+    def connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Forked (e.g. gunicorn --preload): drop the parent's connections
+            self._pid = os.getpid()
+            self._local = threading.local()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                str(self.path),
+                timeout=BUSY_TIMEOUT_MS / 1000,
+                isolation_level=None,  # autocommit; use transaction() for batches
+                cached_statements=STATEMENT_CACHE_SIZE,
+            )
+            conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """Close the calling thread's connection (if any)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    # --- Queries ---
+
+    def _record(self, sql: str, elapsed: float):
+        key = " ".join(sql.split())[:80]
+        with self._stats_lock:
+            entry = self._stats.get(key)
+            if entry is None:
+                entry = self._stats[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += elapsed
+            if elapsed > entry[2]:
+                entry[2] = elapsed
+        if self.observer is not None:
+            self.observer(sql, elapsed)
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return self.connection().execute(sql, params)
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        start = time.perf_counter()
+        try:
+            return self.connection().executemany(sql, seq_of_params)
+        finally:
+            self._record(sql, time.perf_counter() - start)
+
+    def executescript(self, script: str):
+        return self.connection().executescript(script)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run the block in one write transaction (BEGIN IMMEDIATE ... COMMIT)."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def stats(self) -> dict:
+        """Per-query latency stats for this process: {sql: {count, avg_ms, max_ms}}."""
+        with self._stats_lock:
+            return {
+                sql: {
+                    "count": count,
+                    "avg_ms": round(total * 1000 / count, 3),
+                    "max_ms": round(worst * 1000, 3),
+                }
+                for sql, (count, total, worst) in self._stats.items()
+            }
@@ -0,0 +1,178 @@
+"""
+Shared Dedup Store
+==================
+SQLite-backed "have we logged this user in the last hour?" table, shared by all
+gunicorn workers (and anything else that opens the same file).
+
+- Entries live in a ring of `slots` tables, one per time bucket of
+  `bucket_seconds`; a bucket expires by emptying its whole table when the ring
+  wraps around to it, so stale entries are dropped in O(1) instead of scanning
+- A lookup only consults the slots whose bucket still overlaps the dedup window
+- Data lives on disk (WAL, synchronous=OFF — it's a cache), so memory stays
+  bounded by SQLite's page cache no matter how many devices there are
+- Hit/miss/rotation counters are kept in the database itself, so stats() reports
+  totals across all workers
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class DedupStore:
+    """Cross-process dedup table with bucketed, O(1) expiry."""
+
+    def __init__(self, path: Path, interval: int = 3500, slots: int = 8):
+        if slots < 3:
+            raise ValueError("slots must be at least 3")
+        self.path = Path(path)
+        self.interval = interval
+        self.slots = slots
+        # Keep one spare slot so the window never overlaps the slot being recycled
+        self.bucket_seconds = math.ceil(interval / (slots - 2))
+        self.window_buckets = math.ceil(interval / self.bucket_seconds)
+
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._init_db()
+
+    # --- Connection handling ---
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        return conn
+
+    def _conn(self):
+        if self._pid != os.getpid():
+            # Never reuse a connection inherited across fork
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for slot in range(self.slots):
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS seen_{slot} (
+                        uid TEXT PRIMARY KEY,
+                        ts INTEGER NOT NULL
+                    ) WITHOUT ROWID
+                """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS slot_buckets (
+                    slot INTEGER PRIMARY KEY,
+                    bucket INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dedup_stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    # --- Dedup ---
+
+    def _rotate(self, conn, bucket: int):
+        """Make sure the current bucket owns its slot; return ({slot: bucket} of live slots, rotations)."""
+        slot_buckets = dict(conn.execute("SELECT slot, bucket FROM slot_buckets"))
+        rotations = 0
+
+        current_slot = bucket % self.slots
+        if slot_buckets.get(current_slot) != bucket:
+            # DELETE without WHERE lets SQLite drop the table's pages wholesale
+            conn.execute(f"DELETE FROM seen_{current_slot}")
+            conn.execute(
+                "INSERT OR REPLACE INTO slot_buckets (slot, bucket) VALUES (?, ?)",
+                (current_slot, bucket),
+            )
+            slot_buckets[current_slot] = bucket
+            rotations = 1
+
+        oldest_live = bucket - self.window_buckets
+        live = {s: b for s, b in slot_buckets.items() if oldest_live <= b <= bucket}
+        return live, rotations
+
+    def claim_many(self, items) -> list:
+        """
+        Claim a batch of (uid, ts) sightings in one transaction.
+
+        Returns a list of booleans: True if the sighting is new (not seen within
+        `interval` seconds, so it should be logged), False if it's a duplicate.
+        """
+        if not items:
+            return []
+
+        bucket = int(time.time()) // self.bucket_seconds
+        conn = self._conn()
+        results = []
+        hits = 0
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            live, rotations = self._rotate(conn, bucket)
+            current_table = f"seen_{bucket % self.slots}"
+            lookup_sql = "SELECT MAX(ts) FROM (" + " UNION ALL ".join(
+                f"SELECT ts FROM seen_{slot} WHERE uid = ?" for slot in sorted(live)
+            ) + ")"
+            n_live = len(live)
+
+            for uid, ts in items:
+                last_ts = conn.execute(lookup_sql, (uid,) * n_live).fetchone()[0]
+                if last_ts is not None and ts - last_ts < self.interval:
+                    results.append(False)
+                    hits += 1
+                    continue
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {current_table} (uid, ts) VALUES (?, ?)",
+                    (uid, int(ts)),
+                )
+                results.append(True)
+
+            conn.executemany(
+                "INSERT INTO dedup_stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                [("hits", hits), ("misses", len(items) - hits), ("rotations", rotations)],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        return results
+
+    def claim(self, uid: str, ts: float) -> bool:
+        """Claim a single sighting; see claim_many()."""
+        return self.claim_many([(uid, ts)])[0]
+
+    def stats(self) -> dict:
+        """Return hit/miss/rotation totals across all processes sharing the store."""
+        conn = self._conn()
+        counters = dict(conn.execute("SELECT name, value FROM dedup_stats"))
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "rotations": counters.get("rotations", 0),
+            "bucket_seconds": self.bucket_seconds,
+            "slots": self.slots,
+        }
@@ -1,21 +1,106 @@
 import requests
-import pandas as pd
+import csv
 import json
+import math
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 import pytz
 from io import StringIO
+from requests.adapters import HTTPAdapter
+
+from forecast_index import HourlyIndex
+from locations import DEFAULT_LOCATION, load_locations, location_data_path
+from payload_codec import publish_variants
+from snapshot import publish_json
+from snapshot_history import SnapshotHistory
+from upstream_cache import CACHE_DIR, UpstreamCache
 
 # --- CONFIGURATION ---
-# Nijmegen coordinates
-LAT = 51.847683
-LON = 5.862825
+# Published snapshot of the default location (served by analytics_server.py from
+# the repository root); other locations go to data/<key>.json (see locations.py)
+DATA_JSON_PATH = location_data_path(DEFAULT_LOCATION)
+
+# Per-source timings of the last run (exported on analytics_server's /metrics)
+FETCH_METRICS_PATH = Path(__file__).parent.resolve() / "fetch_metrics.json"
+
+# RWS Settings: one request covers the stations of all locations
+RWS_CSV_URL = "https://waterinfo.rws.nl/api/chart/get?locationCodes={codes}&values=-48,48&mapType=waterhoogte"
+
+# Open-Meteo Settings (KNMI HARMONIE AROME): one multi-coordinate request covers all locations
+OPEN_METEO_URL = "https://api.open-meteo.com/v1/forecast?latitude={lats}&longitude={lons}&hourly=visibility,precipitation,weather_code,wind_speed_10m,temperature_2m&models=knmi_harmonie_arome_netherlands&timezone=auto&forecast_days=3"
+
+# Hourly variables read from the forecast, and the horizons they're read at:
+# {name: (anchor, hour offset)}; anchors are resolved to the nearest time step
+WEATHER_VARIABLES = ("wind_speed_10m", "precipitation", "visibility", "weather_code", "temperature_2m")
+WEATHER_HORIZONS = {
+    "now": ("now", 0),
+    "+1h": ("now", 1),
+    "+2h": ("now", 2),
+    "+3h": ("now", 3),
+    "tmr09": ("tmr09", 0),
+}
+
+# HTTP Settings
+FETCH_DEADLINE = 60       # Total time budget (seconds) for fetching all sources
+REQUEST_TIMEOUT = 15      # Max time (seconds) for a single attempt
+MAX_ATTEMPTS = 4          # Attempts per source, within the deadline
+BACKOFF_BASE = 1.0        # First retry delay (seconds), doubled per attempt
+BACKOFF_CAP = 8.0         # Max retry delay (seconds) before jitter
+
+# --- HTTP ---
+_session = None
+
+
+def get_session():
+    """Shared requests session with a small connection pool (reused across sources)."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+
+def http_get(url, deadline, headers=None):
+    """
+    GET `url` with jittered exponential-backoff retries, giving up at `deadline`
+    (a time.monotonic() value). Retries connection errors, timeouts, 429 and 5xx.
+    """
+    last_error = None
+    for attempt in range(MAX_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            r = get_session().get(url, headers=headers, timeout=min(REQUEST_TIMEOUT, remaining))
+            if r.status_code != 429 and r.status_code < 500:
+                r.raise_for_status()
+                return r
+            last_error = requests.HTTPError(f"{r.status_code} from {url}", response=r)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            last_error = e
+
+        delay = min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.5)
+        if attempt + 1 < MAX_ATTEMPTS and time.monotonic() + delay < deadline:
+            print(f"  retrying in {delay:.1f}s after: {last_error}")
+            time.sleep(delay)
+        else:
+            break
+    raise last_error or requests.Timeout(f"Deadline exceeded before requesting {url}")
+
 
-# RWS Settings
-RWS_CSV_URL = "https://waterinfo.rws.nl/api/chart/get?locationCodes=lobith.bovenrijn.tolkamer&values=-48,48&mapType=waterhoogte"
+# Conditional requests (ETag / Last-Modified) with bodies and results kept on disk
+upstream_cache = UpstreamCache(CACHE_DIR, http_get)
+
+
+def _describe(response):
+    return "304 Not Modified" if response.status == "not_modified" else "unchanged upstream"
 
-# Open-Meteo Settings (KNMI HARMONIE AROME)
-OPEN_METEO_URL = f"https://api.open-meteo.com/v1/forecast?latitude={LAT}&longitude={LON}&hourly=visibility,precipitation,weather_code,wind_speed_10m,temperature_2m&models=knmi_harmonie_arome_netherlands&timezone=auto&forecast_days=3"
 # --- HELPER FUNCTIONS ---
 def get_wind_color(knots):
     """Convert wind speed to color code (0-7)"""
@@ -76,164 +161,395 @@ def get_fog_score(vis_m):
     return 0
 
 # --- RWS FETCHER ---
-def fetch_rws_data(now_dt):
-    """Fetch water level data from Rijkswaterstaat Lobith station"""
-    print(f"--- Fetching RWS Data (Lobith) ---")
+def _rws_columns(header):
+    """Return (measure_col, predict_col) indices of the RWS CSV header."""
+    # Find column containing "Waterhoogte" but not "verwachting"
+    measure_col = [i for i, c in enumerate(header) if "Waterhoogte" in c and "verwacht" not in c.lower()][0]
+    # Find column containing "Waterhoogte verwachting"
+    predict_col = [i for i, c in enumerate(header) if "verwacht" in c.lower()][0]
+    return measure_col, predict_col
+
+
+def _to_number(value):
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _rws_station_columns(header, label):
+    """(measure_col, predict_col) of one station in a multi-station CSV, or None."""
+    own = [i for i, c in enumerate(header) if label.lower() in c.lower()]
+    measure = [i for i in own if "Waterhoogte" in header[i] and "verwacht" not in header[i].lower()]
+    predict = [i for i in own if "verwacht" in header[i].lower()]
+    if not measure or not predict:
+        return None
+    return measure[0], predict[0]
+
+
+def parse_rws_stations(text, now_dt, labels=None):
+    """
+    Single-pass parse of the RWS waterhoogte CSV (`;`-separated).
+
+    Tracks the latest measurement at or before `now_dt` and the prediction
+    nearest to tomorrow 09:00 incrementally, for every station in `labels`
+    (matched against the column headers) or, with labels=None, for the only
+    station in the file. Returns {label: (water_now, water_tmr)} in cm;
+    stations whose columns aren't found are left out.
+    """
+    reader = csv.reader(StringIO(text), delimiter=';')
+    header = [c.lstrip('\ufeff') for c in next(reader)]
+    date_col = header.index('Datum')
+    time_col = header.index('Tijd (NL tijd)')
+    if labels is None:
+        stations = {None: _rws_columns(header)}
+    else:
+        stations = {label: _rws_station_columns(header, label) for label in labels}
+        stations = {label: cols for label, cols in stations.items() if cols is not None}
+    n_cols = max([date_col, time_col] + [c for cols in stations.values() for c in cols]) + 1
+    columns = list(stations.items())
+
+    tz = pytz.timezone('Europe/Amsterdam')
+    target_tmr = now_dt.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    # Compare everything as naive UTC; UTC offsets are resolved once per local hour
+    now_utc = now_dt.astimezone(pytz.utc).replace(tzinfo=None)
+    target_utc = target_tmr.astimezone(pytz.utc).replace(tzinfo=None)
+    offsets = {}
+
+    latest = {label: None for label in stations}    # (utc datetime, value) of the most recent past measurement
+    nearest = {label: None for label in stations}   # (|utc datetime - target|, utc datetime, value) of the closest prediction
+    for row in reader:
+        if len(row) < n_cols:
+            continue
+        values = [(label, _to_number(row[m]), _to_number(row[p])) for label, (m, p) in columns]
+        if all(measured is None and predicted is None for _, measured, predicted in values):
+            continue
+        try:
+            day, month, year = row[date_col].split('-')
+            hour, minute = row[time_col].split(':')
+            naive = datetime(int(year), int(month), int(day), int(hour), int(minute))
+        except ValueError:
+            continue
+
+        hour_key = naive.replace(minute=0)
+        if hour_key not in offsets:
+            try:
+                offsets[hour_key] = tz.localize(hour_key, is_dst=None).utcoffset()
+            except pytz.exceptions.InvalidTimeError:
+                # Ambiguous/non-existent DST hour: skipped, like pandas' NaT
+                offsets[hour_key] = None
+        offset = offsets[hour_key]
+        if offset is None:
+            continue
+        dt = naive - offset
+
+        for label, measured, predicted in values:
+            # 1. Current Water Level
+            if measured is not None and dt <= now_utc:
+                best = latest[label]
+                if best is None or dt >= best[0]:
+                    latest[label] = (dt, measured)
+
+            # 2. Tomorrow 09:00 Prediction
+            if predicted is not None:
+                candidate = (abs(dt - target_utc), dt, predicted)
+                best = nearest[label]
+                if best is None or candidate[:2] < best[:2]:
+                    nearest[label] = candidate
+
+    return {
+        label: (
+            int(latest[label][1]) if latest[label] else 0,
+            int(nearest[label][2]) if nearest[label] else 0,
+        )
+        for label in stations
+    }
+
+
+def parse_rws_csv(text, now_dt):
+    """Parse a single-station RWS CSV. Returns (water_now, water_tmr) in cm."""
+    return parse_rws_stations(text, now_dt)[None]
+
+
+def parse_rws_csv_pandas(text, now_dt):
+    """Reference pandas implementation of parse_rws_csv (requires pandas)."""
+    import pandas as pd
+
+    df = pd.read_csv(StringIO(text), sep=';')
+
+    # Provide format parsing for dates
+    df['datetime'] = pd.to_datetime(
+        df['Datum'] + ' ' + df['Tijd (NL tijd)'], 
+        format='%d-%m-%Y %H:%M'
+    )
+    tz = pytz.timezone('Europe/Amsterdam')
+    df['datetime'] = df['datetime'].dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
+
+    # 1. Current Water Level
+    measure_col = df.columns[_rws_columns(list(df.columns))[0]]
+    df = df.sort_values('datetime')
+    past_df = df[(df['datetime'] <= now_dt) & (df[measure_col].notna())]
+    water_now = int(past_df.iloc[-1][measure_col]) if not past_df.empty else 0
+
+    # 2. Tomorrow 09:00 Prediction
+    predict_col = df.columns[_rws_columns(list(df.columns))[1]]
+    target_tmr = now_dt.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    df['diff'] = (df['datetime'] - target_tmr).abs()
+    pred_df = df[df[predict_col].notna()]
+
+    water_tmr = 0
+    if not pred_df.empty:
+        water_tmr = int(pred_df.loc[pred_df['diff'].idxmin()][predict_col])
+    return water_now, water_tmr
+
+
+def _rws_context(now_dt, stations):
+    # Measurements only ever lie in the past, so an unchanged body gives the
+    # same latest measurement; the prediction depends only on tomorrow's date
+    # and the UTC offset the 09:00 target is built with (it changes with DST)
+    return f"{(now_dt + timedelta(days=1)).date()}/{now_dt.utcoffset()}/{','.join(stations)}"
+
+
+def fetch_rws_levels(now_dt, locations, deadline=None):
+    """
+    Fetch water levels for every location from Rijkswaterstaat, with one request
+    for all distinct stations. Returns {key: (water_now, water_tmr)}.
+    """
+    stations = {}
+    for loc in locations.values():
+        stations.setdefault(loc["rws"], loc["rws_label"])
+    print(f"--- Fetching RWS Data ({', '.join(stations.values())}) ---")
+    if deadline is None:
+        deadline = time.monotonic() + FETCH_DEADLINE
+    levels = {}
     try:
         headers = {
             "User-Agent": "Mozilla/5.0 (RowingMonitor/1.0)", 
             "Accept": "text/csv"
         }
-        r = requests.get(RWS_CSV_URL, headers=headers, timeout=15)
-        r.raise_for_status()
-        
-        df = pd.read_csv(StringIO(r.text), sep=';')
-        
-        # Provide format parsing for dates
-        df['datetime'] = pd.to_datetime(
-            df['Datum'] + ' ' + df['Tijd (NL tijd)'], 
-            format='%d-%m-%Y %H:%M'
-        )
-        tz = pytz.timezone('Europe/Amsterdam')
-        df['datetime'] = df['datetime'].dt.tz_localize(tz, ambiguous='NaT', nonexistent='NaT')
-        
-        # 1. Current Water Level
-        # Find column containing "Waterhoogte" but not "verwachting"
-        measure_col = [c for c in df.columns if "Waterhoogte" in c and "verwacht" not in c.lower()][0]
-        df = df.sort_values('datetime')
-        past_df = df[(df['datetime'] <= now_dt) & (df[measure_col].notna())]
-        water_now = int(past_df.iloc[-1][measure_col]) if not past_df.empty else 0
-
-        # 2. Tomorrow 09:00 Prediction
-        # Find column containing "Waterhoogte verwachting"
-        predict_col = [c for c in df.columns if "verwacht" in c.lower()][0]
-        target_tmr = now_dt.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        df['diff'] = (df['datetime'] - target_tmr).abs()
-        pred_df = df[df[predict_col].notna()]
-        
-        water_tmr = 0
-        if not pred_df.empty:
-            water_tmr = int(pred_df.loc[pred_df['diff'].idxmin()][predict_col])
+        r = upstream_cache.get(RWS_CSV_URL.format(codes=",".join(stations)), deadline, headers=headers)
+        context = _rws_context(now_dt, stations)
+        cached = r.reuse(context)
+        if cached is not None:
+            levels = cached
+            print(f"✓ RWS {_describe(r)}, reusing parsed values")
+        else:
+            if len(stations) == 1:
+                (code,) = stations
+                levels = {code: parse_rws_csv(r.text, now_dt)}
+            else:
+                by_label = parse_rws_stations(r.text, now_dt, list(stations.values()))
+                levels = {code: by_label[label] for code, label in stations.items() if label in by_label}
+            r.save_result(context, {code: list(value) for code, value in levels.items()})
 
-        print(f"✓ RWS Success: Now={water_now}cm, Tmr@9={water_tmr}cm")
-        return water_now, water_tmr
+        for code, label in stations.items():
+            if code in levels:
+                water_now, water_tmr = levels[code]
+                print(f"✓ RWS Success ({label}): Now={water_now}cm, Tmr@9={water_tmr}cm")
+            else:
+                print(f"✗ RWS Error ({label}): station not found in CSV")
         
     except Exception as e:
         print(f"✗ RWS Error: {e}")
-        return 0, 0
+
+    return {key: tuple(levels.get(loc["rws"], (0, 0))) for key, loc in locations.items()}
+
+
+def fetch_rws_data(now_dt, deadline=None):
+    """Fetch water level data for the default location (Rijkswaterstaat Lobith station)"""
+    locations = {DEFAULT_LOCATION: load_locations()[DEFAULT_LOCATION]}
+    return fetch_rws_levels(now_dt, locations, deadline)[DEFAULT_LOCATION]
     
     
 # --- OPEN-METEO FETCHER ---
-def fetch_weather_data(now_dt):
-    """Fetch weather forecast from Open-Meteo (KNMI HARMONIE AROME)"""
-    print(f"--- Fetching Weather Data (Open-Meteo / KNMI HARMONIE) ---")
+def _weather_context(now_dt, locations):
+    # The values depend only on the forecast step nearest to now (hourly,
+    # ties to the earlier step, compared at full precision like
+    # HourlyIndex.nearest) and on tomorrow's date
+    now = now_dt.replace(tzinfo=None)
+    hour = now.replace(minute=0, second=0, microsecond=0)
+    nearest_hour = hour + timedelta(hours=1) if now - hour > timedelta(minutes=30) else hour
+    return f"{nearest_hour:%Y-%m-%dT%H}/{(now + timedelta(days=1)).date()}/{','.join(locations)}"
+
+
+def weather_values(hourly, now_dt, name=""):
+    """Compute the 9 weather values of the packed array from one location's hourly forecast"""
+    prefix = f" ({name})" if name else ""
+    index = HourlyIndex(hourly)
+    if not len(index):
+        print(f"✗ Could not find current time in forecast data{prefix}")
+        return [0] * 9
+
+    # Resolve all anchors with one binary search, then read every variable
+    # for every horizon with one batched gather
+    target_tmr = now_dt.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    anchors = dict(zip(
+        ("now", "tmr09"),
+        (int(i) for i in index.nearest([now_dt.replace(tzinfo=None), target_tmr.replace(tzinfo=None)])),
+    ))
+    current_idx = anchors["now"]
+    print(f"✓ Found current time{prefix}: {index.time_at(current_idx)} (index {current_idx})")
+
+    slots = {name: i for i, name in enumerate(WEATHER_HORIZONS)}
+    columns = index.gather(
+        WEATHER_VARIABLES,
+        [anchors[anchor] + offset for anchor, offset in WEATHER_HORIZONS.values()],
+    )
+
+    # Helper to safely get value (missing/None → default)
+    def safe_get(variable, horizon, default=0):
+        val = columns[variable][slots[horizon]]
+        return default if math.isnan(val) else float(val)
     
-    try:
-        r = requests.get(OPEN_METEO_URL, timeout=15)
-        r.raise_for_status()
-        
-        data = r.json()
-        hourly = data['hourly']
-        
-        # Parse time array to datetime objects
-        times = [datetime.fromisoformat(t) for t in hourly['time']]
-        
-        # Find index closest to current time
-        current_idx = None
-        min_diff = timedelta(hours=999)
+    # Convert wind from km/h to knots (1 km/h = 0.539957 knots)
+    def kmh_to_knots(kmh):
+        return int(kmh * 0.539957) if kmh is not None else 0
+    
+    # Get wind values
+    wind_now = kmh_to_knots(safe_get('wind_speed_10m', 'now'))
+    wind_plus1 = kmh_to_knots(safe_get('wind_speed_10m', '+1h'))
+    wind_plus2 = kmh_to_knots(safe_get('wind_speed_10m', '+2h'))
+    wind_plus3 = kmh_to_knots(safe_get('wind_speed_10m', '+3h'))
+    wind_tmr = kmh_to_knots(safe_get('wind_speed_10m', 'tmr09')) if anchors["tmr09"] else wind_now
+    
+    # Precipitation: sum of next 2 hours
+    precip_next2h = round(
+        safe_get('precipitation', '+1h') + 
+        safe_get('precipitation', '+2h'),
+        1
+    )
+    
+    # Sun and fog scores (use current values)
+    sun_score = get_sun_score(safe_get('weather_code', 'now'))
+    fog_score = get_fog_score(safe_get('visibility', 'now'))
+    temp_now = round(safe_get('temperature_2m', 'now'))
+
+    print(f"✓ Weather Success{prefix}:")
+    print(f"  Wind: Now={wind_now}kts, +1h={wind_plus1}kts, +2h={wind_plus2}kts, +3h={wind_plus3}kts, Tmr@9={wind_tmr}kts")
+    print(f"  Precipitation (next 2h): {precip_next2h}mm")
+    print(f"  Visibility: {safe_get('visibility', 'now')}m → Fog Score: {fog_score}")
+    print(f"  Weather Code: {safe_get('weather_code', 'now')} → Sun Score: {sun_score}")
+    
+    # Return: [Precip, WindNow, Wind+1, Wind+2, Wind+3, WindTmr@9, Sun, Fog, Temp]
+    return [
+        precip_next2h,
+        wind_now,
+        wind_plus1,
+        wind_plus2,
+        wind_plus3,
+        wind_tmr,
+        sun_score,
+        fog_score,
+        temp_now
+    ]
+
+
+def weather_values_reference(hourly, now_dt):
+    """Reference implementation of weather_values: the original linear scans over the time array."""
+    times = [datetime.fromisoformat(t) for t in hourly['time']]
+    if not times:
+        return [0] * 9
+
+    def nearest(target):
+        # Ties go to the earlier step (strict <), compared at full precision
+        best, min_diff = None, timedelta(hours=999)
         for i, t in enumerate(times):
-            diff = abs(t - now_dt.replace(tzinfo=None))
+            diff = abs(t - target)
             if diff < min_diff:
-                min_diff = diff
-                current_idx = i
-        
-        if current_idx is None:
-            print("✗ Could not find current time in forecast data")
-            return [0] * 8
-        
-        print(f"✓ Found current time: {times[current_idx]} (index {current_idx})")
-        
-        # Extract values
-        wind_kmh = hourly['wind_speed_10m']
-        precip_mm = hourly['precipitation']
-        visibility_m = hourly['visibility']
-        weather_codes = hourly['weather_code']
-        temps_c = hourly['temperature_2m']
-        
-        # Helper to safely get value
-        def safe_get(arr, idx, default=0):
-            try:
-                val = arr[idx] if idx < len(arr) else default
-                return val if val is not None else default
-            except:
-                return default
-        
-        # Convert wind from km/h to knots (1 km/h = 0.539957 knots)
-        def kmh_to_knots(kmh):
-            return int(kmh * 0.539957) if kmh is not None else 0
-        
-        # Get wind values
-        wind_now = kmh_to_knots(safe_get(wind_kmh, current_idx))
-        wind_plus1 = kmh_to_knots(safe_get(wind_kmh, current_idx + 1))
-        wind_plus2 = kmh_to_knots(safe_get(wind_kmh, current_idx + 2))
-        wind_plus3 = kmh_to_knots(safe_get(wind_kmh, current_idx + 3))
-        
-        # Find tomorrow at 9:00
-        target_tmr = now_dt.replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
-        target_tmr = target_tmr.replace(tzinfo=None)
-        
-        tmr_idx = None
-        min_tmr_diff = timedelta(hours=999)
-        for i, t in enumerate(times):
-            diff = abs(t - target_tmr)
-            if diff < min_tmr_diff:
-                min_tmr_diff = diff
-                tmr_idx = i
-        
-        wind_tmr = kmh_to_knots(safe_get(wind_kmh, tmr_idx)) if tmr_idx else wind_now
-        
-        # Precipitation: sum of next 2 hours
-        precip_next2h = round(
-            safe_get(precip_mm, current_idx + 1, 0) + 
-            safe_get(precip_mm, current_idx + 2, 0),
-            1
+                best, min_diff = i, diff
+        return best
+
+    current_idx = nearest(now_dt.replace(tzinfo=None))
+    tmr_idx = nearest((now_dt.replace(hour=9, minute=0, second=0, microsecond=0)
+                       + timedelta(days=1)).replace(tzinfo=None))
+
+    def safe_get(name, idx, default=0):
+        arr = hourly.get(name, [])
+        val = arr[idx] if idx < min(len(arr), len(times)) else default
+        return val if val is not None else default
+
+    def kmh_to_knots(kmh):
+        return int(kmh * 0.539957) if kmh is not None else 0
+
+    wind_now = kmh_to_knots(safe_get('wind_speed_10m', current_idx))
+    return [
+        round(safe_get('precipitation', current_idx + 1) + safe_get('precipitation', current_idx + 2), 1),
+        wind_now,
+        kmh_to_knots(safe_get('wind_speed_10m', current_idx + 1)),
+        kmh_to_knots(safe_get('wind_speed_10m', current_idx + 2)),
+        kmh_to_knots(safe_get('wind_speed_10m', current_idx + 3)),
+        kmh_to_knots(safe_get('wind_speed_10m', tmr_idx)) if tmr_idx else wind_now,
+        get_sun_score(safe_get('weather_code', current_idx)),
+        get_fog_score(safe_get('visibility', current_idx)),
+        round(safe_get('temperature_2m', current_idx)),
+    ]
+
+
+def fetch_weather_forecasts(now_dt, locations, deadline=None):
+    """
+    Fetch weather forecasts for every location from Open-Meteo (KNMI HARMONIE AROME)
+    with one multi-coordinate request. Returns {key: [9 weather values]}.
+    """
+    print(f"--- Fetching Weather Data (Open-Meteo / KNMI HARMONIE) ---")
+    if deadline is None:
+        deadline = time.monotonic() + FETCH_DEADLINE
+    
+    try:
+        url = OPEN_METEO_URL.format(
+            lats=",".join(str(loc["lat"]) for loc in locations.values()),
+            lons=",".join(str(loc["lon"]) for loc in locations.values()),
         )
-        
-        # Sun and fog scores (use current values)
-        sun_score = get_sun_score(safe_get(weather_codes, current_idx))
-        fog_score = get_fog_score(safe_get(visibility_m, current_idx))
-        temp_now = round(safe_get(temps_c, current_idx, 0))
-
-        print(f"✓ Weather Success:")
-        print(f"  Wind: Now={wind_now}kts, +1h={wind_plus1}kts, +2h={wind_plus2}kts, +3h={wind_plus3}kts, Tmr@9={wind_tmr}kts")
-        print(f"  Precipitation (next 2h): {precip_next2h}mm")
-        print(f"  Visibility: {safe_get(visibility_m, current_idx)}m → Fog Score: {fog_score}")
-        print(f"  Weather Code: {safe_get(weather_codes, current_idx)} → Sun Score: {sun_score}")
-        
-        # Return: [Precip, WindNow, Wind+1, Wind+2, Wind+3, WindTmr@9, Sun, Fog]
-        return [
-            precip_next2h,
-            wind_now,
-            wind_plus1,
-            wind_plus2,
-            wind_plus3,
-            wind_tmr,
-            sun_score,
-            fog_score,
-            temp_now
-        ]
+        r = upstream_cache.get(url, deadline)
+
+        context = _weather_context(now_dt, locations)
+        cached = r.reuse(context)
+        if cached is not None:
+            print(f"✓ Weather {_describe(r)}, reusing computed values")
+            return cached
+
+        data = json.loads(r.text)
+        # One coordinate pair returns an object, several return a list (same order)
+        forecasts = data if isinstance(data, list) else [data]
+        if len(forecasts) != len(locations):
+            raise ValueError(f"expected {len(locations)} forecasts, got {len(forecasts)}")
+
+        results = {}
+        for (key, loc), forecast in zip(locations.items(), forecasts):
+            try:
+                results[key] = weather_values(forecast['hourly'], now_dt, loc["name"] if len(locations) > 1 else "")
+            except Exception as e:
+                print(f"✗ Weather Error ({loc['name']}): {e}")
+                results[key] = [0] * 9
+        r.save_result(context, results)
+        return results
         
     except Exception as e:
         print(f"✗ Weather Error: {e}")
         import traceback
         traceback.print_exc()
-        return [0] * 8
+        return {key: [0] * 9 for key in locations}
+
+
+def fetch_weather_data(now_dt, deadline=None):
+    """Fetch the weather forecast for the default location (Nijmegen)"""
+    locations = {DEFAULT_LOCATION: load_locations()[DEFAULT_LOCATION]}
+    return fetch_weather_forecasts(now_dt, locations, deadline)[DEFAULT_LOCATION]
+
+def _timed(fn, *args):
+    start = time.monotonic()
+    result = fn(*args)
+    return result, time.monotonic() - start
+
 
 def main():
     """Main execution function"""
+    locations = load_locations()
     print("=" * 70)
-    print("Garmin Rowing Data Fetcher - Nijmegen")
-    print("Using Open-Meteo (KNMI HARMONIE AROME) + RWS Lobith")
+    print(f"Garmin Rowing Data Fetcher - {', '.join(loc['name'] for loc in locations.values())}")
+    print("Using Open-Meteo (KNMI HARMONIE AROME) + RWS")
     print("=" * 70)
     
     # Get current time in Amsterdam timezone
@@ -241,25 +557,61 @@ def main():
     now = datetime.now(tz)
     print(f"Fetch time: {now.strftime('%Y-%m-%d %H:%M:%S %Z')}\n")
     
-    # Fetch data
-    w_now, w_tmr = fetch_rws_data(now)
-    weather_data = fetch_weather_data(now)
+    # Fetch both sources concurrently within one deadline budget; each source is
+    # one request covering every location
+    deadline = time.monotonic() + FETCH_DEADLINE
+    fetch_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        rws_future = pool.submit(_timed, fetch_rws_levels, now, locations, deadline)
+        weather_future = pool.submit(_timed, fetch_weather_forecasts, now, locations, deadline)
+        water_levels, rws_seconds = rws_future.result()
+        weather, weather_seconds = weather_future.result()
+    timings = {
+        "rws": round(rws_seconds, 3),
+        "weather": round(weather_seconds, 3),
+        "total": round(time.monotonic() - fetch_start, 3),
+    }
     
-    # Pack into array: [Timestamp, WaterNow, WaterTmr, ...Weather data...]
-    packed = [int(now.timestamp()), w_now, w_tmr] + weather_data
+    # Pack into arrays: [Timestamp, WaterNow, WaterTmr, ...Weather data...]
+    payloads = {
+        key: [int(now.timestamp()), *water_levels[key]] + weather[key]
+        for key in locations
+    }
     
     # Output
     print("\n" + "=" * 70)
     print("FINAL PACKED JSON")
     print("=" * 70)
-    print(json.dumps(packed))
+    for key, packed in payloads.items():
+        print(f"{key}: {json.dumps(packed)}")
     print("\nFormat: [Timestamp, WaterNow, WaterTmr, Precip2h, WindNow, Wind+1, Wind+2, Wind+3, WindTmr@9, Sun, Fog, Temp]")
-    print(f"Array length: {len(packed)} (expected: 12)")
+    print(f"Array length: {len(payloads[DEFAULT_LOCATION])} (expected: 12)")
+    print(f"Fetch timings (s): RWS={timings['rws']}, Weather={timings['weather']}, "
+          f"Total={timings['total']}")
+    for url, counters in upstream_cache.stats().items():
+        print(f"Upstream cache {url[:60]}...: requests={counters['requests']}, "
+              f"304={counters['not_modified']}, identical={counters['identical']}, "
+              f"parses skipped={counters['parses_skipped']}, bytes saved={counters['bytes_saved']}")
     
-    # Save to file
-    with open("data.json", "w") as f:
-        json.dump(packed, f)
-    print("\n✓ Saved to data.json")
+    # Publish atomically (temp file + rename) so the server never reads a partial
+    # file; every location gets JSON plus binary and precompressed variants
+    print()
+    for key, packed in payloads.items():
+        path = location_data_path(key)
+        etag = publish_variants(path, packed)
+        print(f"✓ Saved to {path} (version {etag})")
+
+    # Keep the default location's snapshot for trend charts (/api/history)
+    try:
+        if SnapshotHistory().append(payloads[DEFAULT_LOCATION]):
+            print("✓ Appended to snapshot history")
+    except Exception as e:
+        print(f"✗ History Error: {e}")
+
+    try:
+        publish_json(FETCH_METRICS_PATH, {"finished": round(time.time(), 3), "timings": timings})
+    except OSError as e:
+        print(f"✗ Could not save fetch metrics: {e}")
 
 if __name__ == "__main__":
     main()
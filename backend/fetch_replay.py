@@ -0,0 +1,398 @@
+"""
+Fetch Replay
+============
+Record/replay fixtures for the fetch_data.py pipeline, so it can be tested and
+benchmarked without network.
+
+A fixture is one recorded fetch cycle in fixtures/<name>/:
+- meta.json          recording time, the location registry used, and per source
+                     the URL, response headers and body file
+- rws.csv            RWS waterhoogte CSV body
+- open_meteo.json    Open-Meteo forecast body
+- expected.json      packed arrays per replayed cycle (written by `check --update`)
+
+Replaying swaps fetch_data's HTTP session for a stand-in that answers from the
+fixture (including 304s for conditional requests) and points the upstream
+cache at a temp dir, then runs the real fetch_rws_levels / fetch_weather_forecasts.
+Each fixture is replayed as many cycles: one every 15 minutes from its
+recording time (`--cycles`, default 96 = one day).
+
+Usage:
+    python fetch_replay.py record [--name NAME]       # Capture live responses (needs network)
+    python fetch_replay.py synthesize [--name NAME]   # Generate a synthetic fixture (no network)
+    python fetch_replay.py check [--update]           # Replay all fixtures, compare with expected.json
+                                                      # and with the reference implementations
+    python fetch_replay.py bench [--pandas]           # Time parsing + scoring + packing per cycle
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytz
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import fetch_data
+from locations import load_locations
+from upstream_cache import UpstreamCache
+
+FIXTURES_DIR = Path(__file__).parent.resolve() / "fixtures"
+CYCLE_STEP = timedelta(minutes=15)
+TZ = pytz.timezone("Europe/Amsterdam")
+
+SOURCES = {
+    # source: (body file, host substring)
+    "rws": ("rws.csv", "waterinfo.rws.nl"),
+    "weather": ("open_meteo.json", "open-meteo.com"),
+}
+
+
+# --- Fixtures ---
+
+class Fixture:
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text())
+        self.name = self.path.name
+        self.recorded = datetime.fromisoformat(self.meta["recorded"])
+        self.locations = self.meta["locations"]
+
+    def body(self, source) -> bytes:
+        return (self.path / self.meta["sources"][source]["file"]).read_bytes()
+
+    def cycles(self, count=96) -> list:
+        """The `now` of every replayed cycle."""
+        return [(self.recorded + i * CYCLE_STEP).astimezone(TZ) for i in range(count)]
+
+
+def list_fixtures(directory: Path = FIXTURES_DIR) -> list:
+    return [Fixture(path.parent) for path in sorted(Path(directory).glob("*/meta.json"))]
+
+
+def _write_fixture(name, recorded, locations, sources, directory: Path = FIXTURES_DIR) -> Path:
+    """sources: {source: (url, headers, body bytes)}"""
+    path = Path(directory) / name
+    path.mkdir(parents=True, exist_ok=True)
+    meta = {"recorded": recorded.isoformat(), "locations": locations, "sources": {}}
+    for source, (url, headers, body) in sources.items():
+        file_name = SOURCES[source][0]
+        (path / file_name).write_bytes(body)
+        meta["sources"][source] = {"url": url, "headers": dict(headers), "file": file_name}
+    (path / "meta.json").write_text(json.dumps(meta, indent=2))
+    return path
+
+
+def _urls(locations):
+    stations = dict.fromkeys(loc["rws"] for loc in locations.values())
+    return {
+        "rws": fetch_data.RWS_CSV_URL.format(codes=",".join(stations)),
+        "weather": fetch_data.OPEN_METEO_URL.format(
+            lats=",".join(str(loc["lat"]) for loc in locations.values()),
+            lons=",".join(str(loc["lon"]) for loc in locations.values()),
+        ),
+    }
+
+
+def record(name=None) -> Path:
+    """Capture the live RWS and Open-Meteo responses for the current registry."""
+    locations = load_locations()
+    now = datetime.now(TZ)
+    deadline = time.monotonic() + fetch_data.FETCH_DEADLINE
+    headers = {"User-Agent": "Mozilla/5.0 (RowingMonitor/1.0)", "Accept": "text/csv"}
+    sources = {}
+    for source, url in _urls(locations).items():
+        r = fetch_data.http_get(url, deadline, headers=headers if source == "rws" else None)
+        kept = {k: v for k, v in r.headers.items() if k.lower() in ("etag", "last-modified", "content-type")}
+        sources[source] = (url, kept, r.content)
+    return _write_fixture(name or now.strftime("%Y%m%dT%H%M"), now, locations, sources)
+
+
+def synthesize(name="synthetic", seed=1, recorded=None) -> Path:
+    """Generate a fixture shaped like the real responses (for offline CI; not real data)."""
+    rng = random.Random(seed)
+    locations = load_locations()
+    # Seconds past the quarter hour, so cycles hit hh:30:30 (nearest-step rounding)
+    recorded = recorded or TZ.localize(datetime(2026, 3, 28, 14, 0, 30))
+    midnight = recorded.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+    labels = list(dict.fromkeys(loc["rws_label"] for loc in locations.values()))
+    header = ["Datum", "Tijd (NL tijd)"]
+    for label in labels:
+        header += [f"Waterhoogte Oppervlaktewater t.o.v. Normaal Amsterdams Peil in cm {label}",
+                   f"Waterhoogte verwachting Oppervlaktewater t.o.v. Normaal Amsterdams Peil in cm {label}"]
+    lines = [";".join(header)]
+    now_naive = recorded.replace(tzinfo=None)
+    level = 900.0
+    t = now_naive - timedelta(hours=48)
+    while t <= now_naive + timedelta(hours=48):
+        level += rng.uniform(-2, 2)
+        row = [t.strftime("%d-%m-%Y"), t.strftime("%H:%M")]
+        for i, _ in enumerate(labels):
+            measured = f"{level + 30 * i:.0f}" if t <= now_naive and rng.random() > 0.02 else ""
+            predicted = f"{level + 30 * i + rng.uniform(-5, 5):.0f}" if t >= now_naive - timedelta(hours=6) else ""
+            row += [measured, predicted]
+        lines.append(";".join(row))
+        t += timedelta(minutes=10)
+    rws_body = ("\ufeff" + "\n".join(lines) + "\n").encode("utf-8")
+
+    forecasts = []
+    for loc in locations.values():
+        times = [(midnight + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M") for h in range(72)]
+        def series(fn, missing=0.03):
+            return [None if rng.random() < missing else fn(h) for h in range(72)]
+        forecasts.append({
+            "latitude": loc["lat"], "longitude": loc["lon"], "timezone": "Europe/Amsterdam",
+            "hourly": {
+                "time": times,
+                "visibility": series(lambda h: round(rng.choice([300, 1500, 5000, 24000, 50000]) * 1.0, 1)),
+                "precipitation": series(lambda h: round(max(0.0, rng.gauss(0.2, 0.6)), 1)),
+                "weather_code": series(lambda h: rng.choice([0, 1, 2, 3, 45, 61, 80])),
+                "wind_speed_10m": series(lambda h: round(abs(15 + 10 * math.sin(h / 5) + rng.gauss(0, 4)), 1)),
+                "temperature_2m": series(lambda h: round(8 + 5 * math.sin((h - 9) / 24 * 2 * math.pi), 1)),
+            },
+        })
+    weather_body = json.dumps(forecasts[0] if len(forecasts) == 1 else forecasts).encode("utf-8")
+
+    urls = _urls(locations)
+    return _write_fixture(name, recorded, locations, {
+        "rws": (urls["rws"], {"Content-Type": "text/csv", "ETag": '"synthetic-rws"'}, rws_body),
+        "weather": (urls["weather"], {"Content-Type": "application/json"}, weather_body),
+    })
+
+
+# --- Replay ---
+
+class FixtureSession:
+    """Stands in for fetch_data's requests.Session, answering from a fixture."""
+
+    def __init__(self, fixture: Fixture):
+        self.fixture = fixture
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        for source, (_, host) in SOURCES.items():
+            if host in url:
+                break
+        else:
+            raise requests.ConnectionError(f"no fixture for {url}")
+        recorded = self.fixture.meta["sources"][source]
+        response = requests.Response()
+        response.url = url
+        response.headers = CaseInsensitiveDict(recorded["headers"])
+        etag = recorded["headers"].get("ETag")
+        if etag and (headers or {}).get("If-None-Match") == etag:
+            response.status_code = 304
+            response._content = b""
+        else:
+            response.status_code = 200
+            response._content = self.fixture.body(source)
+        response.encoding = "utf-8"
+        return response
+
+
+@contextlib.contextmanager
+def replaying(fixture: Fixture, quiet=True):
+    """Point fetch_data at `fixture` (HTTP session + a throw-away upstream cache)."""
+    saved = fetch_data._session, fetch_data.upstream_cache
+    cache_dir = Path(tempfile.mkdtemp(prefix="fetch-replay-"))
+    fetch_data._session = FixtureSession(fixture)
+    fetch_data.upstream_cache = UpstreamCache(cache_dir, fetch_data.http_get)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+            yield
+    finally:
+        fetch_data._session, fetch_data.upstream_cache = saved
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def replay_cycle(fixture: Fixture, now) -> dict:
+    """Run one fetch cycle at `now` against the fixture; returns {location: packed array}."""
+    locations = fixture.locations
+    levels = fetch_data.fetch_rws_levels(now, locations)
+    weather = fetch_data.fetch_weather_forecasts(now, locations)
+    return {key: [int(now.timestamp()), *levels[key]] + weather[key] for key in locations}
+
+
+def replay(fixture: Fixture, cycles=96) -> dict:
+    """{now isoformat: {location: packed array}} for every cycle of the fixture."""
+    with replaying(fixture):
+        return {now.isoformat(): replay_cycle(fixture, now) for now in fixture.cycles(cycles)}
+
+
+def reference_mismatches(fixture: Fixture, cycles=96) -> dict:
+    """
+    {check: [cycle isoformat]} where fetch_data disagrees with its reference
+    implementation on the fixture: weather_values vs weather_values_reference,
+    and parse_rws_csv vs parse_rws_csv_pandas (single-station fixtures, only
+    if pandas is installed; None when skipped).
+    """
+    rws_text = fixture.body("rws").decode("utf-8")
+    data = json.loads(fixture.body("weather"))
+    forecasts = data if isinstance(data, list) else [data]
+    labels = set(loc["rws_label"] for loc in fixture.locations.values())
+    try:
+        import pandas  # noqa: F401
+        compare_rws = len(labels) == 1
+    except ImportError:
+        compare_rws = False
+
+    result = {"weather": [], "rws_pandas": [] if compare_rws else None}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for now in fixture.cycles(cycles):
+            for forecast in forecasts:
+                if (fetch_data.weather_values(forecast["hourly"], now)
+                        != fetch_data.weather_values_reference(forecast["hourly"], now)):
+                    result["weather"].append(now.isoformat())
+                    break
+            if compare_rws and (tuple(fetch_data.parse_rws_csv(rws_text, now))
+                                != tuple(fetch_data.parse_rws_csv_pandas(rws_text, now))):
+                result["rws_pandas"].append(now.isoformat())
+    return result
+
+
+def check(update=False, cycles=96) -> bool:
+    fixtures = list_fixtures()
+    if not fixtures:
+        print(f"No fixtures in {FIXTURES_DIR} (run `record` or `synthesize` first)")
+        return False
+    ok = True
+    for fixture in fixtures:
+        for name, mismatches in reference_mismatches(fixture, cycles).items():
+            if mismatches is None:
+                print(f"- {fixture.name}: {name} reference skipped (pandas not installed or several stations)")
+            elif mismatches:
+                ok = False
+                print(f"✗ {fixture.name}: {name} differs from the reference in "
+                      f"{len(mismatches)}/{cycles} cycles, first at {mismatches[0]}")
+            else:
+                print(f"✓ {fixture.name}: {name} matches the reference in {cycles} cycles")
+
+        outputs = replay(fixture, cycles)
+        expected_path = fixture.path / "expected.json"
+        if update or not expected_path.exists():
+            expected_path.write_text(json.dumps(outputs, indent=1))
+            print(f"{fixture.name}: wrote {len(outputs)} cycles to expected.json")
+            continue
+        expected = json.loads(expected_path.read_text())
+        mismatches = [now for now in expected if outputs.get(now) != expected[now]]
+        if mismatches:
+            ok = False
+            print(f"✗ {fixture.name}: {len(mismatches)}/{len(expected)} cycles differ, first at {mismatches[0]}")
+            print(f"  expected {expected[mismatches[0]]}")
+            print(f"  got      {outputs.get(mismatches[0])}")
+        else:
+            print(f"✓ {fixture.name}: {len(expected)} cycles match")
+    return ok
+
+
+# --- Benchmark ---
+
+def _time(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench(cycles=96, repeat=3, with_pandas=False):
+    """Time download-free parsing, scoring and packing over every cycle of every fixture."""
+    fixtures = list_fixtures()
+    if not fixtures:
+        print(f"No fixtures in {FIXTURES_DIR} (run `record` or `synthesize` first)")
+        return
+    stages = {"rws_parse": [], "weather_parse": [], "weather_score": [], "pack": [], "cycle": []}
+    if with_pandas:
+        stages["rws_parse_pandas"] = []
+
+    sink = io.StringIO()
+    for fixture in fixtures:
+        rws_text = fixture.body("rws").decode("utf-8")
+        weather_text = fixture.body("weather").decode("utf-8")
+        labels = list(dict.fromkeys(loc["rws_label"] for loc in fixture.locations.values()))
+        single_station = len(labels) == 1
+        for now in fixture.cycles(cycles):
+            with contextlib.redirect_stdout(sink):
+                if single_station:
+                    rws = lambda: fetch_data.parse_rws_csv(rws_text, now)
+                else:
+                    rws = lambda: fetch_data.parse_rws_stations(rws_text, now, labels)
+                stages["rws_parse"] += _time(rws, repeat)
+                if with_pandas and single_station:
+                    stages["rws_parse_pandas"] += _time(lambda: fetch_data.parse_rws_csv_pandas(rws_text, now), repeat)
+
+                stages["weather_parse"] += _time(lambda: json.loads(weather_text), repeat)
+                data = json.loads(weather_text)
+                forecasts = data if isinstance(data, list) else [data]
+                score = lambda: [fetch_data.weather_values(f["hourly"], now) for f in forecasts]
+                stages["weather_score"] += _time(score, repeat)
+
+                parsed, weather = rws(), score()
+                levels = [parsed if single_station else parsed.get(loc["rws_label"], (0, 0))
+                          for loc in fixture.locations.values()]
+                stages["pack"] += _time(lambda: [json.dumps([int(now.timestamp()), *lv] + w)
+                                                 for lv, w in zip(levels, weather)], repeat)
+
+                def cycle():
+                    parsed = rws()
+                    data = json.loads(weather_text)
+                    forecasts = data if isinstance(data, list) else [data]
+                    return parsed, [fetch_data.weather_values(f["hourly"], now) for f in forecasts]
+                stages["cycle"] += _time(cycle, repeat)
+            sink.seek(0)
+            sink.truncate()
+
+    total_cycles = len(fixtures) * cycles
+    print(f"{len(fixtures)} fixtures x {cycles} cycles = {total_cycles} cycles, {repeat} repeats each")
+    print(f"{'stage':<18}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for stage, samples in stages.items():
+        if not samples:
+            continue
+        samples.sort()
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        print(f"{stage:<18}{statistics.fmean(samples) * 1000:>10.3f}"
+              f"{samples[len(samples) // 2] * 1000:>10.3f}{p95 * 1000:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record/replay fixtures for fetch_data.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("record", help="capture live responses (needs network)")
+    p.add_argument("--name")
+    p = sub.add_parser("synthesize", help="generate a synthetic fixture")
+    p.add_argument("--name", default="synthetic")
+    p.add_argument("--seed", type=int, default=1)
+    p = sub.add_parser("check", help="replay fixtures and compare with expected.json")
+    p.add_argument("--update", action="store_true", help="rewrite expected.json from current output")
+    p.add_argument("--cycles", type=int, default=96)
+    p = sub.add_parser("bench", help="time parsing, scoring and packing")
+    p.add_argument("--cycles", type=int, default=96)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--pandas", action="store_true", help="also time the pandas reference RWS parser")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        print(f"Recorded {record(args.name)}")
+    elif args.command == "synthesize":
+        print(f"Wrote {synthesize(args.name, args.seed)}")
+    elif args.command == "check":
+        sys.exit(0 if check(args.update, args.cycles) else 1)
+    elif args.command == "bench":
+        bench(args.cycles, args.repeat, args.pandas)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Forecast Time Index
+===================
+Resolves forecast horizons against Open-Meteo hourly arrays.
+
+`hourly['time']` is parsed once into a sorted array of microseconds; any list
+of target instants is resolved with one binary search (nearest time step, the
+earlier one only on exact ties, so 14:30:01 resolves to 15:00), and all requested variables for all horizons are read
+with one NumPy gather. Missing values (None in the JSON, or positions past the
+end of the forecast) come back as NaN.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+
+class HourlyIndex:
+    """Time index over an Open-Meteo `hourly` block."""
+
+    def __init__(self, hourly: dict):
+        self.hourly = hourly
+        # Open-Meteo returns local wall-clock times like "2026-02-25T14:00"
+        self.times = np.array(hourly["time"], dtype="datetime64[us]")
+        self._us = self.times.astype(np.int64)
+        self._matrix = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def nearest(self, targets) -> np.ndarray:
+        """Index of the time step nearest to each target (naive local datetimes)."""
+        if not len(self.times):
+            raise ValueError("empty forecast")
+        # Full precision: truncating targets to minutes would turn hh:30:xx into a tie
+        t = np.array([np.datetime64(x, "us") for x in targets]).astype(np.int64)
+        right = np.clip(np.searchsorted(self._us, t, side="left"), 0, len(self.times) - 1)
+        left = np.clip(right - 1, 0, len(self.times) - 1)
+        use_left = np.abs(t - self._us[left]) <= np.abs(self._us[right] - t)
+        return np.where(use_left, left, right)
+
+    def _column(self, name: str) -> np.ndarray:
+        col = self._matrix.get(name)
+        if col is None:
+            # None → NaN; pad/trim to the length of the time axis
+            values = np.array(self.hourly.get(name, []), dtype=float)
+            col = np.full(len(self.times) + 1, np.nan)  # last slot: out-of-range sentinel
+            n = min(len(values), len(self.times))
+            col[:n] = values[:n]
+            self._matrix[name] = col
+        return col
+
+    def gather(self, variables, positions) -> dict:
+        """Read `variables` at integer `positions`: {name: float array}, NaN where missing."""
+        positions = np.asarray(positions, dtype=np.int64)
+        valid = (positions >= 0) & (positions < len(self.times))
+        safe = np.where(valid, positions, len(self.times))
+        block = np.stack([self._column(v) for v in variables])[:, safe]
+        return dict(zip(variables, block))
+
+    def time_at(self, position: int) -> datetime:
+        return self.times[position].astype(datetime)
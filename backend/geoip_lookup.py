@@ -0,0 +1,123 @@
+"""
+GeoIP Country Lookup
+====================
+Cached IP → country code lookups against the GeoLite2-Country database.
+
+- Private, loopback, link-local, reserved etc. addresses are detected with
+  `ipaddress` (not string prefixes) and map to "XX" without a lookup
+- Results are cached in an LRU keyed by network prefix (/24 for IPv4, /48 for
+  IPv6), since country data is never more specific than that in practice
+- The .mmdb is opened memory-mapped, so gunicorn workers share its pages
+- hit/miss/eviction/failure counters are available via stats()
+"""
+
+import ipaddress
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+try:
+    import geoip2.database
+    import maxminddb
+    GEOIP_AVAILABLE = True
+except ImportError:
+    GEOIP_AVAILABLE = False
+
+UNKNOWN = "XX"
+
+log = logging.getLogger("geoip")
+
+
+class CountryLookup:
+    """Country lookups with private-range detection and a per-prefix LRU cache."""
+
+    def __init__(self, db_path: Path, cache_size: int = 65536):
+        self.db_path = Path(db_path)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._reader = None
+        self._reader_failed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.private = 0
+        self.failures = 0
+
+    @property
+    def available(self) -> bool:
+        return GEOIP_AVAILABLE and self.db_path.exists()
+
+    def _get_reader(self):
+        """Lazy-load the memory-mapped GeoIP reader (once)."""
+        if self._reader is None and not self._reader_failed and self.available:
+            try:
+                self._reader = geoip2.database.Reader(str(self.db_path), mode=maxminddb.MODE_MMAP)
+            except Exception as e:
+                self._reader_failed = True
+                log.error("Failed to load GeoIP database: %s", e)
+        return self._reader
+
+    @staticmethod
+    def _cache_key(addr):
+        if addr.version == 4:
+            return 4, int(addr) >> 8      # /24
+        return 6, int(addr) >> 80         # /48
+
+    def lookup(self, ip: str) -> str:
+        """Look up the country code for an IP address. Returns 'XX' on failure."""
+        try:
+            addr = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            self.failures += 1
+            return UNKNOWN
+        if addr.version == 6 and addr.ipv4_mapped is not None:
+            addr = addr.ipv4_mapped
+
+        # Private/local IPs can't be geolocated
+        if not addr.is_global:
+            self.private += 1
+            return UNKNOWN
+
+        key = self._cache_key(addr)
+        with self._lock:
+            code = self._cache.get(key)
+            if code is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return code
+            self.misses += 1
+
+        reader = self._get_reader()
+        if reader is None:
+            self.failures += 1
+            return UNKNOWN
+        try:
+            code = reader.country(str(addr)).country.iso_code or UNKNOWN
+        except Exception:
+            # Includes AddressNotFoundError; cache it so we don't retry the prefix
+            self.failures += 1
+            code = UNKNOWN
+
+        with self._lock:
+            self._cache[key] = code
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+        return code
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "available": self.available,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "private": self.private,
+            "failures": self.failures,
+            "cached_prefixes": len(self._cache),
+        }
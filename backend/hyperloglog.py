@@ -0,0 +1,89 @@
+"""
+HyperLogLog
+===========
+Mergeable cardinality sketch for counting unique users in constant memory.
+
+With the default precision p=12 a sketch is 4 KiB of registers and has a
+standard error of about 1.04 / sqrt(4096) ≈ 1.6%. Sketches with the same
+precision merge by taking the register-wise maximum, so rolling 7/30/90-day
+uniques are a merge of daily sketches instead of a re-scan of the logs.
+"""
+
+import base64
+import hashlib
+import math
+import zlib
+
+DEFAULT_PRECISION = 12
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """HyperLogLog sketch with linear-counting correction for small cardinalities."""
+
+    __slots__ = ("p", "m", "registers")
+
+    def __init__(self, p: int = DEFAULT_PRECISION, registers: bytearray = None):
+        if not 4 <= p <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else bytearray(self.m)
+
+    def add(self, value: str):
+        x = _hash64(value)
+        idx = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def merge(self, other: "HyperLogLog"):
+        """Merge `other` into this sketch in place."""
+        if other.p != self.p:
+            raise ValueError("cannot merge sketches with different precision")
+        regs = self.registers
+        for i, r in enumerate(other.registers):
+            if r > regs[i]:
+                regs[i] = r
+        return self
+
+    def copy(self) -> "HyperLogLog":
+        return HyperLogLog(self.p, bytearray(self.registers))
+
+    def count(self) -> int:
+        """Estimated number of distinct values added."""
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def __len__(self):
+        return self.count()
+
+    # --- Serialization (compact: mostly-empty registers compress well) ---
+
+    def to_str(self) -> str:
+        return f"{self.p}:" + base64.b64encode(zlib.compress(bytes(self.registers))).decode("ascii")
+
+    @classmethod
+    def from_str(cls, data: str) -> "HyperLogLog":
+        p, payload = data.split(":", 1)
+        registers = bytearray(zlib.decompress(base64.b64decode(payload)))
+        sketch = cls(int(p), registers)
+        if len(registers) != sketch.m:
+            raise ValueError("corrupt sketch")
+        return sketch
@@ -0,0 +1,391 @@
+"""
+Load Benchmark
+==============
+Replays synthetic watch-fleet traffic against analytics_server.py and reports
+throughput and p50/p95/p99 latency per route.
+
+The traffic is shaped like the hourly thundering herd: every watch polls
+/data.json?uid=... once within a few seconds of the top of the hour (arrival
+offsets are exponentially distributed), a share of them retries (dedup hits),
+a few browsers hit without a uid, and dashboard visitors mix in /api/summary,
+/api/summary?windows=... and /api/total_users.
+
+The server runs against a throw-away copy of backend/ (sandbox) with optional
+seeded history, so benchmarks never touch real analytics. Modes:
+
+- client    in-process, through Flask's test client (no network, no gunicorn)
+- gunicorn  a real `gunicorn -w N` on localhost, driven over HTTP
+- uvicorn   analytics_asgi.py under `uvicorn --workers N`, driven over HTTP
+
+With --speed the trace is replayed open-loop at that multiple of real time and
+latency is measured from each request's scheduled time (so queueing counts);
+without it requests are sent as fast as --concurrency allows.
+
+Results are saved to bench_results/<UTC timestamp>-<git commit>.json, so runs
+can be compared across commits.
+
+Usage:
+    python load_benchmark.py                                  # test client, 2000 watches
+    python load_benchmark.py --mode gunicorn --workers 2
+    python load_benchmark.py --mode uvicorn --workers 2 --concurrency 256
+    python load_benchmark.py --watches 5000 --concurrency 64 --seed-days 30
+    python load_benchmark.py --save-trace burst.jsonl         # ...and reuse it with --trace
+    python load_benchmark.py --compare bench_results/<older run>.json
+"""
+
+import argparse
+import json
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.resolve()
+REPO_DIR = BACKEND_DIR.parent
+RESULTS_DIR = BACKEND_DIR / "bench_results"
+
+DASHBOARD_ROUTES = (
+    ("/api/summary", "/api/summary"),
+    ("/api/total_users", "/api/total_users"),
+    ("/api/summary?windows", "/api/summary?windows=7,30"),
+)
+
+# /metrics families saved with each run's results
+SERVER_METRICS = ("analytics_", "dedup_", "api_cache_")
+
+
+# --- Traffic ---
+
+def _random_ip(rng) -> str:
+    # Public-looking IPv4 addresses (first octet avoids private/reserved ranges)
+    return f"{rng.choice([31, 46, 77, 82, 84, 145, 185, 213])}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+
+
+def build_trace(watches=2000, burst=30.0, retry=0.1, no_uid=0.02, dashboard=0.05, seed=1) -> list:
+    """One top-of-hour burst: [{"at": seconds, "route": label, "path": ..., "ip": ...}] sorted by time."""
+    rng = random.Random(seed)
+    trace = []
+    for i in range(watches):
+        uid = f"{rng.getrandbits(64):016x}"
+        ip = _random_ip(rng)
+        at = min(rng.expovariate(3.0 / burst), burst * 4)
+        trace.append({"at": at, "route": "/data.json", "path": f"/data.json?uid={uid}", "ip": ip})
+        if rng.random() < retry:
+            trace.append({"at": at + rng.uniform(1, burst), "route": "/data.json",
+                          "path": f"/data.json?uid={uid}", "ip": ip})
+    for _ in range(int(watches * no_uid)):
+        trace.append({"at": rng.uniform(0, burst * 4), "route": "/data.json",
+                      "path": "/data.json", "ip": _random_ip(rng)})
+    for _ in range(int(watches * dashboard)):
+        route, path = rng.choice(DASHBOARD_ROUTES)
+        trace.append({"at": rng.uniform(0, burst * 4), "route": route, "path": path, "ip": _random_ip(rng)})
+    trace.sort(key=lambda entry: entry["at"])
+    return trace
+
+
+def save_trace(trace, path: Path):
+    with open(path, "w") as f:
+        for entry in trace:
+            f.write(json.dumps(entry) + "\n")
+
+
+def load_trace(path: Path) -> list:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# --- Sandbox ---
+
+def make_sandbox(trace, seed_days=7, polls_per_day=24, seed=1) -> Path:
+    """Copy backend/ (code, GeoIP db, locations) and data.json into a temp dir; seed analytics."""
+    root = Path(tempfile.mkdtemp(prefix="garmin-bench-"))
+    backend = root / "backend"
+    backend.mkdir()
+    for path in BACKEND_DIR.iterdir():
+        if path.is_file() and (path.suffix in (".py", ".mmdb") or path.name == "locations.json"):
+            shutil.copy2(path, backend / path.name)
+    for path in REPO_DIR.glob("data.*"):
+        shutil.copy2(path, root / path.name)
+
+    if seed_days:
+        # Past days of watch polls, so summary/rolling endpoints have real work
+        rng = random.Random(seed)
+        uids = sorted({entry["path"].split("uid=")[1] for entry in trace if "uid=" in entry["path"]})
+        analytics = backend / "analytics"
+        analytics.mkdir()
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        for days_ago in range(seed_days, 0, -1):
+            day = today - timedelta(days=days_ago)
+            active = [uid for uid in uids if rng.random() < 0.8]
+            countries = {uid: rng.choice(("NL", "NL", "NL", "DE", "BE", "GB")) for uid in active}
+            with open(analytics / f"{day:%Y-%m-%d}.jsonl", "w") as f:
+                for hour in range(0, 24, max(1, 24 // polls_per_day)):
+                    ts = day.timestamp() + hour * 3600
+                    for uid in active:
+                        f.write(json.dumps({"ts": int(ts + rng.uniform(0, 30)), "uid": uid,
+                                            "country": countries[uid]}) + "\n")
+    return root
+
+
+# --- Senders ---
+
+class ClientTarget:
+    """In-process Flask test client (one client per thread)."""
+
+    name = "client"
+
+    def __init__(self, sandbox: Path):
+        sys.path.insert(0, str(sandbox / "backend"))
+        import analytics_server
+        self.server = analytics_server
+        self._local = threading.local()
+
+    def send(self, path, ip) -> int:
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.server.app.test_client()
+        return client.get(path, headers={"X-Forwarded-For": ip}).status_code
+
+    def metrics(self) -> str:
+        return self.server.app.test_client().get("/metrics").get_data(as_text=True)
+
+    def close(self):
+        self.server._writer.close()
+
+
+class GunicornTarget:
+    """A real gunicorn server on localhost, driven over HTTP with pooled connections."""
+
+    name = "gunicorn"
+
+    def __init__(self, sandbox: Path, workers=2, extra_args=()):
+        import requests
+        self._requests = requests
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.log_path = sandbox / f"{self.name}.log"
+        self.process = subprocess.Popen(
+            self._command(sandbox / "backend", port, workers, extra_args),
+            stdout=open(self.log_path, "w"), stderr=subprocess.STDOUT,
+        )
+        self._local = threading.local()
+        self._wait_ready()
+
+    def _command(self, backend_dir, port, workers, extra_args):
+        return [sys.executable, "-m", "gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers),
+                *extra_args, "--chdir", str(backend_dir), "analytics_server:app"]
+
+    def _wait_ready(self, timeout=20.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.name} exited; see {self.log_path}")
+            try:
+                if self._requests.get(self.base_url + "/health", timeout=1).ok:
+                    return
+            except self._requests.RequestException:
+                # Not listening yet, or too busy starting up to answer in time
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{self.name} did not start in time")
+
+    def send(self, path, ip) -> int:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        return session.get(self.base_url + path, headers={"X-Forwarded-For": ip}, timeout=30).status_code
+
+    def metrics(self) -> str:
+        return self._requests.get(self.base_url + "/metrics", timeout=10).text
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class UvicornTarget(GunicornTarget):
+    """analytics_asgi.py under uvicorn on localhost, driven over HTTP."""
+
+    name = "uvicorn"
+
+    def _command(self, backend_dir, port, workers, extra_args):
+        return [sys.executable, "-m", "uvicorn", "--host", "127.0.0.1", "--port", str(port),
+                "--workers", str(workers), "--no-access-log", *extra_args,
+                "--app-dir", str(backend_dir), "analytics_asgi:app"]
+
+
+# --- Running & reporting ---
+
+def percentile(sorted_values, q) -> float:
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def run(target, trace, concurrency=32, speed=0.0) -> dict:
+    """Replay `trace` against `target`; returns per-route latency samples and wall time."""
+    samples = defaultdict(list)    # route -> [latency seconds]
+    statuses = defaultdict(lambda: defaultdict(int))
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def execute(entry, scheduled):
+        try:
+            status = target.send(entry["path"], entry["ip"])
+        except Exception:
+            status = None
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            samples[entry["route"]].append(elapsed)
+            if status is None or status >= 500:
+                errors[entry["route"]] += 1
+            statuses[entry["route"]][str(status)] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in trace:
+            if speed:
+                scheduled = start + entry["at"] / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(execute, entry, scheduled)
+            else:
+                pool.submit(lambda e=entry: execute(e, time.perf_counter()))
+    wall = time.perf_counter() - start
+
+    routes = {}
+    for route, values in sorted(samples.items()):
+        values.sort()
+        routes[route] = {
+            "count": len(values),
+            "errors": errors[route],
+            "statuses": dict(statuses[route]),
+            "throughput_rps": round(len(values) / wall, 1),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+            "max_ms": round(values[-1] * 1000, 2),
+        }
+    return {
+        "wall_s": round(wall, 3),
+        "requests": len(trace),
+        "throughput_rps": round(len(trace) / wall, 1),
+        "routes": routes,
+    }
+
+
+def server_stats(exposition: str) -> dict:
+    """{sample: value} of the SERVER_METRICS families in a /metrics response."""
+    stats = {}
+    for line in exposition.splitlines():
+        if line.startswith(SERVER_METRICS):
+            sample, value = line.rsplit(" ", 1)
+            stats[sample] = int(value) if value.isdigit() else float(value)
+    return stats
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_report(result, baseline=None):
+    print(f"\n{result['requests']} requests in {result['wall_s']}s "
+          f"({result['throughput_rps']} req/s, mode={result['mode']}, commit={result['commit']})")
+    print(f"{'route':<24}{'count':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for route, r in result["routes"].items():
+        print(f"{route:<24}{r['count']:>7}{r['errors']:>5}{r['throughput_rps']:>9}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old:
+            deltas = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                change = (r[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                deltas.append(f"{key[:3]} {change:+.0f}%")
+            print(f"{'':<24}vs {baseline['commit']}: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay synthetic watch traffic against analytics_server")
+    parser.add_argument("--mode", choices=("client", "gunicorn", "uvicorn"), default="client")
+    parser.add_argument("--workers", type=int, default=2, help="server workers (gunicorn/uvicorn mode)")
+    parser.add_argument("--gunicorn-args", default="", help="extra gunicorn arguments, e.g. '-k gthread --threads 8'")
+    parser.add_argument("--uvicorn-args", default="", help="extra uvicorn arguments, e.g. '--loop uvloop'")
+    parser.add_argument("--watches", type=int, default=2000)
+    parser.add_argument("--burst", type=float, default=30.0, help="seconds over which most watches arrive")
+    parser.add_argument("--retry", type=float, default=0.1, help="share of watches polling twice")
+    parser.add_argument("--no-uid", type=float, default=0.02, help="requests without uid, per watch")
+    parser.add_argument("--dashboard", type=float, default=0.05, help="dashboard API requests, per watch")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seed-days", type=int, default=7, help="days of past analytics to generate")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--speed", type=float, default=0.0, help="replay at N x real time (0 = flat out)")
+    parser.add_argument("--trace", type=Path, help="replay a saved trace instead of generating one")
+    parser.add_argument("--save-trace", type=Path)
+    parser.add_argument("--compare", type=Path, help="earlier results file to compare against")
+    parser.add_argument("--output", type=Path, help="results file (default: bench_results/...)")
+    parser.add_argument("--keep-sandbox", action="store_true")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = build_trace(args.watches, args.burst, args.retry, args.no_uid, args.dashboard, args.seed)
+    if args.save_trace:
+        save_trace(trace, args.save_trace)
+
+    sandbox = make_sandbox(trace, seed_days=args.seed_days, seed=args.seed)
+    print(f"Sandbox: {sandbox}")
+    if args.mode == "client":
+        target = ClientTarget(sandbox)
+    elif args.mode == "gunicorn":
+        target = GunicornTarget(sandbox, workers=args.workers, extra_args=args.gunicorn_args.split())
+    else:
+        target = UvicornTarget(sandbox, workers=args.workers, extra_args=args.uvicorn_args.split())
+
+    try:
+        result = run(target, trace, concurrency=args.concurrency, speed=args.speed)
+        server = server_stats(target.metrics())
+    finally:
+        target.close()
+        if not args.keep_sandbox:
+            shutil.rmtree(sandbox, ignore_errors=True)
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "mode": args.mode,
+        "params": {key: (str(value) if isinstance(value, Path) else value)
+                   for key, value in vars(args).items() if key not in ("compare", "output")},
+        **result,
+        "server": server,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print_report(result, baseline)
+
+    output = args.output or RESULTS_DIR / f"{result['timestamp'].replace(':', '')}-{result['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nSaved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Location Registry
+=================
+Locations the backend publishes forecasts for, keyed by the `?loc=` value the
+watch sends (/data.json?loc=nijmegen). Each location has forecast coordinates
+and the RWS water-level station it reads; locations along the same stretch of
+river can share a station, which is then only parsed once.
+
+The default location is published to the repository-root data.json (what
+watches without ?loc= download); every other location to data/<key>.json.
+
+More locations can be added without code changes in backend/locations.json,
+which is merged over the built-in registry:
+
+    {
+      "arnhem": {"name": "Arnhem", "lat": 51.985, "lon": 5.898,
+                 "rws": "lobith.bovenrijn.tolkamer", "rws_label": "Lobith"}
+    }
+
+`rws` is the waterinfo locationCode; `rws_label` is the station name as it
+appears in the CSV column headers (used to pick the station's columns when one
+request covers several stations).
+"""
+
+import json
+import re
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.resolve()
+LOCATIONS_FILE = BASE_DIR / "locations.json"
+LOCATION_DATA_DIR = BASE_DIR.parent / "data"
+
+DEFAULT_LOCATION = "nijmegen"
+
+LOCATIONS = {
+    "nijmegen": {
+        "name": "Nijmegen",
+        "lat": 51.847683,
+        "lon": 5.862825,
+        "rws": "lobith.bovenrijn.tolkamer",
+        "rws_label": "Lobith",
+    },
+}
+
+_REQUIRED = ("name", "lat", "lon", "rws", "rws_label")
+_KEY_PATTERN = re.compile(r"^[a-z0-9_-]{1,32}$")
+
+
+def load_locations(path: Path = LOCATIONS_FILE) -> dict:
+    """Return the registry {key: location}, including any locations from `path`."""
+    locations = {key: dict(loc) for key, loc in LOCATIONS.items()}
+    try:
+        extra = json.loads(Path(path).read_text())
+    except FileNotFoundError:
+        return locations
+
+    for key, loc in extra.items():
+        if not _KEY_PATTERN.match(key):
+            raise ValueError(f"invalid location key {key!r} in {path}")
+        missing = [field for field in _REQUIRED if field not in loc]
+        if missing:
+            raise ValueError(f"location {key!r} in {path} is missing {', '.join(missing)}")
+        locations[key] = dict(loc)
+    return locations
+
+
+def location_data_path(key: str) -> Path:
+    """Where the published packed array for location `key` lives."""
+    if key == DEFAULT_LOCATION:
+        return BASE_DIR.parent / "data.json"
+    return LOCATION_DATA_DIR / f"{key}.json"
@@ -0,0 +1,208 @@
+"""
+Access Log Ingestion
+====================
+Analytics for the static /data.json mode (nginx/static.conf): nginx serves
+data.json straight from disk and writes every watch poll to an access log in
+the `watch_analytics` format; this job turns that log into the same records
+analytics_server.py would have logged:
+
+    $msec $remote_addr $status "$request_uri"
+
+- uid from the query string (?uid=...); requests without one are logged as
+  the hashed IP (daily salt), like browsers hitting the Flask route
+- Records go through AnalyticsWriter.write(): shared dedup check, country
+  lookup, per-day JSONL line, users.db insert for real device uids, rollups
+- The log is read incrementally: each file is identified by its first line
+  (so renames by logrotate don't matter) and the byte offset reached is kept
+  in analytics/.ingest_state.json, saved after every batch
+- Rotated files (access.log.1, access.log.2.gz, ...) are read oldest first,
+  gzip transparently; a .gz file is finished once read to the end. Only
+  complete lines are consumed, so a line nginx is still writing is picked
+  up by the next run
+- Runs every minute from scheduler.py when ACCESS_LOG_PATH is set; a second
+  run while one is in progress exits immediately
+
+Usage:
+    python log_ingest.py                                  # ACCESS_LOG_PATH or /var/log/nginx/watch/access.log
+    python log_ingest.py --log /path/to/access.log
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from analytics_log import DailySalts
+from analytics_writer import AnalyticsWriter
+from db import Database
+from dedup_store import DedupStore
+from geoip_lookup import CountryLookup
+from rollup_store import ROLLUPS_DB_PATH, RollupStore
+from snapshot import file_lock, publish_json
+
+BASE_DIR = Path(__file__).parent.resolve()
+ANALYTICS_DIR = BASE_DIR / "analytics"
+USERS_DB_PATH = BASE_DIR / "users.db"
+DEDUP_DB_PATH = BASE_DIR / "dedup.db"
+GEOIP_DB_PATH = BASE_DIR / "GeoLite2-Country.mmdb"
+STATE_PATH = ANALYTICS_DIR / ".ingest_state.json"
+LOCK_PATH = ANALYTICS_DIR / ".ingest.lock"
+
+ACCESS_LOG = Path(os.environ.get("ACCESS_LOG_PATH", "/var/log/nginx/watch/access.log"))
+
+# Same dedup window as analytics_server.py
+DEDUP_INTERVAL = 3500
+
+# Records per AnalyticsWriter.write() (and per state checkpoint)
+BATCH_SIZE = 5000
+
+# A file's identity is its first line; longer first lines are cut here
+FINGERPRINT_BYTES = 512
+
+
+# --- Parsing ---
+
+def parse_line(line: bytes):
+    """Return (ts, ip, uid) for one `watch_analytics` log line (uid None if absent), or None."""
+    try:
+        msec, ip, _status, uri = line.decode("utf-8", errors="replace").rstrip("\n").split(" ", 3)
+        ts = int(float(msec))
+    except ValueError:
+        return None
+    uri = uri.strip('"')
+    uid = parse_qs(urlsplit(uri).query).get("uid", [None])[0]
+    return ts, ip, uid or None
+
+
+# --- Files ---
+
+def log_files(log_path: Path) -> list:
+    """The live log and its rotations (log.1, log.2.gz, ...), oldest first."""
+    log_path = Path(log_path)
+    pattern = re.compile(re.escape(log_path.name) + r"\.(\d+)(\.gz)?")
+    rotated = []
+    for path in log_path.parent.glob(log_path.name + ".*"):
+        match = pattern.fullmatch(path.name)
+        if match:
+            rotated.append((int(match.group(1)), path))
+    files = [path for _, path in sorted(rotated, reverse=True)]
+    if log_path.exists():
+        files.append(log_path)
+    return files
+
+
+def _open(path: Path):
+    return gzip.open(path, "rb") if path.suffix == ".gz" else open(path, "rb")
+
+
+def _fingerprint(path: Path):
+    """Identity of a log file: a hash of its first line (None until that line is complete)."""
+    try:
+        with _open(path) as f:
+            first = f.readline(FINGERPRINT_BYTES)
+    except (OSError, EOFError):
+        return None
+    if not first or (len(first) < FINGERPRINT_BYTES and not first.endswith(b"\n")):
+        return None
+    return hashlib.sha1(first).hexdigest()[:16]
+
+
+def _load_state(path: Path) -> dict:
+    try:
+        return json.loads(Path(path).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}}
+
+
+# --- Ingestion ---
+
+def ingest(writer, log_path: Path = ACCESS_LOG, state_path: Path = STATE_PATH,
+           batch_size: int = BATCH_SIZE) -> dict:
+    """Write every new complete line of the access log (and its rotations) through `writer`."""
+    state = _load_state(state_path)
+    files = {}
+    totals = {"files": 0, "lines": 0, "records": 0, "invalid": 0}
+
+    for path in log_files(log_path):
+        fingerprint = _fingerprint(path)
+        if fingerprint is None:
+            continue
+        entry = files[fingerprint] = state["files"].get(fingerprint, {"offset": 0, "done": False})
+        if entry["done"]:
+            continue
+
+        totals["files"] += 1
+        batch = []
+        with _open(path) as f:
+            f.seek(entry["offset"])
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # still being written
+                entry["offset"] += len(line)
+                totals["lines"] += 1
+                record = parse_line(line)
+                if record is None:
+                    totals["invalid"] += 1
+                    continue
+                ts, ip, uid = record
+                batch.append((ts, uid, ip, uid is not None))
+                if len(batch) >= batch_size:
+                    writer.write(batch)
+                    totals["records"] += len(batch)
+                    batch = []
+                    publish_json(state_path, {"files": {**state["files"], **files}})
+        if batch:
+            writer.write(batch)
+            totals["records"] += len(batch)
+        # Compressed rotations are never appended to again
+        entry["done"] = path.suffix == ".gz"
+
+    # Files that rotated out of existence are dropped from the state
+    publish_json(state_path, {"files": files})
+    return totals
+
+
+def make_writer() -> AnalyticsWriter:
+    """An AnalyticsWriter on the same files and databases as analytics_server.py."""
+    users_db = Database(USERS_DB_PATH)
+    users_db.execute("""
+        CREATE TABLE IF NOT EXISTS unique_users (
+            uid TEXT PRIMARY KEY,
+            first_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    return AnalyticsWriter(
+        ANALYTICS_DIR,
+        users_db,
+        resolve_country=CountryLookup(GEOIP_DB_PATH).lookup,
+        anonymize=DailySalts(ANALYTICS_DIR).anonymize,
+        dedup=DedupStore(DEDUP_DB_PATH, interval=DEDUP_INTERVAL),
+        rollups=RollupStore(ROLLUPS_DB_PATH),
+    )
+
+
+def main(log_path: Path = ACCESS_LOG) -> dict:
+    with file_lock(LOCK_PATH, blocking=False) as acquired:
+        if not acquired:
+            print("[ingest] Another ingestion run is in progress, skipping")
+            return {}
+        start = time.perf_counter()
+        writer = make_writer()
+        totals = ingest(writer, log_path)
+        stats = writer.stats()
+        print(f"[ingest] {totals['lines']} lines from {totals['files']} files → "
+              f"{stats['written']} records ({stats['duplicates']} duplicates, "
+              f"{totals['invalid']} invalid) in {time.perf_counter() - start:.2f}s")
+        return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest the nginx watch access log into analytics/")
+    parser.add_argument("--log", type=Path, default=ACCESS_LOG, help="Access log path")
+    args = parser.parse_args()
+    main(args.log)
@@ -0,0 +1,371 @@
+"""
+Metrics
+=======
+Prometheus-style counters, gauges and histograms for analytics_server.py,
+aggregated across gunicorn workers and rendered in the text exposition format
+(served on /metrics).
+
+- Each worker keeps its metrics in memory (a dict update per observation, no
+  I/O on the request path) and a background thread dumps them to
+  METRICS_DIR/<pid>-<start>.json every `flush_interval` seconds and on exit.
+  <start> is the process's start time (from /proc; a random id where there
+  is none), so a later process that reuses the pid — a restarted worker, or
+  a new container whose pids start from 1 again — is told apart from the
+  one that wrote the dump
+- A scrape merges the dumps of all workers with the scraping worker's live
+  values: counters and histograms are summed, gauges are summed over live
+  workers only
+- Dumps of workers that have exited are folded into retired.json, so totals
+  don't go backwards when gunicorn restarts a worker
+- A new server (process group: the gunicorn master or uvicorn supervisor and
+  its workers) empties METRICS_DIR when its first worker starts, so nothing
+  left by a previous run is counted
+- Process collectors turn existing per-worker stats (GeoIP cache, writer
+  queue, ...) into metrics at dump time; scrape collectors compute values that
+  are already shared between processes (dedup store, data.json age, fetch
+  timings) once per scrape
+"""
+
+import atexit
+import json
+import os
+import secrets
+import threading
+import time
+from pathlib import Path
+
+from snapshot import atomic_write_bytes, file_lock
+
+METRICS_DIR = Path(__file__).parent.resolve() / "metrics"
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _start_time(pid: int):
+    """Start time of process `pid` (clock ticks since boot, as a string), or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # starttime is field 22; fields are counted past the parenthesized command name
+    return stat.rsplit(b")", 1)[1].split()[19].decode("ascii")
+
+
+def _boot_id() -> str:
+    try:
+        with open("/proc/sys/kernel/random/boot_id") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}   # {label values tuple: value}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(v) for v in labels)
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.registry._ensure_started()
+        key = self._key(labels)
+        with self.registry._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        self.registry._ensure_started()
+        with self.registry._lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        """Record one observation; values are [per-bucket counts..., +Inf count, sum]."""
+        self.registry._ensure_started()
+        key = self._key(labels)
+        with self.registry._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            else:
+                entry[len(self.buckets)] += 1
+            entry[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+class Registry:
+    """All metrics of one application, shared across its worker processes via METRICS_DIR."""
+
+    def __init__(self, directory: Path = METRICS_DIR, flush_interval: float = 5.0):
+        self.directory = Path(directory)
+        self.flush_interval = flush_interval
+        self._metrics = {}
+        self._process_collectors = []
+        self._scrape_collectors = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._instance = None   # "<pid>-<start>": name of this worker's dump
+        self._thread = None
+        atexit.register(self.flush)
+
+    # --- Definition ---
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=()) -> Counter:
+        return self._add(Counter(self, name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()) -> Gauge:
+        return self._add(Gauge(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labelnames, buckets))
+
+    def process_collector(self, fn):
+        """fn() -> [(name, type, help, labelnames, {labels tuple: value})], per worker (summed)."""
+        self._process_collectors.append(fn)
+        return fn
+
+    def scrape_collector(self, fn):
+        """fn() -> [(name, type, help, labelnames, {labels tuple: value})], once per scrape."""
+        self._scrape_collectors.append(fn)
+        return fn
+
+    # --- Per-worker dumps ---
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                # Forked (e.g. gunicorn --preload): start this worker from zero
+                for metric in self._metrics.values():
+                    metric.values = {}
+            self._pid = os.getpid()
+            self._instance = f"{self._pid}-{_start_time(self._pid) or secrets.token_hex(8)}"
+            self._claim_directory()
+            self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+            self._thread.start()
+
+    def _claim_directory(self):
+        """Empty the directory if it was last used by another server (process group)."""
+        group = os.getpgrp()
+        server = f"{_boot_id()} {group} {_start_time(group) or ''}"
+        marker = self.directory / "server.id"
+        with file_lock(self.directory / ".retire.lock"):
+            try:
+                if marker.read_text() == server:
+                    return
+            except FileNotFoundError:
+                pass
+            for path in self.directory.glob("*.json"):
+                path.unlink(missing_ok=True)
+            atomic_write_bytes(marker, server.encode("utf-8"))
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+    def _snapshot(self) -> dict:
+        """This worker's metrics as {name: {type, help, labelnames, buckets?, values: [[labels, value]]}}."""
+        families = {}
+        with self._lock:
+            for metric in self._metrics.values():
+                family = {"type": metric.type, "help": metric.help, "labelnames": list(metric.labelnames),
+                          "values": [[list(k), v if not isinstance(v, list) else list(v)]
+                                     for k, v in metric.values.items()]}
+                if metric.type == "histogram":
+                    family["buckets"] = list(metric.buckets)
+                families[metric.name] = family
+        for collector in self._process_collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, type_, help, labelnames, values in samples:
+                families[name] = {"type": type_, "help": help, "labelnames": list(labelnames),
+                                  "values": [[list(k), v] for k, v in values.items()]}
+        return families
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        body = json.dumps({"pid": self._pid, "instance": self._instance, "time": time.time(),
+                           "metrics": self._snapshot()})
+        atomic_write_bytes(self.directory / f"{self._instance}.json", body.encode("utf-8"))
+
+    # --- Scraping ---
+
+    @staticmethod
+    def _alive(pid, start) -> bool:
+        """Whether the worker that wrote a dump is still running (not just some process with its pid)."""
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        current = _start_time(pid)
+        return current is None or current == start
+
+    @staticmethod
+    def _merge(into, families, gauges=True):
+        for name, family in families.items():
+            if family["type"] == "gauge" and not gauges:
+                continue
+            target = into.setdefault(name, {**family, "values": {}})
+            for labels, value in family["values"]:
+                key = tuple(labels)
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    target["values"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["values"][key] = current + value
+
+    def _retire(self, paths):
+        """Fold the counters/histograms of exited workers into retired.json."""
+        retired_path = self.directory / "retired.json"
+        with file_lock(self.directory / ".retire.lock"):
+            try:
+                retired = json.loads(retired_path.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                retired = {}
+            merged = {}
+            self._merge(merged, retired, gauges=False)
+            for path in paths:
+                try:
+                    self._merge(merged, json.loads(path.read_text())["metrics"], gauges=False)
+                except (OSError, json.JSONDecodeError, KeyError):
+                    pass
+            out = {name: {**family, "values": [[list(k), v] for k, v in family["values"].items()]}
+                   for name, family in merged.items()}
+            atomic_write_bytes(retired_path, json.dumps(out).encode("utf-8"))
+            for path in paths:
+                path.unlink(missing_ok=True)
+
+    def collect(self) -> dict:
+        """Merged metric families of all workers plus scrape collectors."""
+        self._ensure_started()
+        merged = {}
+        self._merge(merged, self._snapshot())
+
+        dead = []
+        for path in self.directory.glob("*.json"):
+            if path.name == "retired.json":
+                continue
+            if path.stem == self._instance:
+                continue
+            try:
+                pid, start = path.stem.split("-", 1)
+                pid = int(pid)
+            except ValueError:
+                continue
+            if not self._alive(pid, start):
+                dead.append(path)
+                continue
+            try:
+                self._merge(merged, json.loads(path.read_text())["metrics"])
+            except (OSError, json.JSONDecodeError, KeyError):
+                pass
+        if dead:
+            self._retire(dead)
+        try:
+            self._merge(merged, json.loads((self.directory / "retired.json").read_text()), gauges=False)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+        for collector in self._scrape_collectors:
+            try:
+                samples = collector()
+            except Exception:
+                continue
+            for name, type_, help, labelnames, values in samples:
+                merged[name] = {"type": type_, "help": help, "labelnames": list(labelnames), "values": values}
+        return merged
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, family in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            labelnames = family["labelnames"]
+            for labels, value in sorted(family["values"].items()):
+                pairs = list(zip(labelnames, labels))
+                if family["type"] == "histogram":
+                    cumulative = 0
+                    for bound, count in zip(family["buckets"] + ["+Inf"], value[:-1]):
+                        cumulative += count
+                        le = bound if bound == "+Inf" else repr(float(bound))
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_number(value[-1])}")
+                    lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
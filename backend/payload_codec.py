@@ -0,0 +1,132 @@
+"""
+Watch Payload Variants
+======================
+Encodings of the packed array the watch downloads, published side by side by
+fetch_data.py and picked per request by analytics_server.py:
+
+- data.json      JSON text (what current watchfaces parse)
+- data.bin       compact, versioned fixed-width binary (19 bytes)
+- data.json.gz   precompressed JSON (gzip, deterministic)
+- data.json.br   precompressed JSON (brotli; only if the brotli package is installed)
+- data.json.variants  manifest: the ETag of the JSON body the variants were
+                 made from, and the ETag of each published variant
+
+A variant is only served while the manifest ties it to the JSON being served
+(variant_matches), so a reader that picks files up one at a time never pairs
+a new data.json with an old data.bin or data.json.gz. A variant that is no
+longer published (e.g. .br after brotli was uninstalled) is deleted.
+
+Binary layout v1 (little-endian):
+    u8  version (1)
+    u32 timestamp
+    i16 water_now, i16 water_tmr          (cm)
+    u16 precip_2h                         (tenths of mm)
+    u8  wind_now, wind_1h, wind_2h, wind_3h, wind_tmr   (knots)
+    u8  sun, u8 fog                       (0-10)
+    i8  temp                              (°C)
+
+Values outside a field's range are clamped. The version byte comes first so a
+decoder can reject layouts it doesn't know.
+"""
+
+import gzip
+import json
+import struct
+from pathlib import Path
+
+from snapshot import atomic_write_bytes, content_etag, publish_json
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+FORMAT_VERSION = 1
+BINARY_MIMETYPE = "application/vnd.rowing-nijmegen.packed"
+PRECIP_SCALE = 10
+
+_BINARY = struct.Struct("<BIhhH5BBBb")
+
+
+def _clamp(value, low, high) -> int:
+    return max(low, min(high, int(round(value))))
+
+
+def encode_binary(packed: list) -> bytes:
+    """Encode the 12-element packed array in the v1 binary layout."""
+    ts, water_now, water_tmr, precip, *winds_and_scores = packed
+    *winds, sun, fog, temp = winds_and_scores
+    return _BINARY.pack(
+        FORMAT_VERSION,
+        _clamp(ts, 0, 2**32 - 1),
+        _clamp(water_now, -32768, 32767),
+        _clamp(water_tmr, -32768, 32767),
+        _clamp(precip * PRECIP_SCALE, 0, 65535),
+        *(_clamp(w, 0, 255) for w in winds),
+        _clamp(sun, 0, 255),
+        _clamp(fog, 0, 255),
+        _clamp(temp, -128, 127),
+    )
+
+
+def decode_binary(body: bytes) -> list:
+    """Decode a v1 binary payload back into the packed array."""
+    if not body or body[0] != FORMAT_VERSION:
+        raise ValueError(f"unsupported payload version {body[:1]!r}")
+    version, ts, water_now, water_tmr, precip, *rest = _BINARY.unpack(body)
+    return [ts, water_now, water_tmr, round(precip / PRECIP_SCALE, 1), *rest]
+
+
+def variant_paths(json_path: Path) -> dict:
+    """{variant: path} of the files published next to `json_path` (plus "manifest")."""
+    json_path = Path(json_path)
+    return {
+        "bin": json_path.with_suffix(".bin"),
+        "gzip": json_path.with_name(json_path.name + ".gz"),
+        "br": json_path.with_name(json_path.name + ".br"),
+        "manifest": json_path.with_name(json_path.name + ".variants"),
+    }
+
+
+def parse_manifest(body: bytes):
+    """(source ETag, {variant: ETag}) of a manifest body, or None if it's unreadable."""
+    try:
+        manifest = json.loads(body)
+        return manifest["source"], dict(manifest["variants"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def variant_matches(manifest, source_etag: str, variant: str, variant_etag: str) -> bool:
+    """Whether `manifest` (parse_manifest) says this variant body was made from this JSON body."""
+    return (manifest is not None and manifest[0] == source_etag
+            and manifest[1].get(variant) == variant_etag)
+
+
+def publish_variants(json_path: Path, packed: list) -> str:
+    """
+    Atomically publish `packed` as JSON plus its binary and precompressed
+    variants and their manifest; returns the ETag of the JSON body. The JSON
+    is written last, so by the time it changes every variant of the new
+    version exists.
+    """
+    paths = variant_paths(json_path)
+    text = json.dumps(packed).encode("utf-8")
+    bodies = {
+        "bin": encode_binary(packed),
+        "gzip": gzip.compress(text, compresslevel=9, mtime=0),
+    }
+    if BROTLI_AVAILABLE:
+        bodies["br"] = brotli.compress(text, quality=11)
+
+    for variant, body in bodies.items():
+        atomic_write_bytes(paths[variant], body)
+    for variant in ("bin", "gzip", "br"):
+        if variant not in bodies and paths[variant].exists():
+            paths[variant].unlink()
+    atomic_write_bytes(paths["manifest"], json.dumps({
+        "source": content_etag(text),
+        "variants": {variant: content_etag(body) for variant, body in bodies.items()},
+    }).encode("utf-8"))
+    return publish_json(json_path, packed)
@@ -0,0 +1,134 @@
+"""
+Response Cache
+==============
+Small in-process cache for JSON API responses (e.g. /api/summary).
+
+- Entries are fresh for `ttl` seconds and served as-is
+- For another `stale_ttl` seconds a stale entry is still served immediately
+  while a single background thread regenerates it (stale-while-revalidate)
+- Without a usable entry, the first caller computes it and concurrent callers
+  for the same key wait for that result instead of computing it again
+- Every entry carries an ETag and Last-Modified for conditional requests
+- Bounded: at most `max_entries` entries (least recently used evicted first),
+  and single-flight locks come from a fixed pool of LOCK_STRIPES locks picked
+  by key hash, so no per-key state outlives its entry
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from snapshot import content_etag
+
+log = logging.getLogger("cache")
+
+# Single-flight lock pool size (keys sharing a lock just compute one at a time)
+LOCK_STRIPES = 16
+
+
+class CachedResponse:
+    """One cached response body plus its validators."""
+
+    __slots__ = ("body", "etag", "last_modified", "created")
+
+    def __init__(self, body: bytes, last_modified: float = None):
+        self.body = body
+        self.etag = content_etag(body)
+        self.last_modified = last_modified if last_modified is not None else time.time()
+        self.created = time.monotonic()
+
+
+class ResponseCache:
+    """Per-key TTL cache with stale-while-revalidate and single-flight regeneration."""
+
+    def __init__(self, ttl: float = 60.0, stale_ttl: float = 600.0, max_entries: int = 64):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._refreshing = set()
+        self._guard = threading.Lock()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.evictions = 0
+
+    def _key_lock(self, key):
+        return self._locks[hash(key) % LOCK_STRIPES]
+
+    def _lookup(self, key):
+        with self._guard:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._guard:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key, compute) -> CachedResponse:
+        """
+        Return the cached response for `key`.
+
+        `compute()` must return a CachedResponse; it is only called when the
+        entry is missing, expired or due for a background refresh.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            age = time.monotonic() - entry.created
+            if age < self.ttl:
+                self.hits += 1
+                return entry
+            if age < self.ttl + self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh_in_background(key, compute)
+                return entry
+
+        with self._key_lock(key):
+            # Another thread may have filled the entry while we waited
+            entry = self._lookup(key)
+            if entry is not None and time.monotonic() - entry.created < self.ttl:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            entry = compute()
+            self._store(key, entry)
+            return entry
+
+    def _refresh_in_background(self, key, compute):
+        with self._guard:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                with self._key_lock(key):
+                    self._store(key, compute())
+            except Exception as e:
+                self.errors += 1
+                log.warning("Background refresh of %s failed: %s", key, e)
+            finally:
+                with self._guard:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name=f"refresh-{key}", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "entries": len(self._entries),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,203 @@
+"""
+Analytics Rollups
+=================
+Pre-aggregated /data.json poll counts for range queries on the dashboard
+(/api/summary?from=&to=&granularity=...), kept in SQLite and updated by the
+analytics writer with every batch, so a query never reads the day logs.
+
+- hourly (hour, country) and daily (day, country): `requests` counts every
+  poll, `logged` only the polls written to the day log (the first poll of a
+  user within the dedup interval, i.e. roughly the devices active then); a
+  row with country "*" holds each bucket's total
+- minutely (minute): the same two counts without country, for the shape of
+  the burst at the top of each hour
+- Bucket keys are the Unix timestamps of the UTC bucket start. The time
+  series of a query reads the total rows through the (country, bucket)
+  index, one row per bucket; day and week queries read the daily table
+  (weeks start on Monday). Its country breakdown (for the whole range) reads
+  the daily rows of whole days and the hourly rows of the partial days at
+  either end, so even years of data are a few thousand rows per country
+- A writer batch is summed in memory first and upserted in one transaction
+- Days logged before the store existed are filled in from the day logs by
+  `python rollup_store.py backfill` (only `logged` is known for those, so
+  `requests` gets the same value)
+
+Usage:
+    python rollup_store.py backfill              # Add days missing from rollups.db
+"""
+
+import argparse
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+from analytics_log import ANALYTICS_DIR, day_files, iter_entries
+from db import Database
+
+ROLLUPS_DB_PATH = Path(__file__).parent.resolve() / "rollups.db"
+
+# granularity -> (table, table key, bucket seconds)
+GRANULARITIES = {
+    "minute": ("minutely", "minute", 60),
+    "hour": ("hourly", "hour", 3600),
+    "day": ("daily", "day", 86400),
+    "week": ("daily", "day", 7 * 86400),
+}
+
+# Weeks are counted from 1970-01-05, the first Monday after the epoch
+WEEK_ORIGIN = 4 * 86400
+
+# Country of the per-bucket total rows in hourly and daily
+ALL = "*"
+
+_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS minutely (
+        minute INTEGER PRIMARY KEY,
+        requests INTEGER NOT NULL,
+        logged INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS hourly (
+        hour INTEGER NOT NULL,
+        country TEXT NOT NULL,
+        requests INTEGER NOT NULL,
+        logged INTEGER NOT NULL,
+        PRIMARY KEY (hour, country)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS hourly_by_country ON hourly (country, hour);
+    CREATE TABLE IF NOT EXISTS daily (
+        day INTEGER NOT NULL,
+        country TEXT NOT NULL,
+        requests INTEGER NOT NULL,
+        logged INTEGER NOT NULL,
+        PRIMARY KEY (day, country)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS daily_by_country ON daily (country, day);
+"""
+
+
+def _floor(ts: int, size: int, origin: int = 0) -> int:
+    return (ts - origin) // size * size + origin
+
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class RollupStore:
+    """Minute/hour/day poll counts in SQLite, shared by all processes that open the same file."""
+
+    def __init__(self, path: Path = ROLLUPS_DB_PATH, observer=None):
+        self.db = Database(path, observer=observer)
+        self.db.executescript(_SCHEMA)
+
+    # --- Writing ---
+
+    def add(self, polls):
+        """Count (ts, country, logged) polls (logged: written to the day log, not a duplicate)."""
+        minutes = defaultdict(lambda: [0, 0])
+        hours = defaultdict(lambda: [0, 0])
+        days = defaultdict(lambda: [0, 0])
+        for ts, country, logged in polls:
+            ts = int(ts)
+            country = country or "XX"
+            hour = _floor(ts, 3600)
+            day = _floor(ts, 86400)
+            for counts in (minutes[_floor(ts, 60)], hours[(hour, country)], hours[(hour, ALL)],
+                           days[(day, country)], days[(day, ALL)]):
+                counts[0] += 1
+                counts[1] += bool(logged)
+        if not minutes:
+            return
+
+        with self.db.transaction() as db:
+            db.executemany("""
+                INSERT INTO minutely (minute, requests, logged) VALUES (?, ?, ?)
+                ON CONFLICT(minute) DO UPDATE SET
+                    requests = requests + excluded.requests, logged = logged + excluded.logged
+            """, [(minute, r, n) for minute, (r, n) in minutes.items()])
+            for table, key, counts in (("hourly", "hour", hours), ("daily", "day", days)):
+                db.executemany(f"""
+                    INSERT INTO {table} ({key}, country, requests, logged) VALUES (?, ?, ?, ?)
+                    ON CONFLICT({key}, country) DO UPDATE SET
+                        requests = requests + excluded.requests, logged = logged + excluded.logged
+                """, [(bucket, country, r, n) for (bucket, country), (r, n) in counts.items()])
+
+    # --- Reading ---
+
+    def query(self, start: int, end: int, granularity: str = "hour") -> dict:
+        """
+        Poll counts for [start, end) (Unix seconds, widened to whole buckets).
+
+        Returns {"buckets": [{"start", "requests", "logged"}], "countries":
+        {country: logged}}: buckets oldest first, empty ones included;
+        countries for the whole range (whole hours for minute granularity).
+        """
+        table, key, size = GRANULARITIES[granularity]
+        origin = WEEK_ORIGIN if granularity == "week" else 0
+        start = _floor(start, size, origin)
+        end = max(_floor(end - 1, size, origin) + size, start)
+
+        buckets = {bucket: {"start": _iso(bucket), "requests": 0, "logged": 0}
+                   for bucket in range(start, end, size)}
+        total_rows = "" if table == "minutely" else f"country = '{ALL}' AND"
+        rows = self.db.execute(f"""
+            SELECT ({key} - {origin}) / {size} * {size} + {origin} AS bucket, SUM(requests), SUM(logged)
+            FROM {table} WHERE {total_rows} {key} >= ? AND {key} < ? GROUP BY bucket
+        """, (start, end))
+        for bucket, requests, logged in rows:
+            buckets[bucket]["requests"] = requests
+            buckets[bucket]["logged"] = logged
+
+        return {"buckets": list(buckets.values()), "countries": self._countries(start, end)}
+
+    def _countries(self, start: int, end: int) -> dict:
+        """{country: logged} for [start, end), widened to whole hours: whole days from daily, the rest from hourly."""
+        start, end = _floor(start, 3600), _floor(end - 1, 3600) + 3600
+        first_day, last_day = _floor(start + 86400 - 1, 86400), _floor(end, 86400)
+        if first_day < last_day:
+            ranges = [("daily", "day", first_day, last_day),
+                      ("hourly", "hour", start, first_day), ("hourly", "hour", last_day, end)]
+        else:
+            ranges = [("hourly", "hour", start, end)]
+
+        parts = []
+        params = []
+        for table, key, lo, hi in ranges:
+            if lo < hi:
+                parts.append(f"SELECT country, logged FROM {table} "
+                             f"WHERE {key} >= ? AND {key} < ? AND country != '{ALL}'")
+                params += [lo, hi]
+        rows = self.db.execute(f"""
+            SELECT country, SUM(logged) AS n FROM ({" UNION ALL ".join(parts)})
+            GROUP BY country HAVING n > 0 ORDER BY n DESC
+        """, params)
+        return dict(rows.fetchall())
+
+    # --- Backfill ---
+
+    def backfill(self, directory: Path = ANALYTICS_DIR) -> list:
+        """Roll up every day log whose day has no rollups yet; returns the days added."""
+        known = {row[0] for row in self.db.execute("SELECT DISTINCT day FROM daily")}
+        added = []
+        for date_str, path in day_files(directory):
+            day = int(datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+            if day in known:
+                continue
+            self.add((ts, country, True) for ts, _, country in iter_entries(path))
+            added.append(date_str)
+        return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analytics rollup tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    backfill = sub.add_parser("backfill", help="Roll up day logs that aren't in rollups.db yet")
+    backfill.add_argument("--dir", type=Path, default=ANALYTICS_DIR,
+                          help="Analytics directory (default: backend/analytics)")
+    backfill.add_argument("--db", type=Path, default=ROLLUPS_DB_PATH,
+                          help="Rollup database (default: backend/rollups.db)")
+    args = parser.parse_args()
+
+    if args.command == "backfill":
+        added = RollupStore(args.db).backfill(args.dir)
+        print(f"✓ Rolled up {len(added)} days" + (f" ({added[0]} … {added[-1]})" if added else ""))
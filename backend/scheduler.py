@@ -1,47 +1,181 @@
 """
-Lightweight zero-dependency task scheduler for Docker environments.
-Runs `fetch_data.py` every 15 minutes and `analytics_report.py` daily at 03:00.
-Logs output cleanly to stdout so `docker logs` captures everything.
+Lightweight in-process task scheduler for Docker environments.
+Runs `fetch_data` every 15 minutes (at :00, :15, :30, :45) and `analytics_report`
+daily at 03:00, the analytics archive job (gzip closed days, drop expired
+salts) daily at 03:30; with ACCESS_LOG_PATH set (static /data.json mode), also
+`log_ingest` every minute.
+
+- Jobs run from warm, already-imported modules in a forked child process, so
+  a run pays neither interpreter startup nor imports, and can still be killed
+- Ticks are aligned to the wall clock and computed from the schedule, so runs
+  don't drift; the loop sleeps until the next due time instead of polling
+- A job that is still running when it's due again is skipped (no overlap), and
+  killed once it exceeds its timeout
+- Missed runs (scheduler down, host suspended) are caught up once on startup,
+  based on the last run times kept in scheduler_state.json
+- Logs one JSON line per job event to stdout so `docker logs` captures everything
 """
 
+import json
+import logging
+import multiprocessing
+import os
 import time
-import subprocess
-from datetime import datetime
-import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import analytics_log
+import analytics_report
+import fetch_data
+import log_ingest
+from snapshot import atomic_write_bytes
+
+STATE_FILE = Path(__file__).parent.resolve() / "scheduler_state.json"
+
+# How often to check on running jobs (seconds)
+POLL_INTERVAL = 1.0
+
+
+def log(job, event, **fields):
+    record = {"ts": datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "job": job, "event": event}
+    record.update(fields)
+    print(json.dumps(record), flush=True)
+
+
+# --- Schedules: (last_slot, next_slot) functions of a Unix timestamp ---
+
+def every(seconds):
+    def last_slot(ts):
+        return ts - ts % seconds
+    def next_slot(ts):
+        return last_slot(ts) + seconds
+    return last_slot, next_slot
+
+
+def daily_at(hour, minute=0):
+    def last_slot(ts):
+        dt = datetime.fromtimestamp(ts)
+        slot = dt.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if slot > dt:
+            slot -= timedelta(days=1)
+        return slot.timestamp()
+    def next_slot(ts):
+        dt = datetime.fromtimestamp(last_slot(ts)) + timedelta(days=1)
+        return dt.replace(hour=hour, minute=minute).timestamp()
+    return last_slot, next_slot
+
+
+# --- Job targets (run in the forked child) ---
+
+def run_fetch_data():
+    fetch_data.main()
+
+
+def run_analytics_report():
+    analytics_report.generate_report(max_days=90)
+
 
-def run_cmd(name, cmd):
-    print(f"\n--- [{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Executing: {name} ---", flush=True)
+def run_analytics_archive():
+    analytics_log.archive_closed_days()
+
+
+def run_log_ingest():
+    log_ingest.main()
+
+
+class Job:
+    def __init__(self, name, target, schedule, timeout):
+        self.name = name
+        self.target = target
+        self.last_slot, self.next_slot = schedule
+        self.timeout = timeout
+        self.process = None
+        self.started = None
+        self.last_run = None
+
+    def due_at(self):
+        """Next time this job should start."""
+        if self.last_run is None:
+            return 0.0  # never ran: due immediately
+        # Catch up: if the most recent slot hasn't been run yet, it's due now
+        return self.next_slot(self.last_run)
+
+    def start(self, ctx):
+        self.process = ctx.Process(target=self.target, name=self.name, daemon=True)
+        self.started = time.time()
+        self.last_run = self.started
+        self.process.start()
+        log(self.name, "started", pid=self.process.pid)
+
+    def check(self):
+        """Reap a finished process or kill one that exceeded its timeout."""
+        if self.process is None:
+            return
+        duration = round(time.time() - self.started, 3)
+        if self.process.is_alive():
+            if duration > self.timeout:
+                self.process.kill()
+                self.process.join()
+                log(self.name, "finished", status="timeout", duration_s=duration)
+                self.process = None
+            return
+        self.process.join()
+        status = "ok" if self.process.exitcode == 0 else "error"
+        log(self.name, "finished", status=status, exitcode=self.process.exitcode, duration_s=duration)
+        self.process = None
+
+    @property
+    def running(self):
+        return self.process is not None
+
+
+def load_state(jobs):
     try:
-        result = subprocess.run(cmd, shell=True, check=True, text=True, capture_output=True)
-        print(result.stdout, flush=True)
-    except subprocess.CalledProcessError as e:
-        print(f"ERROR running {name}:\n{e.stderr}", file=sys.stderr, flush=True)
+        state = json.loads(STATE_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return
+    for job in jobs:
+        job.last_run = state.get(job.name)
 
-if __name__ == "__main__":
-    print("Starting Docker Python Scheduler...", flush=True)
-    
-    last_fetch_time = 0
-    last_report_time = 0
 
-    # Run initial fetch immediately on startup
-    print("Initial fetch running now...")
-    run_cmd("fetch_data", "python backend/fetch_data.py")
-    last_fetch_time = time.time()
+def save_state(jobs):
+    state = {job.name: job.last_run for job in jobs if job.last_run is not None}
+    atomic_write_bytes(STATE_FILE, json.dumps(state).encode("utf-8"))
+
+
+def main():
+    # Jobs that log (e.g. analytics_report) print their INFO lines like the others
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    print("Starting Docker Python Scheduler...", flush=True)
+    ctx = multiprocessing.get_context("fork")
+    jobs = [
+        Job("fetch_data", run_fetch_data, every(900), timeout=300),
+        Job("analytics_report", run_analytics_report, daily_at(3), timeout=1800),
+        Job("analytics_archive", run_analytics_archive, daily_at(3, 30), timeout=1800),
+    ]
+    if os.environ.get("ACCESS_LOG_PATH"):
+        jobs.append(Job("log_ingest", run_log_ingest, every(60), timeout=600))
+    load_state(jobs)
 
     while True:
         now = time.time()
-        dt = datetime.now()
+        for job in jobs:
+            job.check()
+            if now >= job.due_at():
+                if job.running:
+                    log(job.name, "skipped", reason="previous run still in progress")
+                    # Count the slot as handled so it isn't retried every poll
+                    job.last_run = now
+                else:
+                    job.start(ctx)
+                save_state(jobs)
 
-        # Run fetch_data every 15 mins (900 seconds)
-        if now - last_fetch_time >= 900:
-            run_cmd("fetch_data", "python backend/fetch_data.py")
-            last_fetch_time = time.time()
+        # Sleep until the next job is due (or until it's time to check on running jobs)
+        wake = min(job.due_at() for job in jobs)
+        if any(job.running for job in jobs):
+            wake = min(wake, time.time() + POLL_INTERVAL)
+        time.sleep(max(0.0, wake - time.time()))
 
-        # Run analytics report daily around 03:00 (ensure it runs once per day)
-        # 86000 seconds is approx 24 hours minus a small buffer
-        if dt.hour == 3 and dt.minute < 5 and (now - last_report_time) > 86000:
-            run_cmd("analytics_report", "python backend/analytics_report.py --days 90")
-            last_report_time = time.time()
 
-        # Sleep for 60 seconds before checking again
-        time.sleep(60)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Snapshot Publishing
+===================
+Atomic publish/load helpers for small documents shared between processes
+(fetch_data.py writes data.json, analytics_server.py serves it).
+
+- Writers publish via a temp file + fsync + os.replace, so readers never see
+  a half-written file
+- Every published body gets a content-derived ETag (its version)
+- SnapshotCache keeps the current body in memory and only re-checks the file
+  every few seconds, reloading it when the version on disk changed (or, for
+  callers that must not touch the disk, only when refresh() is called)
+- file_lock() serializes regeneration of a shared file across processes
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import formatdate
+from pathlib import Path
+
+
+def content_etag(body: bytes) -> str:
+    """Return the (strong) ETag for a published body: a truncated SHA-1 of its bytes."""
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+def atomic_write_bytes(path: Path, body: bytes):
+    """Write `body` to `path` so that readers see either the old or the new file, never a mix."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def publish_json(path: Path, payload, **dump_kwargs) -> str:
+    """Atomically publish `payload` as JSON and return the ETag of the written body."""
+    body = json.dumps(payload, **dump_kwargs).encode("utf-8")
+    atomic_write_bytes(path, body)
+    return content_etag(body)
+
+
+@contextlib.contextmanager
+def file_lock(path: Path, blocking: bool = True):
+    """
+    Hold an exclusive flock on `path` for the duration of the block.
+
+    Yields True if the lock was acquired; with blocking=False it yields False
+    immediately when another process already holds it.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(f.fileno(), flags)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Snapshot:
+    """One loaded version of a published file."""
+
+    __slots__ = ("body", "etag", "mtime", "last_modified")
+
+    def __init__(self, body: bytes, mtime: float):
+        self.body = body
+        self.etag = content_etag(body)
+        self.mtime = mtime
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+
+class SnapshotCache:
+    """
+    In-memory copy of a published file.
+
+    `get()` returns the cached Snapshot and only stats the file once every
+    `check_interval` seconds; the body is re-read only when the file's
+    identity (inode, size, mtime) changed, i.e. a new version was published.
+    """
+
+    def __init__(self, path: Path, check_interval: float = 2.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._signature = None
+        self._checked_at = 0.0
+        self.reloads = 0
+
+    def get(self):
+        """Return the current Snapshot, or None if the file does not exist."""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return self._snapshot
+            self._refresh()
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def peek(self):
+        """Return the cached Snapshot without touching the file (kept current by refresh())."""
+        return self._snapshot
+
+    def refresh(self):
+        """Check the file now, e.g. from a background task; returns the current Snapshot."""
+        with self._lock:
+            self._refresh()
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._snapshot = None
+            self._signature = None
+            return
+
+        signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if signature == self._signature:
+            return
+
+        with open(self.path, "rb") as f:
+            body = f.read()
+        self._snapshot = Snapshot(body, st.st_mtime)
+        self._signature = signature
+        self.reloads += 1
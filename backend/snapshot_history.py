@@ -0,0 +1,195 @@
+"""
+Snapshot History
+================
+Fixed-size ring buffer of packed data.json snapshots, for trend charts.
+
+fetch_data.py appends every published packed array; analytics_server.py answers
+time-range queries by memory-mapping the file and slicing it (records are
+appended in timestamp order, so a range is found with a binary search on each
+of the ring's two segments). No database, no parsing.
+
+File layout (little-endian):
+    header   magic b"GRHS", u8 version, 3 reserved bytes,
+             u32 record_size, u32 capacity, u64 written       (padded to 64 bytes)
+    records  capacity x 40-byte records, slot = n % capacity:
+             i64 ts, i32 water_now, i32 water_tmr,
+             i16 precip_2h (tenths of mm), i16 wind_now, wind_1h, wind_2h,
+             wind_3h, wind_tmr, sun, fog, temp, 6 reserved bytes
+
+`written` (total records ever appended) is updated after the record itself, so
+readers only see complete records; records overwritten while a query was
+copying them are detected by re-reading `written` and dropped.
+
+Usage:
+    python snapshot_history.py            # Print the last 24 hours
+"""
+
+import mmap
+import os
+import struct
+from pathlib import Path
+
+import numpy as np
+
+from snapshot import file_lock
+
+HISTORY_PATH = Path(__file__).parent.resolve() / "history.bin"
+LOCK_PATH = Path(__file__).parent.resolve() / ".history.lock"
+
+# 90 days of snapshots at one fetch every 15 minutes
+DEFAULT_CAPACITY = 90 * 24 * 4
+
+MAGIC = b"GRHS"
+VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<4sB3xIIQ")
+_WRITTEN = struct.Struct("<Q")
+_WRITTEN_OFFSET = 16
+
+# Same order as the packed data.json array
+FIELDS = ("ts", "water_now", "water_tmr", "precip_2h", "wind_now", "wind_1h", "wind_2h",
+          "wind_3h", "wind_tmr", "sun", "fog", "temp")
+_RECORD = struct.Struct("<qii9h6x")
+RECORD_DTYPE = np.dtype({
+    "names": list(FIELDS),
+    "formats": ["<i8", "<i4", "<i4"] + ["<i2"] * 9,
+    "offsets": [0, 8, 12] + [16 + 2 * i for i in range(9)],
+    "itemsize": _RECORD.size,
+})
+PRECIP_SCALE = 10
+
+
+def _clamp16(value) -> int:
+    return max(-32768, min(32767, int(round(value))))
+
+
+def pack_record(packed: list) -> bytes:
+    """Encode one 12-element packed array as a fixed-size record."""
+    ts, water_now, water_tmr, precip = packed[:4]
+    return _RECORD.pack(
+        int(ts), int(water_now), int(water_tmr),
+        _clamp16(precip * PRECIP_SCALE),
+        *(_clamp16(v) for v in packed[4:12]),
+    )
+
+
+class SnapshotHistory:
+    """Memory-mapped ring buffer of packed snapshots."""
+
+    def __init__(self, path: Path = HISTORY_PATH, capacity: int = DEFAULT_CAPACITY):
+        self.path = Path(path)
+        self.capacity = capacity
+        self._mm = None
+        self._ino = None
+
+    # --- Writing (fetch_data.py) ---
+
+    def _create(self):
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, _RECORD.size, self.capacity, 0).ljust(HEADER_SIZE, b"\0"))
+            f.truncate(HEADER_SIZE + self.capacity * _RECORD.size)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def append(self, packed: list) -> bool:
+        """Append a packed snapshot; returns False if it isn't newer than the last one."""
+        record = pack_record(packed)
+        with file_lock(LOCK_PATH):
+            if not self.path.exists():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._create()
+            with open(self.path, "r+b") as f, mmap.mmap(f.fileno(), 0) as mm:
+                _, _, record_size, capacity, written = self._read_header(mm)
+                if written:
+                    last = HEADER_SIZE + ((written - 1) % capacity) * record_size
+                    if struct.unpack_from("<q", mm, last)[0] >= int(packed[0]):
+                        return False
+                slot = HEADER_SIZE + (written % capacity) * record_size
+                mm[slot:slot + record_size] = record
+                _WRITTEN.pack_into(mm, _WRITTEN_OFFSET, written + 1)
+                mm.flush()
+        return True
+
+    # --- Reading (analytics_server.py) ---
+
+    @staticmethod
+    def _read_header(mm):
+        magic, version, record_size, capacity, written = _HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != _RECORD.size:
+            raise ValueError("not a snapshot history file")
+        return magic, version, record_size, capacity, written
+
+    def _map(self):
+        """Read-only mapping of the file, re-opened if it was replaced."""
+        try:
+            ino = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        if self._mm is None or ino != self._ino:
+            with open(self.path, "rb") as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._ino = ino
+        return self._mm
+
+    def query(self, start: int, end: int) -> np.ndarray:
+        """Records with start <= ts <= end, oldest first (a RECORD_DTYPE array)."""
+        mm = self._map()
+        if mm is None:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        _, _, _, capacity, written = self._read_header(mm)
+        count = min(written, capacity)
+        records = np.frombuffer(mm, dtype=RECORD_DTYPE, count=capacity, offset=HEADER_SIZE)
+
+        # Logical order: the oldest segment [head:count) then [0:head)
+        head = written % capacity if written > capacity else 0
+        segments = [(head, count), (0, head)] if head else [(0, count)]
+        parts = []
+        first_index = written - count   # absolute index of the oldest record
+        for lo, hi in segments:
+            ts = records["ts"][lo:hi]
+            i = int(np.searchsorted(ts, start, side="left"))
+            j = int(np.searchsorted(ts, end, side="right"))
+            if i < j:
+                absolute = first_index + (lo - head) % capacity + i
+                parts.append((absolute, records[lo + i:lo + j].copy()))
+
+        # Drop anything the writer overwrote while we were copying, including the
+        # slot it may be writing right now (its counter isn't bumped yet)
+        _, _, _, _, now_written = self._read_header(mm)
+        oldest_valid = now_written + 1 - capacity
+        result = []
+        for absolute, part in parts:
+            skip = max(0, oldest_valid - absolute)
+            result.append(part[skip:])
+        if not result:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.concatenate(result)
+
+    def query_columns(self, start: int, end: int, fields=FIELDS) -> dict:
+        """Range query as JSON-ready columns: {field: [values]} (precip in mm)."""
+        records = self.query(start, end)
+        columns = {}
+        for name in fields:
+            values = records[name]
+            if name == "precip_2h":
+                columns[name] = [round(v / PRECIP_SCALE, 1) for v in values.tolist()]
+            else:
+                columns[name] = values.tolist()
+        return columns
+
+    def stats(self) -> dict:
+        mm = self._map()
+        if mm is None:
+            return {"records": 0, "capacity": self.capacity}
+        _, _, _, capacity, written = self._read_header(mm)
+        return {"records": min(written, capacity), "capacity": capacity, "written": written}
+
+
+if __name__ == "__main__":
+    import json
+    import time
+
+    now = int(time.time())
+    print(json.dumps(SnapshotHistory().query_columns(now - 86400, now)))
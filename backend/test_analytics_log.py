@@ -0,0 +1,129 @@
+"""
+Analytics Log Tests
+===================
+Offline checks of the day-file formats: the columnar .bin encoding and the
+incremental JSONL scan.
+
+Run with:
+    python -m pytest -q test_analytics_log.py
+"""
+
+import json
+
+import pytest
+
+import analytics_log
+from analytics_log import convert_jsonl, encode_binary, iter_entries, read_binary, scan
+
+ENTRIES = [
+    (1700000000, "device-1", "NL"),
+    (1700000005, "a3f09c1b2d4e5f60", "DE"),
+    (1700000010, "device-1", "NL"),
+    (1700003600, "ürsula-ß", "XX"),
+]
+
+
+def _line(ts, uid, country) -> bytes:
+    return (json.dumps({"ts": ts, "uid": uid, "country": country}) + "\n").encode()
+
+
+def _decode(data: bytes):
+    ts, uid_idx, country_idx, uids, countries = read_binary(data)
+    return list(zip(ts, (uids[i] for i in uid_idx), (countries[i] for i in country_idx)))
+
+
+# --- .bin ---
+
+def test_binary_round_trip():
+    data = encode_binary(ENTRIES)
+    assert _decode(data) == ENTRIES
+
+
+def test_binary_dictionaries_deduplicate():
+    ts, uid_idx, country_idx, uids, countries = read_binary(encode_binary(ENTRIES))
+    assert uids == ["device-1", "a3f09c1b2d4e5f60", "ürsula-ß"]
+    assert countries == ["NL", "DE", "XX"]
+    assert list(uid_idx) == [0, 1, 0, 2]
+    assert list(country_idx) == [0, 1, 0, 2]
+
+
+def test_binary_defaults_for_missing_fields():
+    data = encode_binary([(None, None, None), (1700000000, "", "")])
+    assert _decode(data) == [(0, "", "XX"), (1700000000, "", "XX")]
+
+
+def test_binary_empty():
+    assert _decode(encode_binary([])) == []
+
+
+def test_binary_rejects_other_data():
+    with pytest.raises(ValueError):
+        read_binary(b"\x1f\x8b" + bytes(18))
+
+
+def test_convert_jsonl(tmp_path):
+    path = tmp_path / "2024-01-01.jsonl"
+    path.write_bytes(b"".join(_line(*entry) for entry in ENTRIES))
+
+    target = convert_jsonl(path, remove_source=True)
+    assert target == tmp_path / "2024-01-01.bin"
+    assert not path.exists()
+    assert list(iter_entries(target)) == ENTRIES
+    # A .bin file is read as a whole: any offset short of its size reads it all
+    _, end = scan(target, 0)
+    assert end == target.stat().st_size
+    assert list(scan(target, end)[0]) == []
+
+
+# --- JSONL partial lines ---
+
+def test_scan_stops_before_partial_line(tmp_path):
+    path = tmp_path / "2024-01-01.jsonl"
+    complete = _line(*ENTRIES[0]) + _line(*ENTRIES[1])
+    path.write_bytes(complete + b'{"ts": 17000')
+
+    entries, end = scan(path)
+    assert list(entries) == ENTRIES[:2]
+    assert end == len(complete)
+
+
+def test_scan_resumes_at_offset(tmp_path):
+    path = tmp_path / "2024-01-01.jsonl"
+    first = _line(*ENTRIES[0])
+    second = _line(*ENTRIES[1])
+    path.write_bytes(first + second[:10])
+
+    entries, end = scan(path)
+    assert list(entries) == ENTRIES[:1]
+    assert end == len(first)
+
+    # Nothing new until the partial line is finished
+    entries, again = scan(path, end)
+    assert list(entries) == [] and again == end
+
+    with open(path, "ab") as f:
+        f.write(second[10:] + _line(*ENTRIES[2]))
+    entries, end = scan(path, end)
+    assert list(entries) == ENTRIES[1:3]
+    assert end == path.stat().st_size
+
+
+def test_scan_partial_line_longer_than_tail_block(tmp_path, monkeypatch):
+    # The search for the last newline reads the file backwards in blocks
+    monkeypatch.setattr(analytics_log, "_TAIL_BLOCK", 8)
+    path = tmp_path / "2024-01-01.jsonl"
+    complete = _line(*ENTRIES[0])
+    path.write_bytes(complete + b'{"ts": 1700000005, "uid": "still-being-wri')
+
+    entries, end = scan(path)
+    assert list(entries) == ENTRIES[:1]
+    assert end == len(complete)
+
+
+def test_scan_skips_blank_and_corrupt_lines(tmp_path):
+    path = tmp_path / "2024-01-01.jsonl"
+    path.write_bytes(_line(*ENTRIES[0]) + b"\n" + b"not json\n" + _line(*ENTRIES[1]))
+
+    entries, end = scan(path)
+    assert list(entries) == ENTRIES[:2]
+    assert end == path.stat().st_size
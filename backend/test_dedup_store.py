@@ -0,0 +1,118 @@
+"""
+DedupStore Tests
+================
+Offline checks of the dedup window and the bucket ring (time.time() is
+patched, so no test waits).
+
+Run with:
+    python -m pytest -q test_dedup_store.py
+"""
+
+import sqlite3
+
+import pytest
+
+import dedup_store
+from dedup_store import DedupStore
+
+INTERVAL = 3500
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Settable stand-in for time.time(), starting at the start of a bucket."""
+    class Clock:
+        now = 0.0
+
+    monkeypatch.setattr(dedup_store.time, "time", lambda: Clock.now)
+    return Clock
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    store = DedupStore(tmp_path / "dedup.db", interval=INTERVAL, slots=8)
+    clock.now = 1_000_000 * store.bucket_seconds
+    return store
+
+
+def _rows(store, slot):
+    with sqlite3.connect(store.path) as conn:
+        return [uid for (uid,) in conn.execute(f"SELECT uid FROM seen_{slot}")]
+
+
+def test_too_few_slots(tmp_path):
+    with pytest.raises(ValueError):
+        DedupStore(tmp_path / "dedup.db", slots=2)
+
+
+def test_duplicate_within_interval(store, clock):
+    t = clock.now
+    assert store.claim("a", t) is True
+    assert store.claim("a", t + 60) is False
+    assert store.claim("a", t + INTERVAL - 1) is False
+    assert store.claim("b", t + 60) is True
+
+
+def test_new_again_after_interval(store, clock):
+    t = clock.now
+    assert store.claim("a", t) is True
+    clock.now = t + INTERVAL
+    assert store.claim("a", t + INTERVAL) is True
+    # The new sighting restarts the window
+    assert store.claim("a", t + INTERVAL + 10) is False
+
+
+def test_claim_many_sees_its_own_batch(store, clock):
+    t = clock.now
+    assert store.claim_many([("a", t), ("b", t), ("a", t + 5)]) == [True, True, False]
+    assert store.claim_many([]) == []
+
+
+def test_duplicate_across_buckets(store, clock):
+    # Still inside the window, but the entry lives in an older slot
+    t = clock.now
+    assert store.claim("a", t) is True
+    clock.now = t + 3 * store.bucket_seconds
+    assert store.claim("a", t + 3 * store.bucket_seconds) is False
+
+
+def test_buckets_outside_window_are_ignored(store, clock):
+    t = clock.now
+    assert store.claim("a", t) is True
+    # The bucket of the first sighting has left the window: its slot isn't
+    # consulted any more, even though it hasn't been recycled yet
+    clock.now = t + (store.window_buckets + 1) * store.bucket_seconds
+    assert store.claim("a", t + 1) is True
+
+
+def test_slot_emptied_on_wraparound(store, clock):
+    t = clock.now
+    slot = int(t) // store.bucket_seconds % store.slots
+    store.claim_many([("a", t), ("b", t)])
+    assert sorted(_rows(store, slot)) == ["a", "b"]
+
+    # One full turn of the ring later the same slot belongs to a new bucket
+    clock.now = t + store.slots * store.bucket_seconds
+    assert store.claim("c", clock.now) is True
+    assert _rows(store, slot) == ["c"]
+
+
+def test_rotations_counted_once_per_bucket(store, clock):
+    t = clock.now
+    store.claim("a", t)
+    store.claim("b", t + 1)
+    clock.now = t + store.bucket_seconds
+    store.claim("c", clock.now)
+    assert store.stats()["rotations"] == 2
+
+
+def test_stats_shared_between_instances(store, clock):
+    other = DedupStore(store.path, interval=INTERVAL, slots=8)
+    t = clock.now
+    assert store.claim("a", t) is True
+    assert other.claim("a", t + 1) is False
+
+    stats = other.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+    assert stats["hit_rate"] == 0.5
+    assert stats["slots"] == 8
@@ -0,0 +1,121 @@
+"""
+HyperLogLog Tests
+=================
+Offline checks of the sketch's error bounds, merging and serialization. The
+hash is deterministic, so the estimates (and these tests) are too.
+
+Run with:
+    python -m pytest -q test_hyperloglog.py
+"""
+
+import math
+
+import pytest
+
+from hyperloglog import DEFAULT_PRECISION, HyperLogLog
+
+# Standard error of the default precision (≈1.6%)
+STD_ERROR = 1.04 / math.sqrt(1 << DEFAULT_PRECISION)
+
+
+def _sketch(values, p: int = DEFAULT_PRECISION) -> HyperLogLog:
+    sketch = HyperLogLog(p)
+    sketch.update(values)
+    return sketch
+
+
+def _uids(start: int, stop: int):
+    return (f"device-{i}" for i in range(start, stop))
+
+
+# --- Error bounds ---
+
+def test_empty():
+    assert HyperLogLog().count() == 0
+
+
+@pytest.mark.parametrize("n", [1, 10, 100, 1000])
+def test_small_cardinalities_nearly_exact(n):
+    # Linear counting: the estimate is within a couple of values of n
+    assert abs(_sketch(_uids(0, n)).count() - n) <= max(2, n * 0.01)
+
+
+@pytest.mark.parametrize("n", [5_000, 20_000, 100_000])
+def test_large_cardinalities_within_error(n):
+    estimate = _sketch(_uids(0, n)).count()
+    assert abs(estimate - n) / n < 4 * STD_ERROR
+
+
+def test_low_precision_error_grows():
+    n = 20_000
+    estimate = _sketch(_uids(0, n), p=6).count()
+    assert abs(estimate - n) / n < 4 * 1.04 / math.sqrt(1 << 6)
+
+
+def test_duplicates_not_counted():
+    once = _sketch(_uids(0, 1000))
+    twice = _sketch(list(_uids(0, 1000)) * 2)
+    assert twice.registers == once.registers
+
+
+def test_precision_range():
+    for p in (3, 17):
+        with pytest.raises(ValueError):
+            HyperLogLog(p)
+
+
+# --- Merging ---
+
+def test_merge_equals_sketch_of_union():
+    a = _sketch(_uids(0, 6000))
+    b = _sketch(_uids(4000, 10000))
+    merged = a.copy().merge(b)
+    assert merged.registers == _sketch(_uids(0, 10000)).registers
+    assert abs(merged.count() - 10000) / 10000 < 4 * STD_ERROR
+
+
+def test_merge_commutative_and_idempotent():
+    a = _sketch(_uids(0, 3000))
+    b = _sketch(_uids(2000, 5000))
+    ab = a.copy().merge(b)
+    assert ab.registers == b.copy().merge(a).registers
+    assert ab.copy().merge(b).registers == ab.registers
+
+
+def test_merge_leaves_other_untouched():
+    a = _sketch(_uids(0, 100))
+    b = _sketch(_uids(100, 200))
+    before = bytes(b.registers)
+    a.merge(b)
+    assert bytes(b.registers) == before
+
+
+def test_merge_rolling_window_of_days():
+    # 30 daily sketches with overlapping users, as in the rolling report
+    days = [_sketch(_uids(day * 500, day * 500 + 2000)) for day in range(30)]
+    window = HyperLogLog()
+    for day in days:
+        window.merge(day)
+    n = 29 * 500 + 2000
+    assert abs(window.count() - n) / n < 4 * STD_ERROR
+
+
+def test_merge_different_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+
+# --- Serialization ---
+
+def test_str_round_trip():
+    sketch = _sketch(_uids(0, 5000))
+    restored = HyperLogLog.from_str(sketch.to_str())
+    assert restored.p == sketch.p
+    assert restored.registers == sketch.registers
+    assert restored.count() == sketch.count()
+
+
+def test_from_str_rejects_wrong_size():
+    data = _sketch(_uids(0, 10), p=10).to_str()
+    with pytest.raises(ValueError):
+        HyperLogLog.from_str("12:" + data.split(":", 1)[1])
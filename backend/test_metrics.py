@@ -0,0 +1,101 @@
+"""
+Metrics Registry Tests
+======================
+Offline checks of how worker dumps are merged: dumps of exited workers are
+retired, a reused pid isn't mistaken for the worker that wrote a dump, and
+a new server starts from an empty metrics directory.
+
+Run with:
+    python -m pytest -q test_metrics.py
+"""
+
+import json
+import os
+
+import pytest
+
+import metrics
+from metrics import Registry
+
+
+def _dump(directory, instance, requests):
+    body = {"pid": int(instance.split("-")[0]), "instance": instance, "time": 0, "metrics": {
+        "requests_total": {"type": "counter", "help": "Requests", "labelnames": [],
+                           "values": [[[], requests]]},
+        "queue_depth": {"type": "gauge", "help": "Queue", "labelnames": [], "values": [[[], 7]]},
+    }}
+    (directory / f"{instance}.json").write_text(json.dumps(body))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    registry = Registry(tmp_path / "metrics", flush_interval=3600)
+    registry.counter("requests_total", "Requests").inc(amount=2)
+    return registry
+
+
+def _value(families, name):
+    values = families[name]["values"]
+    return values.get(()) if values else None
+
+
+def test_live_worker_dump_merged(registry):
+    # The parent process is alive and keeps its start time
+    ppid = os.getppid()
+    _dump(registry.directory, f"{ppid}-{metrics._start_time(ppid)}", 5)
+    families = registry.collect()
+    assert _value(families, "requests_total") == 7
+    assert _value(families, "queue_depth") == 7
+
+
+def test_exited_worker_retired(registry):
+    _dump(registry.directory, "999999999-123", 5)
+    families = registry.collect()
+    # Counters are kept in retired.json, gauges of a dead worker dropped
+    assert _value(families, "requests_total") == 7
+    assert "queue_depth" not in families
+    assert not (registry.directory / "999999999-123.json").exists()
+    assert _value(registry.collect(), "requests_total") == 7
+
+
+@pytest.mark.skipif(metrics._start_time(os.getpid()) is None, reason="needs /proc")
+def test_reused_pid_is_not_the_dump_writer(registry):
+    # Same pid as a running process, but a different start time: a dump left
+    # by an earlier process (e.g. before a container restart)
+    ppid = os.getppid()
+    _dump(registry.directory, f"{ppid}-1", 5)
+    families = registry.collect()
+    assert "queue_depth" not in families
+    assert not (registry.directory / f"{ppid}-1.json").exists()
+
+
+def test_own_dump_not_counted_twice(registry):
+    registry.flush()
+    assert _value(registry.collect(), "requests_total") == 2
+
+
+def test_new_server_clears_directory(tmp_path):
+    directory = tmp_path / "metrics"
+    directory.mkdir()
+    _dump(directory, "999999999-123", 5)
+    (directory / "retired.json").write_text(json.dumps({
+        "requests_total": {"type": "counter", "help": "Requests", "labelnames": [], "values": [[[], 100]]},
+    }))
+    (directory / "server.id").write_text("a previous server")
+
+    registry = Registry(directory, flush_interval=3600)
+    registry.counter("requests_total", "Requests").inc()
+    assert _value(registry.collect(), "requests_total") == 1
+    assert not list(directory.glob("*.json"))
+
+
+def test_same_server_keeps_directory(registry):
+    registry.collect()
+    ppid = os.getppid()
+    _dump(registry.directory, f"{ppid}-{metrics._start_time(ppid)}", 3)
+    _dump(registry.directory, "999999999-123", 5)
+
+    # A worker restarted by the same server: the live and retired dumps stay
+    other = Registry(registry.directory, flush_interval=3600)
+    other.counter("requests_total", "Requests").inc()
+    assert _value(other.collect(), "requests_total") == 1 + 3 + 5
@@ -0,0 +1,128 @@
+"""
+Payload Codec Tests
+===================
+Offline checks of the binary watch payload and of the published variants
+and their manifest.
+
+Run with:
+    python -m pytest -q test_payload_codec.py
+"""
+
+import gzip
+import json
+
+import pytest
+
+import payload_codec
+from payload_codec import (
+    FORMAT_VERSION, decode_binary, encode_binary, parse_manifest, publish_variants,
+    variant_matches, variant_paths,
+)
+from snapshot import content_etag
+
+PACKED = [1700000000, 245, -12, 1.3, 8, 9, 11, 12, 14, 7, 2, -3]
+
+
+# --- Binary layout ---
+
+def test_binary_round_trip():
+    body = encode_binary(PACKED)
+    assert len(body) == 19
+    assert body[0] == FORMAT_VERSION
+    assert decode_binary(body) == PACKED
+
+
+def test_binary_rounds_to_field_resolution():
+    packed = [1700000000.4, 245.6, -12.4, 1.26, 8.5, 9, 11, 12, 14, 7, 2, -3.2]
+    assert decode_binary(encode_binary(packed)) == [1700000000, 246, -12, 1.3, 8, 9, 11, 12, 14, 7, 2, -3]
+
+
+@pytest.mark.parametrize("index, value, decoded", [
+    (0, -5, 0),               # timestamp u32
+    (1, 40000, 32767),        # water_now i16
+    (2, -40000, -32768),      # water_tmr i16
+    (3, 9999.0, 6553.5),      # precip u16 tenths
+    (3, -1.0, 0.0),
+    (4, 300, 255),            # wind u8
+    (8, -4, 0),
+    (11, 200, 127),           # temp i8
+    (11, -200, -128),
+])
+def test_binary_clamps_out_of_range(index, value, decoded):
+    packed = list(PACKED)
+    packed[index] = value
+    assert decode_binary(encode_binary(packed))[index] == decoded
+
+
+@pytest.mark.parametrize("body", [b"", b"\x02" + bytes(18), b"[1700000000, 245]"])
+def test_binary_rejects_unknown_version(body):
+    with pytest.raises(ValueError):
+        decode_binary(body)
+
+
+# --- Manifest ---
+
+def test_manifest_matches_only_its_source():
+    manifest = ("json-etag", {"bin": "bin-etag", "gzip": "gz-etag"})
+    assert variant_matches(manifest, "json-etag", "bin", "bin-etag")
+    assert not variant_matches(manifest, "newer-json-etag", "bin", "bin-etag")
+    assert not variant_matches(manifest, "json-etag", "bin", "older-bin-etag")
+    assert not variant_matches(manifest, "json-etag", "br", "br-etag")
+    assert not variant_matches(None, "json-etag", "bin", "bin-etag")
+
+
+@pytest.mark.parametrize("body", [b"", b"not json", b"[]", b'{"source": "x"}', b'{"source": "x", "variants": 3}'])
+def test_parse_manifest_rejects_garbage(body):
+    assert parse_manifest(body) is None
+
+
+# --- Publishing ---
+
+def test_publish_variants(tmp_path):
+    json_path = tmp_path / "data.json"
+    etag = publish_variants(json_path, PACKED)
+    paths = variant_paths(json_path)
+
+    text = json_path.read_bytes()
+    assert json.loads(text) == PACKED
+    assert etag == content_etag(text)
+    assert decode_binary(paths["bin"].read_bytes()) == PACKED
+    assert gzip.decompress(paths["gzip"].read_bytes()) == text
+
+    manifest = parse_manifest(paths["manifest"].read_bytes())
+    for variant in manifest[1]:
+        body = paths[variant].read_bytes()
+        assert variant_matches(manifest, etag, variant, content_etag(body))
+
+
+def test_publish_variants_deterministic(tmp_path):
+    a = tmp_path / "a" / "data.json"
+    b = tmp_path / "b" / "data.json"
+    publish_variants(a, PACKED)
+    publish_variants(b, PACKED)
+    for variant in ("bin", "gzip", "manifest"):
+        assert variant_paths(a)[variant].read_bytes() == variant_paths(b)[variant].read_bytes()
+
+
+def test_stale_variant_does_not_match_new_json(tmp_path):
+    json_path = tmp_path / "data.json"
+    paths = variant_paths(json_path)
+    publish_variants(json_path, PACKED)
+    old_bin = paths["bin"].read_bytes()
+
+    newer = [PACKED[0] + 900] + PACKED[1:]
+    etag = publish_variants(json_path, newer)
+    manifest = parse_manifest(paths["manifest"].read_bytes())
+    assert not variant_matches(manifest, etag, "bin", content_etag(old_bin))
+    assert variant_matches(manifest, etag, "bin", content_etag(paths["bin"].read_bytes()))
+
+
+def test_unpublished_variant_removed(tmp_path, monkeypatch):
+    json_path = tmp_path / "data.json"
+    paths = variant_paths(json_path)
+    paths["br"].write_bytes(b"left over from a brotli install")
+
+    monkeypatch.setattr(payload_codec, "BROTLI_AVAILABLE", False)
+    publish_variants(json_path, PACKED)
+    assert not paths["br"].exists()
+    assert "br" not in parse_manifest(paths["manifest"].read_bytes())[1]
@@ -0,0 +1,113 @@
+"""
+Snapshot History Tests
+======================
+Offline checks of the ring buffer: appends, wraparound and time-range
+queries across the wrap point.
+
+Run with:
+    python -m pytest -q test_snapshot_history.py
+"""
+
+import pytest
+
+import snapshot_history
+from snapshot_history import FIELDS, SnapshotHistory
+
+CAPACITY = 8
+T0 = 1_700_000_000
+STEP = 900
+
+
+def _packed(i: int) -> list:
+    """Packed array of the i-th snapshot (every field derived from i)."""
+    return [T0 + i * STEP, 1000 + i, 1100 + i, i / 10, i, i + 1, i + 2, i + 3, i + 4, i % 2, 0, 15 - i]
+
+
+def _ts(i: int) -> int:
+    return T0 + i * STEP
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot_history, "LOCK_PATH", tmp_path / ".history.lock")
+    return SnapshotHistory(tmp_path / "history.bin", capacity=CAPACITY)
+
+
+def _fill(history, n: int):
+    for i in range(n):
+        assert history.append(_packed(i))
+
+
+def _indices(records) -> list:
+    return [(int(ts) - T0) // STEP for ts in records["ts"]]
+
+
+def test_missing_file(history):
+    assert len(history.query(0, 2**40)) == 0
+    assert history.stats() == {"records": 0, "capacity": CAPACITY}
+
+
+def test_record_round_trip(history):
+    history.append(_packed(3))
+    columns = history.query_columns(0, 2**40)
+    assert [columns[name][0] for name in FIELDS] == _packed(3)
+
+
+def test_values_clamped_to_int16(history):
+    history.append([T0, 0, 0, 5000.0, 40000, -40000, 0, 0, 0, 0, 0, 0])
+    columns = history.query_columns(T0, T0)
+    assert columns["precip_2h"] == [3276.7]
+    assert (columns["wind_now"], columns["wind_1h"]) == ([32767], [-32768])
+
+
+def test_rejects_out_of_order(history):
+    _fill(history, 3)
+    assert history.append(_packed(2)) is False
+    assert history.append(_packed(1)) is False
+    assert history.stats()["written"] == 3
+
+
+def test_range_before_wraparound(history):
+    _fill(history, 5)
+    assert _indices(history.query(0, 2**40)) == [0, 1, 2, 3, 4]
+    assert _indices(history.query(_ts(1), _ts(3))) == [1, 2, 3]
+    # Bounds between records
+    assert _indices(history.query(_ts(1) + 1, _ts(3) - 1)) == [2]
+    assert _indices(history.query(_ts(5), _ts(9))) == []
+
+
+def test_wraparound_keeps_newest(history):
+    _fill(history, 20)
+    assert history.stats() == {"records": CAPACITY, "capacity": CAPACITY, "written": 20}
+    # Records 12..19 are in the ring; the oldest slot is the next one to be
+    # written, so a query never returns it
+    assert _indices(history.query(0, 2**40)) == list(range(13, 20))
+
+
+@pytest.mark.parametrize("lo, hi", [(13, 15), (15, 17), (16, 19), (14, 18), (17, 17), (13, 19)])
+def test_range_across_wrap_point(history, lo, hi):
+    # 20 appends into 8 slots: records 16..19 sit in slots 0..3, 12..15 in slots 4..7
+    _fill(history, 20)
+    assert _indices(history.query(_ts(lo), _ts(hi))) == list(range(lo, hi + 1))
+
+
+def test_range_outside_ring(history):
+    _fill(history, 20)
+    assert _indices(history.query(_ts(0), _ts(12))) == []
+    assert _indices(history.query(_ts(10), _ts(14))) == [13, 14]
+    assert _indices(history.query(_ts(20), _ts(30))) == []
+
+
+def test_exactly_full_ring(history):
+    _fill(history, CAPACITY)
+    assert _indices(history.query(0, 2**40)) == list(range(1, CAPACITY))
+    history.append(_packed(CAPACITY))
+    assert _indices(history.query(0, 2**40)) == list(range(2, CAPACITY + 1))
+
+
+def test_reader_sees_later_appends(history):
+    _fill(history, 3)
+    reader = SnapshotHistory(history.path, capacity=CAPACITY)
+    assert _indices(reader.query(0, 2**40)) == [0, 1, 2]
+    history.append(_packed(3))
+    assert _indices(reader.query(0, 2**40)) == [0, 1, 2, 3]
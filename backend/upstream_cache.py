@@ -0,0 +1,148 @@
+"""
+Upstream Response Cache
+=======================
+On-disk conditional-request cache for the RWS and Open-Meteo downloads.
+
+Per upstream URL it keeps the last body plus its ETag / Last-Modified, and the
+values computed from that body. Each cycle sends If-None-Match /
+If-Modified-Since; on a 304, or a 200 with a byte-identical body, the stored
+body is reused, and if the caller's context (e.g. the forecast hour) is also
+unchanged the previously computed values are returned without parsing at all.
+
+Files (in CACHE_DIR, one pair per URL):
+- <key>.body   last response body (UTF-8 text)
+- <key>.json   validators, body hash, computed result and hit counters
+"""
+
+import hashlib
+import json
+import time
+from pathlib import Path
+
+from snapshot import atomic_write_bytes
+
+CACHE_DIR = Path(__file__).parent.resolve() / "upstream_cache"
+
+COUNTERS = ("requests", "not_modified", "identical", "changed", "parses_skipped", "bytes_saved")
+
+
+class UpstreamResponse:
+    """Body of one upstream fetch, plus access to the values computed from it."""
+
+    def __init__(self, cache, url, meta, text, status):
+        self._cache = cache
+        self.url = url
+        self.meta = meta
+        self.text = text
+        self.status = status     # "not_modified", "identical" or "changed"
+
+    @property
+    def changed(self) -> bool:
+        return self.status == "changed"
+
+    def reuse(self, context):
+        """Previously computed result for this body and `context`, or None."""
+        if self.changed or self.meta.get("context") != context or "result" not in self.meta:
+            return None
+        self.meta["counters"]["parses_skipped"] += 1
+        self._cache.save_meta(self.url, self.meta)
+        return self.meta["result"]
+
+    def save_result(self, context, result):
+        """Remember the values computed from this body (must be JSON-serializable)."""
+        self.meta["context"] = context
+        self.meta["result"] = result
+        self._cache.save_meta(self.url, self.meta)
+
+
+class UpstreamCache:
+    """Conditional GETs with validators, bodies and results persisted in `cache_dir`."""
+
+    def __init__(self, cache_dir: Path, http_get):
+        self.cache_dir = Path(cache_dir)
+        self.http_get = http_get   # http_get(url, deadline, headers=None) -> requests.Response
+
+    @staticmethod
+    def _key(url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+    def _paths(self, url):
+        key = self._key(url)
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.body"
+
+    def load_meta(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {}
+        if not body_path.exists():
+            # Validators are useless without the body they describe
+            meta = {"counters": meta.get("counters", {})}
+        meta["url"] = url
+        counters = meta.setdefault("counters", {})
+        for name in COUNTERS:
+            counters.setdefault(name, 0)
+        return meta
+
+    def save_meta(self, url, meta):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        meta_path, _ = self._paths(url)
+        atomic_write_bytes(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def get(self, url, deadline, headers=None) -> UpstreamResponse:
+        """Conditional GET of `url`; raises like http_get on failure."""
+        meta = self.load_meta(url)
+        counters = meta["counters"]
+        _, body_path = self._paths(url)
+
+        request_headers = dict(headers or {})
+        if meta.get("etag"):
+            request_headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            request_headers["If-Modified-Since"] = meta["last_modified"]
+
+        r = self.http_get(url, deadline, headers=request_headers)
+        counters["requests"] += 1
+        meta["checked"] = int(time.time())
+
+        if r.status_code == 304 and "sha1" in meta:
+            text = body_path.read_text(encoding="utf-8")
+            counters["not_modified"] += 1
+            counters["bytes_saved"] += len(text.encode("utf-8"))
+            status = "not_modified"
+        else:
+            text = r.text
+            body = text.encode("utf-8")
+            digest = hashlib.sha1(body).hexdigest()
+            status = "changed" if digest != meta.get("sha1") else "identical"
+            counters[status] += 1
+            if status == "changed":
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                atomic_write_bytes(body_path, body)
+                meta["sha1"] = digest
+                meta.pop("context", None)
+                meta.pop("result", None)
+            meta["etag"] = r.headers.get("ETag")
+            meta["last_modified"] = r.headers.get("Last-Modified")
+
+        self.save_meta(url, meta)
+        return UpstreamResponse(self, url, meta, text, status)
+
+    def stats(self) -> dict:
+        """Counters for every cached URL: {url: {requests, not_modified, ...}}."""
+        result = {}
+        for meta_path in sorted(self.cache_dir.glob("*.json")):
+            try:
+                meta = json.loads(meta_path.read_text())
+            except (OSError, json.JSONDecodeError):
+                continue
+            counters = meta.get("counters", {})
+            requests_made = counters.get("requests", 0)
+            reused = counters.get("not_modified", 0) + counters.get("identical", 0)
+            result[meta.get("url", meta_path.stem)] = dict(
+                counters,
+                hit_rate=round(reused / requests_made, 4) if requests_made else 0.0,
+                checked=meta.get("checked"),
+            )
+        return result